@@ -0,0 +1,491 @@
+"""
+Mock LLM Provider Server
+Local stand-in for the OpenAI, Anthropic and Gemini APIs, for offline load tests
+
+Serves the chat-completions, messages and generateContent wire formats (plain
+and streamed) with configurable latency distributions, token rates and 429/5xx
+injection, and can record real provider responses to a JSONL file and replay
+them later. Requests carrying an output schema (response_format, a forced tool,
+responseSchema) get output in that shape; --rate-malformed drops a required
+field from a fraction of them. Repeated prompt prefixes are reported as cache
+reads once they reach the provider's minimum cacheable length.
+
+Usage:
+    python mock_llm_server.py --port 8900 --latency lognormal:0.8,0.5 --rate-429 0.05
+    python mock_llm_server.py --provider anthropic:latency=fixed:3 --provider gemini:rate_5xx=0.2
+    python mock_llm_server.py --record responses.jsonl   # forward to the real APIs and save
+    python mock_llm_server.py --replay responses.jsonl   # serve saved responses
+
+Point the backend at it with LLM_BASE_URL=http://localhost:8900 (or the
+per-provider OPENAI_BASE_URL / ANTHROPIC_BASE_URL / GEMINI_BASE_URL) and any
+non-empty API keys.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from collections import Counter
+from typing import Optional, Dict, Any, List, Tuple
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+
+UPSTREAM_URLS = {
+    'openai': 'https://api.openai.com',
+    'anthropic': 'https://api.anthropic.com',
+    'gemini': 'https://generativelanguage.googleapis.com',
+}
+# Headers passed through to the real API when recording
+FORWARD_HEADERS = ('authorization', 'x-api-key', 'anthropic-version', 'anthropic-beta', 'x-goog-api-key')
+
+SAMPLE_LINES = [
+    '山高水长，风起云涌，',
+    '人生如梦，一樽还酹江月。',
+    '春风又绿江南岸，明月何时照我还。',
+    '江湖夜雨十年灯，桃李春风一杯酒。',
+    '世事洞明皆学问，人情练达即文章。',
+]
+
+class LatencyModel:
+    """
+    Latency distribution parsed from a spec string (seconds):
+    fixed:S, uniform:LO,HI, normal:MEAN,STD, lognormal:MEDIAN,SIGMA
+    """
+
+    def __init__(self, spec: str):
+        kind, _, args = spec.partition(':')
+        self.kind = kind
+        self.args = [float(a) for a in args.split(',') if a]
+        if kind not in ('fixed', 'uniform', 'normal', 'lognormal'):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == 'fixed':
+            return self.args[0]
+        if self.kind == 'uniform':
+            return rng.uniform(*self.args)
+        if self.kind == 'normal':
+            return max(0.0, rng.gauss(*self.args))
+        median, sigma = self.args
+        return rng.lognormvariate(0.0, sigma) * median
+
+class Profile:
+    """Behaviour of one mocked provider"""
+
+    def __init__(self, latency: str, tokens_per_second: float, rate_429: float, rate_5xx: float,
+                 completion_tokens: int, rate_malformed: float = 0.0):
+        self.latency = LatencyModel(latency)
+        self.tokens_per_second = tokens_per_second
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.completion_tokens = completion_tokens
+        self.rate_malformed = rate_malformed
+
+    def set(self, key: str, value: str):
+        if key == 'latency':
+            self.latency = LatencyModel(value)
+        elif key in ('tokens_per_second', 'rate_429', 'rate_5xx', 'rate_malformed'):
+            setattr(self, key, float(value))
+        elif key == 'completion_tokens':
+            self.completion_tokens = int(value)
+        else:
+            raise ValueError(f"Unknown profile setting: {key}")
+
+def request_key(provider: str, path: str, body: Dict[str, Any]) -> str:
+    """Same canonical request hash as the backend's LLM response cache"""
+    canonical = json.dumps({'provider': provider, 'url': path, 'body': body},
+                           sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+# -------- Synthetic responses --------
+
+def _prompt_text(provider: str, body: Dict[str, Any]) -> str:
+    if provider == 'gemini':
+        return ''.join(p.get('text', '') for c in body.get('contents', []) for p in c.get('parts', []))
+    system = body.get('system') or ''
+    parts = [''.join(block.get('text', '') for block in system) if isinstance(system, list) else system]
+    for message in body.get('messages', []):
+        content = message.get('content', '')
+        parts.append(content if isinstance(content, str) else json.dumps(content, ensure_ascii=False))
+    return ''.join(p if isinstance(p, str) else json.dumps(p, ensure_ascii=False) for p in parts)
+
+def output_schema(provider: str, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The JSON schema a request constrains its output to, if any"""
+    if provider == 'openai':
+        return ((body.get('response_format') or {}).get('json_schema') or {}).get('schema')
+    if provider == 'anthropic':
+        forced = (body.get('tool_choice') or {}).get('name')
+        return next((t.get('input_schema') for t in body.get('tools') or [] if t.get('name') == forced), None)
+    return (body.get('generationConfig') or {}).get('responseSchema')
+
+def _from_schema(schema: Dict[str, Any], text: str, rng: random.Random) -> Any:
+    """A value for a (JSON or Gemini-style) schema, long text going to 'content'"""
+    if str(schema.get('type', '')).lower() != 'object':
+        return rng.choice(SAMPLE_LINES)
+    value = {}
+    for name, prop in (schema.get('properties') or {}).items():
+        if name == 'content':
+            value[name] = text
+        elif name == 'title':
+            value[name] = text[:8]
+        elif name == 'emotion':
+            value[name] = rng.choice(['开心', '思考', '惊讶', '平静'])
+        else:
+            value[name] = _from_schema(prop, text, rng)
+    return value
+
+def _generated_output(prompt: str, schema: Optional[Dict[str, Any]], tokens: int, rng: random.Random,
+                      malformed: bool = False) -> Dict[str, Any]:
+    """Output in the schema's shape, or the shape the task asks for (a chat prompt quotes the conversation)"""
+    text = ''
+    while len(text) < tokens:
+        text += rng.choice(SAMPLE_LINES)
+    text = text[:tokens]
+    if schema:
+        output = _from_schema(schema, text, rng)
+    elif '对话历史' in prompt:
+        output = {'content': text, 'emotion': rng.choice(['开心', '思考', '惊讶', '平静'])}
+    else:
+        output = {'title': text[:8], 'content': text, 'metadata': {'mock': True}}
+    if malformed:
+        output.pop('content', None)
+    return output
+
+# Shortest prefix each provider caches; shorter ones are silently not cached
+CACHE_MIN_TOKENS = {'openai': 1024, 'anthropic': 1024}
+CACHE_MIN_TOKENS_HAIKU = 2048
+
+def cache_min_tokens(provider: str, model: str) -> Optional[int]:
+    """Minimum cacheable prefix for a model, None where the mock does not cache"""
+    if provider == 'anthropic' and 'haiku' in model:
+        return CACHE_MIN_TOKENS_HAIKU
+    return CACHE_MIN_TOKENS.get(provider)
+
+def estimated_tokens(text: str) -> int:
+    """About one token per CJK character and one per four other characters"""
+    cjk = sum(1 for ch in text if ch >= '\u2e80')
+    return cjk + (len(text) - cjk + 3) // 4
+
+def _prompt_segments(provider: str, body: Dict[str, Any]) -> List[Tuple[str, bool]]:
+    """(text, cache breakpoint after it) for every part of the prompt, in the provider's prefix order"""
+    dump = lambda value: value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, sort_keys=True)
+    if provider == 'gemini':
+        schema = (body.get('generationConfig') or {}).get('responseSchema')
+        return [(_prompt_text(provider, body), False)] + ([(dump(schema), False)] if schema else [])
+    if provider == 'openai':
+        segments = [(dump(body['response_format']), False)] if body.get('response_format') else []
+        return segments + [(dump(m.get('content', '')), False) for m in body.get('messages', [])]
+    segments = [(dump(tool), bool(tool.get('cache_control'))) for tool in body.get('tools') or []]
+    system = body.get('system') or ''
+    if isinstance(system, list):
+        segments += [(block.get('text', ''), bool(block.get('cache_control'))) for block in system]
+    else:
+        segments.append((system, False))
+    return segments + [(dump(m.get('content', '')), False) for m in body.get('messages', [])]
+
+def count_prompt_tokens(provider: str, body: Dict[str, Any]) -> int:
+    """Input tokens of a request, tool and schema definitions included"""
+    return estimated_tokens(''.join(text for text, _ in _prompt_segments(provider, body)))
+
+def cacheable_prefix(provider: str, body: Dict[str, Any]) -> str:
+    """
+    Prompt prefix the provider would cache: OpenAI's response_format and system
+    message, or Anthropic's tools and system blocks up to the last breakpoint
+    """
+    segments = _prompt_segments(provider, body)
+    if provider == 'openai':
+        messages = body.get('messages') or [{}]
+        if messages[0].get('role') != 'system':
+            return ''
+        return ''.join(text for text, _ in segments[:len(segments) - len(messages) + 1])
+    if provider == 'anthropic':
+        marked = [i for i, (_, breakpoint) in enumerate(segments) if breakpoint]
+        return ''.join(text for text, _ in segments[:marked[-1] + 1]) if marked else ''
+    return ''
+
+def synthetic_response(provider: str, model: str, body: Dict[str, Any], profile: Profile, rng: random.Random,
+                       cached_tokens: int = 0, cache_write_tokens: int = 0, malformed: bool = False):
+    """(response body, completion tokens) in the provider's wire format"""
+    prompt = _prompt_text(provider, body)
+    schema = output_schema(provider, body)
+    output = _generated_output(prompt, schema, profile.completion_tokens, rng, malformed)
+    content = json.dumps(output, ensure_ascii=False)
+    prompt_tokens, completion_tokens = count_prompt_tokens(provider, body), len(content)
+    if provider == 'openai':
+        return {
+            'id': f'chatcmpl-mock{rng.getrandbits(32):x}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens,
+                      'prompt_tokens_details': {'cached_tokens': cached_tokens}},
+        }, completion_tokens
+    if provider == 'anthropic':
+        if schema:
+            block = {'type': 'tool_use', 'id': f'toolu_mock{rng.getrandbits(32):x}',
+                     'name': body['tool_choice']['name'], 'input': output}
+        else:
+            block = {'type': 'text', 'text': content}
+        return {
+            'id': f'msg_mock{rng.getrandbits(32):x}',
+            'type': 'message',
+            'role': 'assistant',
+            'model': model,
+            'content': [block],
+            'stop_reason': 'tool_use' if schema else 'end_turn',
+            'usage': {'input_tokens': prompt_tokens - cached_tokens - cache_write_tokens,
+                      'cache_read_input_tokens': cached_tokens, 'cache_creation_input_tokens': cache_write_tokens,
+                      'output_tokens': completion_tokens},
+        }, completion_tokens
+    return {
+        'candidates': [{'content': {'role': 'model', 'parts': [{'text': content}]}, 'finishReason': 'STOP'}],
+        'usageMetadata': {'promptTokenCount': prompt_tokens, 'candidatesTokenCount': completion_tokens,
+                          'totalTokenCount': prompt_tokens + completion_tokens},
+    }, completion_tokens
+
+def _sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ''
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def synthetic_stream(provider: str, model: str, response: Dict[str, Any], profile: Profile,
+                           chunk_chars: int = 8):
+    """Replay a synthetic response as the provider's SSE events at the profile's token rate"""
+    if provider == 'openai':
+        content, usage = response['choices'][0]['message']['content'], response['usage']
+    elif provider == 'anthropic':
+        block = response['content'][0]
+        content = json.dumps(block['input'], ensure_ascii=False) if block['type'] == 'tool_use' else block['text']
+        usage = response['usage']
+    else:
+        content, usage = response['candidates'][0]['content']['parts'][0]['text'], response['usageMetadata']
+    pause = chunk_chars / profile.tokens_per_second if profile.tokens_per_second > 0 else 0
+
+    if provider == 'anthropic':
+        yield _sse({'type': 'message_start', 'message': {'id': response['id'], 'model': model, 'role': 'assistant',
+                    'usage': {**usage, 'output_tokens': 1}}}, 'message_start')
+        block = response['content'][0]
+        if block['type'] == 'tool_use':
+            start = {'type': 'tool_use', 'id': block['id'], 'name': block['name'], 'input': {}}
+        else:
+            start = {'type': 'text', 'text': ''}
+        yield _sse({'type': 'content_block_start', 'index': 0, 'content_block': start}, 'content_block_start')
+    for i in range(0, len(content), chunk_chars):
+        piece = content[i:i + chunk_chars]
+        if provider == 'openai':
+            yield _sse({'id': response['id'], 'object': 'chat.completion.chunk', 'model': model,
+                        'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]})
+        elif provider == 'anthropic':
+            delta = ({'type': 'input_json_delta', 'partial_json': piece} if block['type'] == 'tool_use'
+                     else {'type': 'text_delta', 'text': piece})
+            yield _sse({'type': 'content_block_delta', 'index': 0, 'delta': delta}, 'content_block_delta')
+        else:
+            yield _sse({'candidates': [{'content': {'role': 'model', 'parts': [{'text': piece}]}}],
+                        'usageMetadata': {**usage, 'candidatesTokenCount': i + len(piece)}})
+        if pause:
+            await asyncio.sleep(pause)
+    if provider == 'openai':
+        yield _sse({'id': response['id'], 'object': 'chat.completion.chunk', 'model': model, 'choices': [],
+                    'usage': usage})
+        yield 'data: [DONE]\n\n'
+    elif provider == 'anthropic':
+        yield _sse({'type': 'content_block_stop', 'index': 0}, 'content_block_stop')
+        yield _sse({'type': 'message_delta', 'delta': {'stop_reason': response['stop_reason']},
+                    'usage': {'output_tokens': usage['output_tokens']}}, 'message_delta')
+        yield _sse({'type': 'message_stop'}, 'message_stop')
+
+def error_response(provider: str, status: int, retry_after: Optional[float] = None) -> JSONResponse:
+    if provider == 'anthropic':
+        kind = 'rate_limit_error' if status == 429 else 'overloaded_error' if status == 529 else 'api_error'
+        body = {'type': 'error', 'error': {'type': kind, 'message': f'mock {status}'}}
+    else:
+        body = {'error': {'code': status, 'message': f'mock {status}'}}
+    headers = {'retry-after': f'{retry_after:g}'} if retry_after is not None else None
+    return JSONResponse(body, status_code=status, headers=headers)
+
+# -------- Server --------
+
+class MockLLMServer:
+    """Request handling shared by the three provider routes"""
+
+    def __init__(self, profiles: Dict[str, Profile], seed: Optional[int] = None,
+                 record_path: Optional[str] = None, replay_path: Optional[str] = None, strict: bool = False):
+        self.profiles = profiles
+        self.rng = random.Random(seed)
+        self.record_path = record_path
+        self.strict = strict
+        self.recorded: Dict[str, Dict[str, Any]] = {}
+        self.counts: Counter = Counter()
+        self.cached_prefixes: set = set()  # simulated provider prompt cache
+        self._upstream: Optional[httpx.AsyncClient] = None
+        if replay_path:
+            with open(replay_path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.recorded[entry['key']] = entry
+            print(f"[MockLLM] Loaded {len(self.recorded)} recorded responses from {replay_path}")
+
+    async def handle(self, provider: str, model: str, request: Request, stream: bool = False):
+        body = await request.json()
+        path = request.url.path + (f'?{request.url.query}' if request.url.query else '')
+        key = request_key(provider, path, body)
+
+        if self.record_path:
+            return await self._forward(provider, path, key, body, request)
+
+        entry = self.recorded.get(key)
+        if entry is not None:
+            self.counts[(provider, 'replayed')] += 1
+            if 'stream' in entry:
+                return Response(entry['stream'], status_code=entry['status'], media_type='text/event-stream')
+            return JSONResponse(entry['response'], status_code=entry['status'])
+        if self.recorded and self.strict:
+            self.counts[(provider, 'replay_miss')] += 1
+            return error_response(provider, 404)
+
+        profile = self.profiles[provider]
+        latency = profile.latency.sample(self.rng)
+        roll = self.rng.random()
+        if roll < profile.rate_429:
+            await asyncio.sleep(min(latency, 0.05))
+            self.counts[(provider, '429')] += 1
+            return error_response(provider, 429, retry_after=round(self.rng.uniform(0.5, 2.0), 1))
+        if roll < profile.rate_429 + profile.rate_5xx:
+            status = self.rng.choice([500, 502, 503, 529 if provider == 'anthropic' else 503])
+            await asyncio.sleep(latency)
+            self.counts[(provider, str(status))] += 1
+            return error_response(provider, status)
+
+        # Prefixes seen before are reported as cached, if they reach the provider's minimum
+        prefix = cacheable_prefix(provider, body)
+        prefix_tokens = estimated_tokens(prefix)
+        minimum = cache_min_tokens(provider, model)
+        cached = cache_write = 0
+        if prefix and minimum is not None and prefix_tokens >= minimum:
+            prefix_key = (provider, model, hashlib.sha256(prefix.encode('utf-8')).hexdigest())
+            if prefix_key in self.cached_prefixes:
+                cached = prefix_tokens
+            else:
+                self.cached_prefixes.add(prefix_key)
+                cache_write = prefix_tokens if provider == 'anthropic' else 0
+        elif prefix:
+            self.counts[(provider, 'prefix_below_cache_minimum')] += 1
+        malformed = self.rng.random() < profile.rate_malformed
+        if malformed:
+            self.counts[(provider, 'malformed')] += 1
+        response, completion_tokens = synthetic_response(provider, model, body, profile, self.rng, cached, cache_write,
+                                                         malformed)
+        if stream:
+            await asyncio.sleep(latency)
+            self.counts[(provider, 'streamed')] += 1
+            return StreamingResponse(synthetic_stream(provider, model, response, profile),
+                                     media_type='text/event-stream')
+        # Time to first token, then generation at the profile's token rate
+        if profile.tokens_per_second > 0:
+            latency += completion_tokens / profile.tokens_per_second
+        await asyncio.sleep(latency)
+        self.counts[(provider, '200')] += 1
+        return response
+
+    async def _forward(self, provider: str, path: str, key: str, body: Dict[str, Any], request: Request):
+        """Proxy to the real API and append the exchange to the record file"""
+        if self._upstream is None:
+            self._upstream = httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=10.0))
+        headers = {h: request.headers[h] for h in FORWARD_HEADERS if h in request.headers}
+        upstream = await self._upstream.post(UPSTREAM_URLS[provider] + path, headers=headers, json=body)
+        entry = {'key': key, 'provider': provider, 'path': path, 'status': upstream.status_code}
+        if 'text/event-stream' in upstream.headers.get('content-type', ''):
+            # Streams are recorded whole and replayed without pacing
+            entry['stream'] = upstream.text
+        else:
+            try:
+                entry['response'] = upstream.json()
+            except ValueError:
+                entry['response'] = {'error': upstream.text}
+        with open(self.record_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.counts[(provider, 'recorded')] += 1
+        headers = {'retry-after': upstream.headers['retry-after']} if 'retry-after' in upstream.headers else None
+        if 'stream' in entry:
+            return Response(entry['stream'], status_code=upstream.status_code, media_type='text/event-stream')
+        return JSONResponse(entry['response'], status_code=upstream.status_code, headers=headers)
+
+    def stats(self) -> Dict[str, Any]:
+        by_provider: Dict[str, Dict[str, int]] = {}
+        for (provider, outcome), count in self.counts.items():
+            by_provider.setdefault(provider, {})[outcome] = count
+        return {'recorded_responses': len(self.recorded), 'requests': by_provider}
+
+def create_app(server: MockLLMServer) -> FastAPI:
+    app = FastAPI(title="Mock LLM Provider")
+
+    @app.post("/v1/chat/completions")
+    async def openai_chat(request: Request):
+        body = await request.json()
+        return await server.handle('openai', body.get('model', ''), request, stream=bool(body.get('stream')))
+
+    @app.post("/v1/messages")
+    async def anthropic_messages(request: Request):
+        body = await request.json()
+        return await server.handle('anthropic', body.get('model', ''), request, stream=bool(body.get('stream')))
+
+    @app.post("/v1beta/models/{model_action}")
+    async def gemini_generate(model_action: str, request: Request):
+        model, _, action = model_action.partition(':')
+        if action not in ('generateContent', 'streamGenerateContent'):
+            return error_response('gemini', 404)
+        return await server.handle('gemini', model, request, stream=action == 'streamGenerateContent')
+
+    @app.get("/stats")
+    async def stats():
+        return server.stats()
+
+    return app
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Mock OpenAI/Anthropic/Gemini server for offline load tests")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.getenv('MOCK_LLM_PORT', '8900')))
+    parser.add_argument('--latency', default='lognormal:0.8,0.5',
+                        help='time to first token: fixed:S | uniform:LO,HI | normal:MEAN,STD | lognormal:MEDIAN,SIGMA')
+    parser.add_argument('--tokens-per-second', type=float, default=80.0, help='generation speed, 0 for none')
+    parser.add_argument('--completion-tokens', type=int, default=300, help='length of generated content')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='fraction of requests rate limited')
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help='fraction of requests failing with 5xx')
+    parser.add_argument('--rate-malformed', type=float, default=0.0,
+                        help='fraction of responses missing a required output field')
+    parser.add_argument('--provider', action='append', default=[], metavar='NAME:KEY=VALUE',
+                        help='per-provider override, e.g. anthropic:latency=fixed:3 or gemini:rate_5xx=0.2')
+    parser.add_argument('--seed', type=int, default=None, help='seed for reproducible latency and errors')
+    parser.add_argument('--record', metavar='FILE', help='forward to the real APIs and append responses to FILE')
+    parser.add_argument('--replay', metavar='FILE', help='serve responses recorded in FILE')
+    parser.add_argument('--strict', action='store_true', help='with --replay, 404 on unrecorded requests')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    profiles = {
+        provider: Profile(args.latency, args.tokens_per_second, args.rate_429, args.rate_5xx, args.completion_tokens,
+                          args.rate_malformed)
+        for provider in UPSTREAM_URLS
+    }
+    for override in args.provider:
+        provider, _, setting = override.partition(':')
+        key, _, value = setting.partition('=')
+        profiles[provider].set(key, value)
+
+    server = MockLLMServer(profiles, seed=args.seed, record_path=args.record,
+                           replay_path=args.replay, strict=args.strict)
+    print(f"[MockLLM] Listening on http://{args.host}:{args.port} "
+          f"({'recording' if args.record else 'replay' if args.replay else 'synthetic'} mode)")
+    uvicorn.run(create_app(server), host=args.host, port=args.port, log_level='warning')
+
+if __name__ == '__main__':
+    main()
@@ -4,21 +4,67 @@ FastAPI-based REST API for AgentCircle platform
 """
 import os
 import sys
+import hmac
+import json
+import zlib
 import uuid
+import asyncio
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 
-from fastapi import FastAPI, HTTPException, Query, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Query, Header, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+import httpx
 
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from services.storage_service import storage
+from services.storage_service import storage, ROLE_LIST_FIELDS, POST_LIST_FIELDS, AUTHOR_FIELDS, TABLE_COLUMNS
 from services.llm_service import llm_service
+from services.event_bus import event_bus, room_topic, ROOMS_TOPIC
+from services.event_relay import event_relay
+from services.single_flight import single_flight, flight_key
+from services.admission import admission, AdmissionMiddleware
+from services.job_service import job_manager
+from services.metrics import MetricsMiddleware, StatsCollector, render_metrics, REGISTRY
+from services.profiler import profiler, ProfilerMiddleware, PROFILE_INTERVAL_MS
+from services.query_stats import query_stats
+from services.leader_election import leader_elector, LEADER_ELECTION_ENABLED
+from services.rate_limiter import rate_limits
+from services.llm_cache import llm_cache
+from services.llm_router import llm_router
+from services.usage_tracker import usage_tracker, ROLLUP_DIMENSIONS
+from services.prompt_compiler import prompt_compiler
+from services.memory_service import memory_service
+from services.post_dedup import post_dedup
 from tasks.scheduler import scheduler
 
+SSE_KEEPALIVE_SECONDS = float(os.getenv('SSE_KEEPALIVE_SECONDS', '15'))
+SSE_RESUME_LIMIT = int(os.getenv('SSE_RESUME_LIMIT', '500'))  # max messages replayed from storage on reconnect
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', '20'))
+EXPORT_TABLES = [t for t in os.getenv('EXPORT_TABLES', ','.join(TABLE_COLUMNS)).split(',') if t in TABLE_COLUMNS]
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')  # admin profiling routes require it as X-Admin-Token
+
+def _admin_token_valid(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token or '', ADMIN_TOKEN)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Dependency checking X-Admin-Token; closed when no ADMIN_TOKEN is configured"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin routes are disabled (ADMIN_TOKEN not set)")
+    if not _admin_token_valid(x_admin_token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+def _is_admin_scope(scope) -> bool:
+    """Header-triggered profiling is only honored with a configured, matching token"""
+    for key, value in scope.get('headers', []):
+        if key == b'x-admin-token':
+            return _admin_token_valid(value.decode('latin-1'))
+    return False
+
 # Initialize FastAPI app
 app = FastAPI(
     title="AgentCircle API",
@@ -26,6 +72,12 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Profiling hook (innermost, so only handler work is attributed to a request)
+app.add_middleware(ProfilerMiddleware, profiler=profiler, is_admin=_is_admin_scope)
+
+# Admission control (added before CORS so CORS headers wrap 503 responses too)
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -35,6 +87,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency metrics (outermost, so admission wait time is included)
+app.add_middleware(MetricsMiddleware)
+REGISTRY.register(StatsCollector(admission.stats, single_flight.stats))
+
 # ==================== Pydantic Models ====================
 
 class RoleResponse(BaseModel):
@@ -113,6 +169,29 @@ class StatsResponse(BaseModel):
     alive_agents: int
     dead_agents: int
 
+class ProfileRequest(BaseModel):
+    requests: int = Field(0, ge=0, le=1000)  # profile the next N requests
+    seconds: float = Field(0.0, ge=0.0)  # or a time window (also caps request/job sessions)
+    job: Optional[str] = None  # or the next run of a scheduler job
+    interval_ms: float = Field(PROFILE_INTERVAL_MS, ge=1.0, le=1000.0)
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    path: str  # e.g. "/api/posts?limit=6"
+    params: Dict[str, Any] = Field(default_factory=dict)
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem] = Field(..., min_length=1)
+
+class BatchItemResponse(BaseModel):
+    id: Optional[str]
+    path: str
+    status: int
+    body: Any
+
+class BatchResponse(BaseModel):
+    responses: List[BatchItemResponse]
+
 # ==================== API Routes ====================
 
 @app.get("/")
@@ -123,64 +202,39 @@ async def root():
         "status": "running"
     }
 
-# -------------------- Roles --------------------
+@app.get("/api/health")
+async def health():
+    """Worker health, including whether this worker is the scheduler leader"""
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        "scheduler": {
+            "running": scheduler.is_running,
+            **leader_elector.status()
+        },
+        "event_relay": event_relay.stats()
+    }
 
-@app.get("/api/roles", response_model=List[RoleResponse])
-async def get_roles(
-    limit: int = Query(50, ge=1, le=1000),
-    offset: int = Query(0, ge=0),
-    camp: Optional[str] = Query(None)
-):
-    """Get all roles with pagination"""
-    roles = storage.get_roles(limit=limit, offset=offset, camp=camp)
-    
-    # Format response
-    result = []
-    for role in roles:
-        result.append({
-            'id': role['id'],
-            'name': role['name'],
-            'avatar_url': role.get('avatar_url'),
-            'camp': role['camp'],
-            'is_historical': bool(role.get('is_historical', 0)),
-            'title': role.get('title'),
-            'description': role.get('description'),
-            'source': role.get('source'),
-            'personality': {
-                'openness': role.get('openness', 50),
-                'conscientiousness': role.get('conscientiousness', 50),
-                'extraversion': role.get('extraversion', 50),
-                'agreeableness': role.get('agreeableness', 50),
-                'neuroticism': role.get('neuroticism', 50),
-            },
-            'life_cycle': {
-                'birth_date': role.get('birth_date'),
-                'death_date': role.get('death_date'),
-                'is_alive': bool(role.get('is_alive', 1)),
-                'age': role.get('age', 25),
-                'health': role.get('health', 100),
-                'mood': role.get('mood', 'neutral'),
-            },
-            'stats': {
-                'reputation': role.get('reputation', 0),
-                'post_count': role.get('post_count', 0),
-                'follower_count': role.get('follower_count', 0),
-                'following_count': role.get('following_count', 0),
-            },
-            'llm_model': role.get('llm_model', 'gpt-4o-mini'),
-            'created_at': role.get('created_at'),
-            'last_active_at': role.get('last_active_at'),
-        })
-    
-    return result
+# -------------------- Helpers --------------------
 
-@app.get("/api/roles/{role_id}", response_model=RoleResponse)
-async def get_role(role_id: str):
-    """Get a single role by ID"""
-    role = storage.get_role_by_id(role_id)
-    if not role:
-        raise HTTPException(status_code=404, detail="Role not found")
-    
+FIELDS_DESCRIPTION = "Comma-separated storage columns; returns the raw projected rows"
+
+def _requested_fields(table: str, fields: Optional[str]) -> Optional[List[str]]:
+    """Validate a fields= query parameter against a table's columns"""
+    if not fields:
+        return None
+    try:
+        return storage.resolve_fields(table, fields.split(','))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _coalesced(request: Request, fn, *args, **kwargs):
+    """Share one computation between concurrent identical requests"""
+    key = flight_key(request.url.path, request.query_params.multi_items())
+    return await single_flight.do(key, fn, *args, name=request.url.path, **kwargs)
+
+def _format_role(role: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a flat storage row into a RoleResponse"""
     return {
         'id': role['id'],
         'name': role['name'],
@@ -216,28 +270,81 @@ async def get_role(role_id: str):
         'last_active_at': role.get('last_active_at'),
     }
 
+def _format_author(author: Dict[str, Any]) -> Dict[str, Any]:
+    """Author summary embedded in post responses"""
+    return {
+        'id': author['id'],
+        'name': author['name'],
+        'avatar_url': author.get('avatar_url'),
+        'camp': author['camp'],
+        'is_historical': bool(author.get('is_historical', 0)),
+        'title': author.get('title'),
+    }
+
+def _attach_authors(posts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Embed author summaries, looking each author up once"""
+    authors = {}
+    for post in posts:
+        author_id = post['author_id']
+        if author_id not in authors:
+            authors[author_id] = storage.get_role_by_id(author_id, fields=AUTHOR_FIELDS)
+        if authors[author_id]:
+            post['author'] = _format_author(authors[author_id])
+    return posts
+
+# -------------------- Metrics --------------------
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+# -------------------- Roles --------------------
+
+@app.get("/api/roles", response_model=List[RoleResponse])
+async def get_roles(
+    limit: int = Query(50, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    camp: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+):
+    """Get all roles with pagination"""
+    requested = _requested_fields('roles', fields)
+    roles = storage.get_roles(limit=limit, offset=offset, camp=camp, fields=requested or ROLE_LIST_FIELDS)
+    if requested:
+        return JSONResponse(roles)
+    
+    return [_format_role(role) for role in roles]
+
+@app.get("/api/roles/{role_id}", response_model=RoleResponse)
+async def get_role(role_id: str):
+    """Get a single role by ID"""
+    role = storage.get_role_by_id(role_id)
+    if not role:
+        raise HTTPException(status_code=404, detail="Role not found")
+    
+    return _format_role(role)
+
 @app.get("/api/roles/{role_id}/posts", response_model=List[PostResponse])
 async def get_role_posts(
     role_id: str,
-    limit: int = Query(20, ge=1, le=100)
+    limit: int = Query(20, ge=1, le=100),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
     """Get posts by a specific role"""
-    role = storage.get_role_by_id(role_id)
+    role = storage.get_role_by_id(role_id, fields=AUTHOR_FIELDS)
     if not role:
         raise HTTPException(status_code=404, detail="Role not found")
     
-    posts = storage.get_posts(limit=limit, author_id=role_id)
+    requested = _requested_fields('posts', fields)
+    posts = storage.get_posts(limit=limit, author_id=role_id, fields=requested or POST_LIST_FIELDS)
+    if requested:
+        return JSONResponse(posts)
     
     # Add author info
     for post in posts:
-        post['author'] = {
-            'id': role['id'],
-            'name': role['name'],
-            'avatar_url': role.get('avatar_url'),
-            'camp': role['camp'],
-            'is_historical': bool(role.get('is_historical', 0)),
-            'title': role.get('title'),
-        }
+        post['author'] = _format_author(role)
     
     return posts
 
@@ -245,34 +352,31 @@ async def get_role_posts(
 
 @app.get("/api/posts", response_model=List[PostResponse])
 async def get_posts(
+    request: Request,
     limit: int = Query(20, ge=1, le=100),
     offset: int = Query(0, ge=0),
     circle_id: Optional[str] = Query(None),
     author_id: Optional[str] = Query(None),
-    order_by: str = Query('created_at', regex='^(created_at|likes)$')
+    order_by: str = Query('created_at', regex='^(created_at|likes)$'),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
     """Get posts with filtering and sorting"""
-    posts = storage.get_posts(
-        limit=limit,
-        offset=offset,
-        circle_id=circle_id,
-        author_id=author_id,
-        order_by=order_by
-    )
+    requested = _requested_fields('posts', fields)
     
-    # Add author info
-    for post in posts:
-        author = storage.get_role_by_id(post['author_id'])
-        if author:
-            post['author'] = {
-                'id': author['id'],
-                'name': author['name'],
-                'avatar_url': author.get('avatar_url'),
-                'camp': author['camp'],
-                'is_historical': bool(author.get('is_historical', 0)),
-                'title': author.get('title'),
-            }
+    def load_posts():
+        posts = storage.get_posts(
+            limit=limit,
+            offset=offset,
+            circle_id=circle_id,
+            author_id=author_id,
+            order_by=order_by,
+            fields=requested or POST_LIST_FIELDS
+        )
+        return posts if requested else _attach_authors(posts)
     
+    posts = await _coalesced(request, load_posts)
+    if requested:
+        return JSONResponse(posts)
     return posts
 
 @app.get("/api/posts/{post_id}", response_model=PostResponse)
@@ -282,79 +386,158 @@ async def get_post(post_id: str):
     posts = storage.get_posts(limit=1)
     for p in posts:
         if p['id'] == post_id:
-            author = storage.get_role_by_id(p['author_id'])
-            if author:
-                p['author'] = {
-                    'id': author['id'],
-                    'name': author['name'],
-                    'avatar_url': author.get('avatar_url'),
-                    'camp': author['camp'],
-                    'is_historical': bool(author.get('is_historical', 0)),
-                    'title': author.get('title'),
-                }
-            return p
+            return _attach_authors([p])[0]
     
     raise HTTPException(status_code=404, detail="Post not found")
 
 # -------------------- Circles --------------------
 
 @app.get("/api/circles", response_model=List[CircleResponse])
-async def get_circles():
+async def get_circles(
+    request: Request,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+):
     """Get all circles"""
-    circles = storage.get_circles()
+    requested = _requested_fields('circles', fields)
+    circles = await _coalesced(request, storage.get_circles, fields=requested)
+    if requested:
+        return JSONResponse(circles)
     return circles
 
 @app.get("/api/circles/{circle_id}/posts", response_model=List[PostResponse])
 async def get_circle_posts(
     circle_id: str,
-    limit: int = Query(20, ge=1, le=100)
+    limit: int = Query(20, ge=1, le=100),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
     """Get posts in a specific circle"""
-    posts = storage.get_posts(limit=limit, circle_id=circle_id)
-    
-    # Add author info
-    for post in posts:
-        author = storage.get_role_by_id(post['author_id'])
-        if author:
-            post['author'] = {
-                'id': author['id'],
-                'name': author['name'],
-                'avatar_url': author.get('avatar_url'),
-                'camp': author['camp'],
-                'is_historical': bool(author.get('is_historical', 0)),
-                'title': author.get('title'),
-            }
+    requested = _requested_fields('posts', fields)
+    posts = storage.get_posts(limit=limit, circle_id=circle_id, fields=requested or POST_LIST_FIELDS)
+    if requested:
+        return JSONResponse(posts)
     
-    return posts
+    return _attach_authors(posts)
 
 # -------------------- Chat --------------------
 
 @app.get("/api/chat/rooms", response_model=List[ChatRoomResponse])
 async def get_chat_rooms(
-    limit: int = Query(50, ge=1, le=200)
+    limit: int = Query(50, ge=1, le=200),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
     """Get all chat rooms"""
-    rooms = storage.get_chat_rooms(limit=limit)
+    requested = _requested_fields('chat_rooms', fields)
+    rooms = storage.get_chat_rooms(limit=limit, fields=requested)
+    if requested:
+        return JSONResponse(rooms)
     return rooms
 
 @app.get("/api/chat/rooms/{room_id}/messages", response_model=List[ChatMessageResponse])
 async def get_chat_messages(
     room_id: str,
-    limit: int = Query(50, ge=1, le=200)
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = Query(None, description="Message id; page back to older messages"),
+    after: Optional[str] = Query(None, description="Message id; fetch messages that followed it")
 ):
-    """Get messages in a chat room"""
-    messages = storage.get_chat_messages(room_id, limit=limit)
+    """Get messages in a chat room in chronological order; the newest ones without a cursor"""
+    try:
+        messages = storage.get_chat_messages(room_id, limit=limit, before=before, after=after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return messages
 
+def _format_sse(event: Dict[str, Any]) -> str:
+    """Serialize a bus event as a Server-Sent Events frame (no id for ephemeral events, keeping the resume cursor)"""
+    data = json.dumps(event['data'], ensure_ascii=False, default=str)
+    if event['id'] is None:
+        return f"event: {event['event']}\ndata: {data}\n\n"
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {data}\n\n"
+
+async def _resume_room_from_storage(room_id: str, last_event_id: str) -> Optional[List[Dict[str, Any]]]:
+    """Messages after last_event_id read from storage, as bus events; None if the id is unknown"""
+    try:
+        messages = await run_in_threadpool(
+            storage.get_chat_messages, room_id, limit=SSE_RESUME_LIMIT, after=last_event_id
+        )
+    except ValueError:
+        return None
+    return [{'id': m['id'], 'event': 'message', 'data': m} for m in messages]
+
+async def _event_stream(request: Request, topic: str, last_event_id: Optional[str],
+                        room_id: Optional[str] = None):
+    """Replay missed events, then forward live ones until the client leaves"""
+    # Room streams can resume from storage when the cursor is older than the bus history
+    sub, backlog = event_bus.subscribe(topic, last_event_id, replay_on_gap=room_id is None)
+    replayed = set()
+    try:
+        if backlog is None:
+            backlog = await _resume_room_from_storage(room_id, last_event_id)
+            if backlog is None:
+                backlog = event_bus.history(topic)
+            # Messages stored after we subscribed may arrive again from the live queue
+            replayed = {event['id'] for event in backlog}
+        
+        yield "retry: 3000\n\n"
+        for event in backlog:
+            yield _format_sse(event)
+        
+        while not sub.closed:
+            event = await sub.get(timeout=SSE_KEEPALIVE_SECONDS)
+            if await request.is_disconnected():
+                break
+            if event is None:
+                yield ": keepalive\n\n"
+            elif event['id'] not in replayed:
+                yield _format_sse(event)
+    finally:
+        sub.close()
+
+def _sse_response(request: Request, topic: str, last_event_id: Optional[str],
+                  room_id: Optional[str] = None) -> StreamingResponse:
+    return StreamingResponse(
+        _event_stream(request, topic, last_event_id, room_id),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.get("/api/chat/rooms/stream")
+async def stream_chat_rooms(
+    request: Request,
+    last_event_id: Optional[str] = Query(None),
+    last_event_id_header: Optional[str] = Header(None, alias='Last-Event-ID')
+):
+    """Server-Sent Events stream of room activity (one event per new message)"""
+    return _sse_response(request, ROOMS_TOPIC, last_event_id_header or last_event_id)
+
+@app.get("/api/chat/rooms/{room_id}/stream")
+async def stream_chat_room(
+    request: Request,
+    room_id: str,
+    last_event_id: Optional[str] = Query(None),
+    last_event_id_header: Optional[str] = Header(None, alias='Last-Event-ID')
+):
+    """Server-Sent Events stream of new messages in a chat room
+    
+    Event ids are message ids; reconnecting clients resume via Last-Event-ID
+    (sent automatically by EventSource) or the last_event_id query parameter.
+    With CHAT_STREAM_DELTAS on, id-less `message_delta` events carry the text
+    of a message still being generated; the final `message` has the same id.
+    """
+    return _sse_response(request, room_topic(room_id), last_event_id_header or last_event_id, room_id)
+
 # -------------------- Wiki --------------------
 
 @app.get("/api/wiki/entries", response_model=List[WikiEntryResponse])
 async def get_wiki_entries(
     category: Optional[str] = Query(None),
-    limit: int = Query(100, ge=1, le=500)
+    limit: int = Query(100, ge=1, le=500),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
     """Get wiki entries"""
-    entries = storage.get_wiki_entries(category=category, limit=limit)
+    requested = _requested_fields('wiki_entries', fields)
+    entries = storage.get_wiki_entries(category=category, limit=limit, fields=requested)
+    if requested:
+        return JSONResponse(entries)
     return entries
 
 @app.get("/api/wiki/entries/{entry_id}", response_model=WikiEntryResponse)
@@ -366,14 +549,56 @@ async def get_wiki_entry(entry_id: str):
             return entry
     raise HTTPException(status_code=404, detail="Wiki entry not found")
 
+# -------------------- Export --------------------
+
+def _ndjson_stream(table: str, since: Optional[str], fields: Optional[List[str]], compress: bool):
+    """NDJSON chunks, one per fetchmany() batch, optionally gzip-compressed"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits=31: gzip container
+    for batch in storage.iter_export_batches(table, since=since, fields=fields):
+        chunk = ''.join(json.dumps(row, ensure_ascii=False, default=str) + '\n' for row in batch).encode('utf-8')
+        if compressor:
+            chunk = compressor.compress(chunk)
+            if not chunk:
+                continue
+        yield chunk
+    if compressor:
+        yield compressor.flush()
+
+@app.get("/api/export/{table}")
+async def export_table(
+    request: Request,
+    table: str,
+    since: Optional[str] = Query(None, description="Only rows with created_at after this ISO timestamp"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    gzip: Optional[bool] = Query(None, description="Compress the stream; defaults to Accept-Encoding negotiation")
+):
+    """Stream a whole table as NDJSON with constant memory"""
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown export table: {table}")
+    requested = _requested_fields(table, fields)
+    if gzip is None:
+        gzip = 'gzip' in request.headers.get('accept-encoding', '')
+    
+    headers = {'Content-Disposition': f'attachment; filename="{table}.ndjson"'}
+    if gzip:
+        headers['Content-Encoding'] = 'gzip'
+    return StreamingResponse(
+        _ndjson_stream(table, since, requested, gzip),
+        media_type='application/x-ndjson',
+        headers=headers
+    )
+
 # -------------------- Stats --------------------
 
 @app.get("/api/stats", response_model=StatsResponse)
-async def get_stats():
+async def get_stats(request: Request):
     """Get platform statistics"""
-    roles = storage.get_roles(limit=10000)
-    posts = storage.get_posts(limit=10000)
-    circles = storage.get_circles()
+    return await _coalesced(request, _compute_stats)
+
+def _compute_stats() -> Dict[str, int]:
+    roles = storage.get_roles(limit=10000, fields=['is_alive', 'last_active_at'])
+    posts = storage.get_posts(limit=10000, fields=['id'])
+    circles = storage.get_circles(fields=['id'])
     
     alive_count = sum(1 for r in roles if r.get('is_alive', True))
     dead_count = len(roles) - alive_count
@@ -387,17 +612,217 @@ async def get_stats():
         'dead_agents': dead_count,
     }
 
+# -------------------- Batch --------------------
+
+def _batch_path_error(path: str) -> Optional[str]:
+    """Reason a sub-request path can't be batched, None if it can"""
+    route = path.split('?', 1)[0]
+    if not route.startswith('/api/'):
+        return "Only /api/ routes can be batched"
+    if route == '/api/batch' or route.startswith('/api/admin/'):
+        return "Route not allowed in a batch"
+    if route.endswith('/stream') or route.startswith('/api/export/'):
+        return "Streaming routes can't be batched"
+    return None
+
+async def _run_batch_item(client: httpx.AsyncClient, item: BatchItem) -> Dict[str, Any]:
+    """Dispatch one GET sub-request through the app in-process"""
+    error = _batch_path_error(item.path)
+    if error:
+        return {'id': item.id, 'path': item.path, 'status': 400, 'body': {'detail': error}}
+    
+    try:
+        response = await client.get(item.path, params=item.params or None)
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        return {'id': item.id, 'path': item.path, 'status': response.status_code, 'body': body}
+    except Exception as e:
+        print(f"[API] Batch item {item.path} failed: {e}")
+        return {'id': item.id, 'path': item.path, 'status': 500, 'body': {'detail': 'Internal error'}}
+
+@app.post("/api/batch", response_model=BatchResponse)
+async def batch(request: BatchRequest):
+    """Run several GET routes concurrently in-process and return all results
+    
+    Each sub-response carries its own status, so one failing item doesn't
+    fail the batch.
+    """
+    if len(request.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_REQUESTS} requests per batch")
+    
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://batch') as client:
+        results = await asyncio.gather(*[_run_batch_item(client, item) for item in request.requests])
+    
+    return {'responses': results}
+
 # -------------------- Admin --------------------
 
 @app.post("/api/admin/sync")
-async def sync_from_supabase(background_tasks: BackgroundTasks):
-    """Sync data from Supabase to SQLite"""
-    success = storage.sync_from_supabase()
-    return {"success": success}
+async def sync_from_supabase():
+    """Start a background sync from Supabase to SQLite
+    
+    Returns immediately with the job; a second trigger while a sync is
+    running attaches to that job instead of starting another.
+    """
+    job, created = job_manager.submit('sync', storage.sync_from_supabase)
+    return {"job": job.to_dict(), "attached": not created}
+
+@app.get("/api/admin/jobs")
+async def list_jobs():
+    """List recent background jobs"""
+    return [job.to_dict() for job in job_manager.list()]
+
+@app.get("/api/admin/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get status and progress of a background job"""
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.post("/api/admin/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Request cancellation of a running background job"""
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"cancelled": job.cancel(), "job": job.to_dict()}
+
+@app.get("/api/admin/singleflight")
+async def single_flight_stats():
+    """Request coalescing counters for the hot read routes"""
+    return single_flight.stats()
+
+@app.get("/api/admin/admission")
+async def admission_stats():
+    """Concurrency, queue depth and shed counts per route class"""
+    return admission.stats()
+
+@app.get("/api/admin/llm/rate-limits")
+async def llm_rate_limits():
+    """Per-provider quota headroom, throttling and retry counters"""
+    return {provider: limiter.stats() for provider, limiter in rate_limits.items()}
+
+@app.get("/api/admin/llm/routing")
+async def llm_routing():
+    """Rolling per-model latency/error stats, equivalence classes and hedge counters"""
+    return llm_router.stats()
+
+@app.get("/api/admin/llm/usage")
+async def llm_usage(
+    group_by: str = Query('model', pattern=f"^({'|'.join(ROLLUP_DIMENSIONS)})$"),
+    days: int = Query(7, ge=1, le=90)
+):
+    """LLM calls, tokens and estimated cost rolled up by role, model, content type, job or day"""
+    rows = await run_in_threadpool(usage_tracker.rollup, group_by, days)
+    caps = await run_in_threadpool(usage_tracker.caps)
+    return {"group_by": group_by, "days": days, "rows": rows, "caps": caps}
+
+@app.get("/api/admin/llm/prompts")
+async def llm_prompt_stats():
+    """Persona prompt template version, compile/stored-hit counters, unwritten prompts and cache prefix sizes"""
+    return {**prompt_compiler.stats(), 'cache_prefix': llm_service.cache_prefix_stats()}
+
+@app.get("/api/admin/memory")
+async def memory_stats():
+    """Loaded memory indexes and recall latency"""
+    return memory_service.stats()
+
+@app.get("/api/admin/memory/{role_id}", dependencies=[Depends(require_admin)])
+async def recall_memories(role_id: str, q: str = Query(..., min_length=1), k: int = Query(5, ge=1, le=50)):
+    """A role's top-k memories for a query, with their combined scores"""
+    await memory_service.aload(role_id)
+    memories = await run_in_threadpool(memory_service.recall, role_id, q, k)
+    return {"role_id": role_id, "query": q, "memories": memories}
+
+@app.get("/api/admin/dedup")
+async def dedup_stats():
+    """Near-duplicate post index size, threshold and drop counts"""
+    return post_dedup.stats()
+
+@app.get("/api/admin/llm/cache")
+async def llm_cache_stats():
+    """LLM response cache size and hit/miss/bypass counters"""
+    if not llm_cache:
+        return {"enabled": False}
+    return llm_cache.stats()
+
+@app.post("/api/admin/llm/cache/clear", dependencies=[Depends(require_admin)])
+async def clear_llm_cache():
+    """Drop every cached LLM response"""
+    if not llm_cache:
+        raise HTTPException(status_code=400, detail="LLM cache is not enabled")
+    llm_cache.clear()
+    return {"message": "LLM cache cleared"}
+
+@app.get("/api/admin/queries", dependencies=[Depends(require_admin)])
+async def query_stats_report(
+    limit: int = Query(20, ge=1, le=200),
+    order_by: str = Query('total_ms', pattern='^(total_ms|max_ms|calls|rows|slow)$')
+):
+    """Top SQLite statement shapes by total time, plus the recent slow query log"""
+    return {
+        "slow_query_ms": query_stats.slow_ms,
+        "statements": query_stats.top(limit, order_by),
+        "slow": query_stats.slow_log()
+    }
+
+@app.post("/api/admin/queries/reset", dependencies=[Depends(require_admin)])
+async def reset_query_stats():
+    """Clear statement stats and the slow query log"""
+    query_stats.reset()
+    return {"message": "Query stats reset"}
+
+@app.post("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def start_profile(request: ProfileRequest):
+    """
+    Arm the sampling profiler for the next N requests, a time window, or a scheduler job
+
+    A single request can also be profiled by sending X-Profile: 1 with a valid
+    X-Admin-Token; its profile id comes back in the X-Profile-Id header.
+    """
+    session = profiler.start(
+        requests=request.requests,
+        seconds=request.seconds,
+        job=request.job,
+        interval_ms=request.interval_ms
+    )
+    return session.to_dict()
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """List recent profiling sessions"""
+    return [session.to_dict() for session in profiler.list()]
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(
+    profile_id: str,
+    format: str = Query('json', pattern='^(json|collapsed)$')
+):
+    """Get a profile; format=collapsed returns flamegraph.pl input as plain text"""
+    session = profiler.get(profile_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == 'collapsed':
+        return Response(content=session.collapsed(), media_type='text/plain')
+    return {**session.to_dict(), 'collapsed': session.collapsed()}
+
+@app.post("/api/admin/profiles/{profile_id}/stop", dependencies=[Depends(require_admin)])
+async def stop_profile(profile_id: str):
+    """Finish a profiling session early"""
+    session = profiler.stop(profile_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return session.to_dict()
 
 @app.post("/api/admin/scheduler/start")
 async def start_scheduler():
-    """Start the task scheduler"""
+    """Start the task scheduler (only on the elected leader worker)"""
+    if LEADER_ELECTION_ENABLED and not leader_elector.is_leader:
+        raise HTTPException(status_code=409, detail="This worker is not the scheduler leader")
     scheduler.start()
     return {"status": "started"}
 
@@ -415,7 +840,7 @@ async def hidden_wiki():
     return {
         "message": "Welcome to AgentCircle Wiki",
         "description": "A comprehensive encyclopedia of all characters, events, and stories in AgentCircle. Humans can edit entries.",
-        "entries_count": len(storage.get_wiki_entries(limit=10000)),
+        "entries_count": len(storage.get_wiki_entries(limit=10000, fields=['id'])),
         "url": "/wiki"
     }
 
@@ -442,16 +867,34 @@ async def startup_event():
     """Run on startup"""
     print("[API] AgentCircle API starting up...")
     
-    # Start scheduler
-    scheduler.start()
+    # Periodically persist LLM usage aggregates and recompiled persona prompts
+    usage_tracker.start()
+    prompt_compiler.start()
+    
+    # Start the scheduler in exactly one worker: the elected leader; the others
+    # relay its stored chat messages to their own SSE clients
+    if LEADER_ELECTION_ENABLED:
+        leader_elector.start(on_elected=scheduler.start, on_revoked=scheduler.stop)
+        event_relay.start(is_source=lambda: leader_elector.is_leader)
+    else:
+        scheduler.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Run on shutdown"""
     print("[API] AgentCircle API shutting down...")
     
-    # Stop scheduler
+    # Stop scheduler and hand leadership to another worker
+    await leader_elector.stop()
     scheduler.stop()
+    await event_relay.stop()
+    
+    # Close pooled LLM provider connections
+    await llm_service.aclose()
+    
+    # Write out remaining LLM usage and recompiled prompts
+    await usage_tracker.stop()
+    await prompt_compiler.stop()
     
     # Close storage
     storage.close()
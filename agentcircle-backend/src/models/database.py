@@ -63,6 +63,8 @@ class Role(Base):
     # AI Model config
     llm_model = Column(String, default='gpt-4o-mini')  # 可配置的大模型
     system_prompt = Column(Text)  # 角色专属系统提示词
+    prompt_version = Column(Integer)  # system_prompt 的模板版本
+    prompt_hash = Column(String)  # 生成 system_prompt 时人设字段的哈希
     
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -310,6 +312,13 @@ class InteractionSession(Base):
     cost = Column(Float, default=0.0)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+# Columns added after the first release; run once in the Supabase SQL editor on older
+# projects (SQLite files are migrated by StorageService on startup)
+POSTGRES_MIGRATIONS = [
+    'ALTER TABLE roles ADD COLUMN IF NOT EXISTS prompt_version INTEGER',
+    'ALTER TABLE roles ADD COLUMN IF NOT EXISTS prompt_hash TEXT',
+]
+
 # Database initialization
 SQLITE_DB_PATH = os.path.join(os.path.dirname(__file__), '../../data/agentcircle.db')
 
@@ -352,6 +361,8 @@ async def init_async_sqlite():
                 following_count INTEGER DEFAULT 0,
                 llm_model TEXT DEFAULT 'gpt-4o-mini',
                 system_prompt TEXT,
+                prompt_version INTEGER,
+                prompt_hash TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 last_active_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -0,0 +1,181 @@
+"""
+Admission control and load shedding for the API worker
+Per route class concurrency limits with a bounded, deadline-aware wait queue
+"""
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from typing import Optional, Dict, Any
+
+def _limits(prefix: str, concurrency: int, queue: int, timeout: float) -> Dict[str, Any]:
+    return {
+        'max_concurrency': int(os.getenv(f'ADMISSION_{prefix}_CONCURRENCY', str(concurrency))),
+        'max_queue': int(os.getenv(f'ADMISSION_{prefix}_QUEUE', str(queue))),
+        'queue_timeout': float(os.getenv(f'ADMISSION_{prefix}_QUEUE_TIMEOUT', str(timeout))),
+    }
+
+# Route classes and their default limits
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+ROUTE_CLASS_LIMITS = {
+    'reads': _limits('READS', 64, 256, 2.0),
+    'admin': _limits('ADMIN', 2, 4, 5.0),
+    'streaming': _limits('STREAMING', 2000, 0, 0.0),
+}
+# Probes must answer when the worker is busy, or orchestrators restart healthy workers
+EXEMPT_PATHS = {'/api/health', '/metrics'}
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of admitted"""
+
+    def __init__(self, route_class: str, reason: str, retry_after: int):
+        super().__init__(f"{route_class} {reason}")
+        self.route_class = route_class
+        self.reason = reason
+        self.retry_after = retry_after
+
+class Bulkhead:
+    """Concurrency limit with a FIFO wait queue bounded in size and wait time"""
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: deque = deque()
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self._service_time = 0.0  # EWMA of seconds per request, for Retry-After
+
+    async def acquire(self):
+        """Take a slot, waiting in the queue if needed; raises Overloaded"""
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.shed_queue_full += 1
+            raise Overloaded(self.name, 'queue full', self.retry_after())
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        timer = loop.call_later(self.queue_timeout, self._expire, waiter)
+        try:
+            granted = await waiter
+        except asyncio.CancelledError:
+            # Caller went away; hand on a slot we may already have been given
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        finally:
+            timer.cancel()
+
+        if not granted:
+            self.shed_timeout += 1
+            raise Overloaded(self.name, 'queue timeout', self.retry_after())
+        self.admitted += 1
+
+    def _expire(self, waiter: asyncio.Future):
+        """Queue deadline reached before a slot freed up"""
+        if not waiter.done():
+            self._waiters.remove(waiter)
+            waiter.set_result(False)
+
+    def release(self, elapsed: Optional[float] = None):
+        """Free a slot, handing it straight to the oldest live waiter"""
+        if elapsed is not None:
+            self._service_time = elapsed if not self._service_time else 0.9 * self._service_time + 0.1 * elapsed
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot moves to the waiter; active count is unchanged
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+    def retry_after(self) -> int:
+        """Seconds a shed client should wait: time to drain the current queue"""
+        backlog = len(self._waiters) + self.active
+        estimate = backlog * self._service_time / max(self.max_concurrency, 1)
+        return max(1, math.ceil(estimate))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'active': self.active,
+            'queue_depth': len(self._waiters),
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue,
+            'queue_timeout': self.queue_timeout,
+            'admitted': self.admitted,
+            'shed_queue_full': self.shed_queue_full,
+            'shed_timeout': self.shed_timeout,
+        }
+
+class AdmissionController:
+    """Maps requests to route classes and admits them through bulkheads"""
+
+    def __init__(self, limits: Dict[str, Dict[str, Any]] = ROUTE_CLASS_LIMITS):
+        self.bulkheads = {name: Bulkhead(name, **cfg) for name, cfg in limits.items()}
+
+    def classify(self, path: str) -> Optional[str]:
+        """Route class for a path, None for routes that bypass admission"""
+        if path in EXEMPT_PATHS or not path.startswith('/api/') or path == '/api/batch':
+            # Batch fans out into sub-requests that are admitted one by one
+            return None
+        if path.startswith('/api/admin/'):
+            return 'admin'
+        if path.endswith('/stream') or path.startswith('/api/export/'):
+            return 'streaming'
+        return 'reads'
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: b.stats() for name, b in self.bulkheads.items()}
+
+class AdmissionMiddleware:
+    """ASGI middleware holding a slot for the whole response, streams included"""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        route_class = self.controller.classify(scope['path']) if scope['type'] == 'http' else None
+        if not ADMISSION_ENABLED or route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        bulkhead = self.controller.bulkheads[route_class]
+        try:
+            await bulkhead.acquire()
+        except Overloaded as e:
+            await self._reject(send, e)
+            return
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            bulkhead.release(time.monotonic() - started)
+
+    async def _reject(self, send, error: Overloaded):
+        body = f'{{"detail":"Server overloaded ({error.reason}), retry later"}}'.encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'retry-after', str(error.retry_after).encode()),
+                (b'content-length', str(len(body)).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+# Global admission controller
+admission = AdmissionController()
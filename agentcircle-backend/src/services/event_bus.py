@@ -0,0 +1,139 @@
+"""
+In-process event bus for AgentCircle
+Fans out chat events to streaming subscribers (SSE) with resume support
+"""
+import os
+import asyncio
+import threading
+from collections import deque
+from typing import Optional, List, Dict, Any, Tuple
+
+EVENT_HISTORY_SIZE = int(os.getenv('EVENT_HISTORY_SIZE', '200'))
+EVENT_QUEUE_SIZE = int(os.getenv('EVENT_QUEUE_SIZE', '100'))
+
+# Topic names
+ROOMS_TOPIC = 'rooms'
+
+def room_topic(room_id: str) -> str:
+    """Topic carrying the messages of a single chat room"""
+    return f"room:{room_id}"
+
+class Subscription:
+    """A single subscriber's queue, bound to the event loop that created it"""
+
+    def __init__(self, bus: 'EventBus', topic: str, queue_size: int):
+        self.bus = bus
+        self.topic = topic
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def push(self, event: Dict[str, Any]):
+        """Deliver an event; safe to call from any thread"""
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Loop already closed - subscriber is gone
+            self.bus.unsubscribe(self)
+
+    def _put(self, event: Dict[str, Any]):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow consumer: drop it, the client reconnects with Last-Event-ID
+            self.overflowed = True
+            self.bus.unsubscribe(self)
+
+    @property
+    def closed(self) -> bool:
+        """True once an overflowed subscription has drained its queue"""
+        return self.overflowed and self.queue.empty()
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Wait for the next event, returns None on timeout"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+class EventBus:
+    """Topic-based pub/sub with a bounded per-topic replay history"""
+
+    def __init__(self, history_size: int = EVENT_HISTORY_SIZE, queue_size: int = EVENT_QUEUE_SIZE):
+        self.history_size = history_size
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._history: Dict[str, deque] = {}
+        self._subscribers: Dict[str, set] = {}
+
+    def publish(self, topic: str, event_type: str, event_id: Optional[str], data: Dict[str, Any],
+                ephemeral: bool = False) -> Dict[str, Any]:
+        """Publish an event to every subscriber of a topic; ephemeral events skip the replay history"""
+        event = {'id': event_id, 'event': event_type, 'data': data}
+        with self._lock:
+            if not ephemeral:
+                history = self._history.get(topic)
+                if history is None:
+                    history = self._history[topic] = deque(maxlen=self.history_size)
+                history.append(event)
+            subscribers = list(self._subscribers.get(topic, ()))
+
+        for sub in subscribers:
+            sub.push(event)
+        return event
+
+    def subscribe(self, topic: str, last_event_id: Optional[str] = None,
+                  replay_on_gap: bool = True) -> Tuple[Subscription, Optional[List[Dict]]]:
+        """
+        Subscribe to a topic (must be called from a running event loop)
+
+        Returns:
+            (subscription, backlog) where backlog holds the buffered events after
+            last_event_id. If last_event_id fell out of the history the whole
+            buffered history is replayed instead, or backlog is None when
+            replay_on_gap is False so the caller can resume from storage.
+        """
+        sub = Subscription(self, topic, self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(sub)
+            backlog = []
+            if last_event_id:
+                backlog = self._replay(topic, last_event_id)
+                if backlog is None and replay_on_gap:
+                    backlog = list(self._history.get(topic, ()))
+        return sub, backlog
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            subs = self._subscribers.get(sub.topic)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.topic]
+
+    def history(self, topic: str) -> List[Dict]:
+        """Buffered events for a topic, oldest first"""
+        with self._lock:
+            return list(self._history.get(topic, ()))
+
+    def _replay(self, topic: str, last_event_id: str) -> Optional[List[Dict]]:
+        """Events published after last_event_id, None if it fell out of the history"""
+        history = list(self._history.get(topic, ()))
+        for i, event in enumerate(history):
+            if event['id'] == last_event_id:
+                return history[i + 1:]
+        return None
+
+    def subscriber_count(self, topic: Optional[str] = None) -> int:
+        with self._lock:
+            if topic is not None:
+                return len(self._subscribers.get(topic, ()))
+            return sum(len(s) for s in self._subscribers.values())
+
+# Global event bus instance
+event_bus = EventBus()
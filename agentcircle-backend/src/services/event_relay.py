@@ -0,0 +1,78 @@
+"""
+Cross-worker chat event relay
+Only the scheduler leader creates chat messages, so only its in-process event bus
+sees them. Every other worker tails the chat_messages table of the shared SQLite
+file and publishes new messages on its own bus, so SSE clients connected to any
+worker receive them live. Streaming deltas (message_delta) are not stored and
+only reach clients connected to the leader.
+"""
+import os
+import asyncio
+from typing import Callable, Optional, Dict, Any
+
+from services.storage_service import storage
+from services.event_bus import event_bus
+
+EVENT_RELAY_SECONDS = float(os.getenv('EVENT_RELAY_SECONDS', '1'))
+EVENT_RELAY_BATCH = 500  # messages read per query
+
+class EventRelay:
+    """Tails stored chat messages into the local event bus while another worker produces them"""
+
+    def __init__(self, interval: float = EVENT_RELAY_SECONDS):
+        self.interval = interval
+        self.relayed = 0
+        self._cursor: Optional[int] = None  # rowid of the last message seen, None while idle
+        self._is_source: Callable[[], bool] = lambda: False
+        self._task: Optional[asyncio.Task] = None
+
+    def poll(self) -> int:
+        """Publish messages stored since the last poll (blocking), returns how many"""
+        if self._is_source() or not event_bus.subscriber_count():
+            # This worker publishes its own messages, or nobody is listening: start afresh next time
+            self._cursor = None
+            return 0
+        relayed = 0
+        while True:
+            messages, self._cursor = storage.get_chat_messages_since(self._cursor, EVENT_RELAY_BATCH)
+            for message in messages:
+                storage.publish_chat_message(message)
+            relayed += len(messages)
+            if len(messages) < EVENT_RELAY_BATCH:
+                break
+        self.relayed += relayed
+        return relayed
+
+    def start(self, is_source: Callable[[], bool]):
+        """Poll on the running event loop; is_source() is true while this worker creates the messages itself"""
+        self._is_source = is_source
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._relay_loop())
+
+    async def _relay_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.poll)
+            except Exception as e:
+                print(f"[Relay] Poll failed: {e}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'running': self._task is not None,
+            'interval': self.interval,
+            'active': self._cursor is not None,
+            'relayed': self.relayed,
+        }
+
+# Global relay; started alongside leader election
+event_relay = EventRelay()
@@ -0,0 +1,159 @@
+"""
+Background job tracking for long-running admin operations
+Jobs run on their own thread with progress reporting and cancellation
+"""
+import os
+import uuid
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Optional, List, Dict, Any, Tuple
+
+JOB_HISTORY_SIZE = int(os.getenv('JOB_HISTORY_SIZE', '50'))
+
+class JobCancelled(Exception):
+    """Raised inside a job once cancellation was requested"""
+
+class Job:
+    """A single background job and its progress"""
+
+    def __init__(self, kind: str):
+        self.id = f"job_{uuid.uuid4().hex[:12]}"
+        self.kind = kind
+        self.status = 'pending'  # pending, running, succeeded, failed, cancelled
+        self.created_at = datetime.utcnow().isoformat()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.error: Optional[str] = None
+        self.result: Any = None
+        self.progress: Dict[str, Dict[str, Optional[int]]] = {}
+        self._started = None
+        self._elapsed = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    # -------- Called from the job body --------
+
+    def update_progress(self, step: str, done: int, total: Optional[int] = None):
+        """Record progress for one step (e.g. a table)"""
+        with self._lock:
+            entry = self.progress.setdefault(step, {'done': 0, 'total': None})
+            entry['done'] = done
+            if total is not None:
+                entry['total'] = total
+
+    def check_cancelled(self):
+        """Raise JobCancelled if cancellation was requested"""
+        if self._cancel.is_set():
+            raise JobCancelled(f"{self.kind} job {self.id} cancelled")
+
+    # -------- Lifecycle --------
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in ('pending', 'running')
+
+    def cancel(self) -> bool:
+        """Request cancellation; the job stops at its next checkpoint"""
+        if not self.is_active:
+            return False
+        self._cancel.set()
+        return True
+
+    def run(self, fn: Callable[['Job'], Any]):
+        self.status = 'running'
+        self.started_at = datetime.utcnow().isoformat()
+        self._started = time.monotonic()
+        try:
+            self.result = fn(self)
+            if self._cancel.is_set():
+                self.status = 'cancelled'
+            elif self.result is False:
+                self.status = 'failed'
+                self.error = f"{self.kind} reported failure, see server log"
+            else:
+                self.status = 'succeeded'
+        except JobCancelled:
+            self.status = 'cancelled'
+        except Exception as e:
+            self.status = 'failed'
+            self.error = str(e)
+            print(f"[Jobs] {self.kind} job {self.id} failed: {e}")
+        finally:
+            self._elapsed = time.monotonic() - self._started
+            self.finished_at = datetime.utcnow().isoformat()
+            print(f"[Jobs] {self.kind} job {self.id} {self.status} in {self._elapsed:.1f}s")
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            progress = {step: dict(p) for step, p in self.progress.items()}
+        if self._elapsed is not None:
+            elapsed = self._elapsed
+        elif self._started is not None:
+            elapsed = time.monotonic() - self._started
+        else:
+            elapsed = 0.0
+        items_done = sum(p['done'] or 0 for p in progress.values())
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'elapsed_seconds': round(elapsed, 3),
+            'progress': progress,
+            'items_done': items_done,
+            'items_per_second': round(items_done / elapsed, 1) if elapsed > 0 else 0.0,
+            'cancel_requested': self.cancel_requested,
+            'error': self.error,
+        }
+
+class JobManager:
+    """Runs at most one job per kind and keeps a short history"""
+
+    def __init__(self, history_size: int = JOB_HISTORY_SIZE):
+        self.history_size = history_size
+        self._jobs: 'OrderedDict[str, Job]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn: Callable[[Job], Any]) -> Tuple[Job, bool]:
+        """
+        Start fn(job) on a background thread
+
+        Returns:
+            (job, created) - if a job of this kind is already active it is
+            returned instead of starting a parallel one, with created=False
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.kind == kind and job.is_active:
+                    return job, False
+
+            job = Job(kind)
+            self._jobs[job.id] = job
+            self._trim()
+
+        thread = threading.Thread(target=job.run, args=(fn,), name=f"job-{kind}", daemon=True)
+        thread.start()
+        return job, True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        return list(reversed(self._jobs.values()))
+
+    def _trim(self):
+        """Drop the oldest finished jobs beyond the history size"""
+        finished = [job_id for job_id, job in self._jobs.items() if not job.is_active]
+        for job_id in finished[:max(0, len(self._jobs) - self.history_size)]:
+            del self._jobs[job_id]
+
+# Global job manager instance
+job_manager = JobManager()
@@ -0,0 +1,193 @@
+"""
+Leader election for multi-worker deployments
+Workers compete for a lease row in the shared SQLite file; only the holder runs the scheduler
+"""
+import os
+import time
+import uuid
+import socket
+import asyncio
+import sqlite3
+import threading
+from typing import Callable, Optional, Dict, Any
+
+from services.storage_service import SQLITE_DB_PATH
+
+LEADER_ELECTION_ENABLED = os.getenv('LEADER_ELECTION_ENABLED', 'true').lower() == 'true'
+LEADER_LEASE_SECONDS = float(os.getenv('LEADER_LEASE_SECONDS', '30'))
+LEADER_RENEW_SECONDS = float(os.getenv('LEADER_RENEW_SECONDS', '10'))
+
+class LeaderElector:
+    """
+    Lease-based election: the leader renews its lease every renew interval,
+    and any worker may take over once the lease has expired. Callbacks fire
+    on the event loop when this worker gains or loses leadership.
+    """
+
+    def __init__(self, db_path: str, name: str = 'scheduler',
+                 lease_seconds: float = LEADER_LEASE_SECONDS, renew_seconds: float = LEADER_RENEW_SECONDS):
+        self.db_path = db_path
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.renew_seconds = renew_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.is_leader = False
+        self.lease_expires_at = 0.0
+        self.leader_since: Optional[float] = None
+        self.transitions = 0
+        # (holder, expires_at, acquired_at) as last seen by the campaign loop, for status()
+        self._lease: Optional[tuple] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        # The connection is used from executor threads and from stop(); one user at a time
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._task: Optional[asyncio.Task] = None
+        self._on_elected: Optional[Callable[[], None]] = None
+        self._on_revoked: Optional[Callable[[], None]] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """Shared connection (caller holds _lock)"""
+        if self._conn is None:
+            # Autocommit mode; the lease update runs in an explicit IMMEDIATE transaction
+            self._conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS leader_leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    acquired_at REAL NOT NULL
+                )
+            ''')
+        return self._conn
+
+    # -------- Lease operations (blocking, run off the event loop) --------
+
+    def _try_acquire(self) -> bool:
+        """Take or renew the lease; returns whether this worker holds it"""
+        with self._lock:
+            if self._stopped:
+                # A renewal that was already queued when stop() ran must not retake the lease
+                return False
+            conn = self._connect()
+            now = time.time()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT holder, expires_at, acquired_at FROM leader_leases WHERE name = ?',
+                                   (self.name,)).fetchone()
+                if row is None or row[0] == self.worker_id or row[1] < now:
+                    acquired_at = now if row is None or row[0] != self.worker_id else None
+                    conn.execute('''
+                        INSERT INTO leader_leases (name, holder, expires_at, acquired_at) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(name) DO UPDATE SET
+                            holder = excluded.holder,
+                            expires_at = excluded.expires_at,
+                            acquired_at = COALESCE(?, leader_leases.acquired_at)
+                    ''', (self.name, self.worker_id, now + self.lease_seconds, now, acquired_at))
+                    conn.execute('COMMIT')
+                    self.lease_expires_at = now + self.lease_seconds
+                    self._lease = (self.worker_id, self.lease_expires_at, acquired_at or row[2])
+                    return True
+                conn.execute('COMMIT')
+                self._lease = row
+                return False
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def _release(self):
+        """Give up the lease so another worker can take over immediately"""
+        with self._lock:
+            self._connect().execute('DELETE FROM leader_leases WHERE name = ? AND holder = ?',
+                                    (self.name, self.worker_id))
+
+    def current_leader(self) -> Optional[Dict[str, Any]]:
+        """The lease row as stored, None if nobody holds a live lease"""
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT holder, expires_at, acquired_at FROM leader_leases WHERE name = ?', (self.name,)
+            ).fetchone()
+        return self._describe(row)
+
+    @staticmethod
+    def _describe(row: Optional[tuple]) -> Optional[Dict[str, Any]]:
+        if row is None or row[1] < time.time():
+            return None
+        return {'worker_id': row[0], 'lease_expires_in': round(row[1] - time.time(), 1), 'acquired_at': row[2]}
+
+    # -------- Election loop --------
+
+    def start(self, on_elected: Callable[[], None], on_revoked: Callable[[], None]):
+        """Begin campaigning on the running event loop"""
+        self._on_elected = on_elected
+        self._on_revoked = on_revoked
+        self._stopped = False
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._campaign())
+
+    async def _campaign(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                holds = await loop.run_in_executor(None, self._try_acquire)
+            except Exception as e:
+                # Can't reach the lease; keep leading only while the last renewal is still valid
+                print(f"[Leader] Lease renewal failed: {e}")
+                holds = self.is_leader and time.time() < self.lease_expires_at
+            self._set_leader(holds)
+            await asyncio.sleep(self.renew_seconds)
+
+    def _set_leader(self, holds: bool):
+        if holds == self.is_leader:
+            return
+        self.is_leader = holds
+        self.transitions += 1
+        if holds:
+            self.leader_since = time.time()
+            print(f"[Leader] {self.worker_id} elected {self.name} leader")
+            self._on_elected()
+        else:
+            self.leader_since = None
+            print(f"[Leader] {self.worker_id} lost {self.name} leadership")
+            self._on_revoked()
+
+    async def stop(self):
+        """Stop campaigning and hand the lease back"""
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            self._set_leader(False)
+        await asyncio.to_thread(self._close)
+        self._lease = None
+
+    def _close(self):
+        """Release the lease and close; also when not leader, as a renewal in flight during stop() may have won"""
+        if self._conn is None:
+            return
+        try:
+            self._release()
+        except Exception as e:
+            print(f"[Leader] Failed to release lease: {e}")
+        with self._lock:
+            self._conn.close()
+            self._conn = None
+
+    def status(self) -> Dict[str, Any]:
+        """Election state from the last campaign round; no I/O, so health checks never wait on the lease row"""
+        return {
+            'enabled': LEADER_ELECTION_ENABLED,
+            'worker_id': self.worker_id,
+            'is_leader': self.is_leader,
+            'leader_since': self.leader_since,
+            'lease_seconds': self.lease_seconds,
+            'transitions': self.transitions,
+            'leader': self._describe(self._lease),
+        }
+
+# Global elector for the scheduler, sharing the SQLite file all workers use
+leader_elector = LeaderElector(SQLITE_DB_PATH)
@@ -0,0 +1,171 @@
+"""
+Content-addressed LLM response cache
+Raw provider responses stored in SQLite, keyed by a hash of the full request
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional, Dict, Any, Tuple
+
+from services.metrics import record_llm_cache
+from services.storage_service import SQLITE_DB_PATH
+
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'false').lower() == 'true'
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join(os.path.dirname(SQLITE_DB_PATH), 'llm_cache.db'))
+LLM_CACHE_MAX_MB = float(os.getenv('LLM_CACHE_MAX_MB', '256'))
+LLM_CACHE_TTL_HOURS = float(os.getenv('LLM_CACHE_TTL_HOURS', '168'))
+# Sampled requests above this temperature bypass the cache; set to 2 to cache everything (replays, benchmarks)
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv('LLM_CACHE_MAX_TEMPERATURE', '0'))
+
+# Provider defaults when the request doesn't set a temperature
+DEFAULT_TEMPERATURE = {'openai': 1.0, 'anthropic': 1.0, 'gemini': 1.0}
+
+def request_temperature(provider: str, body: Dict[str, Any]) -> float:
+    if provider == 'gemini':
+        value = (body.get('generationConfig') or {}).get('temperature')
+    else:
+        value = body.get('temperature')
+    return DEFAULT_TEMPERATURE.get(provider, 1.0) if value is None else float(value)
+
+class LLMCache:
+    """SQLite key-value store with TTL and LRU size eviction"""
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_bytes: int = int(LLM_CACHE_MAX_MB * 1024 * 1024),
+                 ttl_seconds: float = LLM_CACHE_TTL_HOURS * 3600, max_temperature: float = LLM_CACHE_MAX_TEMPERATURE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_temperature = max_temperature
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evicted = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    provider TEXT NOT NULL,
+                    model TEXT,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_hit_at REAL NOT NULL,
+                    hits INTEGER DEFAULT 0
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_last_hit ON responses (last_hit_at)')
+            self._conn.commit()
+            self._size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        return self._conn
+
+    @staticmethod
+    def key(provider: str, url: str, body: Dict[str, Any]) -> str:
+        """sha256 over the canonical request; credentials live in headers and are excluded"""
+        canonical = json.dumps({'provider': provider, 'url': url, 'body': body},
+                               sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def lookup(self, provider: str, url: str, body: Dict[str, Any]) -> Tuple[Optional[str], Optional[Dict]]:
+        """
+        (key, cached response) for a request
+
+        key is None when the request bypasses the cache (sampling temperature
+        above the limit); the response is None on a miss.
+        """
+        if request_temperature(provider, body) > self.max_temperature:
+            self.bypassed += 1
+            record_llm_cache(provider, 'bypass')
+            return None, None
+
+        key = self.key(provider, url, body)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute('SELECT response, created_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None and now - row[1] <= self.ttl_seconds:
+                conn.execute('UPDATE responses SET last_hit_at = ?, hits = hits + 1 WHERE key = ?', (now, key))
+                conn.commit()
+                self.hits += 1
+                record_llm_cache(provider, 'hit')
+                return key, json.loads(row[0])
+        self.misses += 1
+        record_llm_cache(provider, 'miss')
+        return key, None
+
+    def put(self, key: str, provider: str, model: str, response: Dict[str, Any]):
+        """Store a provider response, evicting expired then least recently used entries"""
+        payload = json.dumps(response, ensure_ascii=False)
+        size = len(payload.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            old = conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            conn.execute('''
+                INSERT OR REPLACE INTO responses (key, provider, model, response, size, created_at, last_hit_at, hits)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+            ''', (key, provider, model, payload, size, now, now))
+            self._size += size - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """Drop expired entries, then LRU ones until under 90% of the size limit (caller holds the lock)"""
+        expired = conn.execute('DELETE FROM responses WHERE created_at < ?', (now - self.ttl_seconds,)).rowcount
+        self.evicted += max(expired, 0)
+        self._size = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        target = self.max_bytes * 0.9
+        if self._size <= target:
+            return
+        freed = 0
+        victims = []
+        for key, size in conn.execute('SELECT key, size FROM responses ORDER BY last_hit_at'):
+            if self._size - freed <= target:
+                break
+            victims.append((key,))
+            freed += size
+        conn.executemany('DELETE FROM responses WHERE key = ?', victims)
+        self._size -= freed
+        self.evicted += len(victims)
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute('DELETE FROM responses')
+            conn.commit()
+            self._size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._connect().execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            size = self._size
+        lookups = self.hits + self.misses
+        return {
+            'enabled': LLM_CACHE_ENABLED,
+            'path': self.path,
+            'entries': entries,
+            'size_bytes': size,
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl_seconds,
+            'max_temperature': self.max_temperature,
+            'hits': self.hits,
+            'misses': self.misses,
+            'bypassed': self.bypassed,
+            'evicted': self.evicted,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+# Global cache instance (None unless LLM_CACHE_ENABLED)
+llm_cache = LLMCache() if LLM_CACHE_ENABLED else None
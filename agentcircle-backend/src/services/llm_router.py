@@ -0,0 +1,173 @@
+"""
+Latency-aware model routing and hedged LLM requests
+Tracks rolling per-model latency and error rates, routes within equivalence classes,
+and races a backup model once the primary runs past its p95
+"""
+import os
+import asyncio
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
+
+def _parse_classes(spec: str) -> Dict[str, List[str]]:
+    """'fast=a,b;strong=c,d' -> {'fast': ['a', 'b'], 'strong': ['c', 'd']}"""
+    classes = {}
+    for part in spec.split(';'):
+        if '=' in part:
+            name, models = part.split('=', 1)
+            classes[name.strip()] = [m.strip() for m in models.split(',') if m.strip()]
+    return classes
+
+# Models that are interchangeable for generation; routing never leaves a role's class
+LLM_MODEL_CLASSES = _parse_classes(os.getenv(
+    'LLM_MODEL_CLASSES',
+    'fast=gpt-4o-mini,claude-3-haiku,gemini-pro;strong=gpt-4o,claude-3-sonnet'
+))
+LLM_ROUTING_ENABLED = os.getenv('LLM_ROUTING_ENABLED', 'true').lower() == 'true'
+LLM_HEDGING_ENABLED = os.getenv('LLM_HEDGING_ENABLED', 'true').lower() == 'true'
+LLM_ROUTER_WINDOW = int(os.getenv('LLM_ROUTER_WINDOW', '100'))  # recent calls kept per model
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '10'))  # before p95 is trusted
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv('LLM_HEDGE_DEFAULT_DELAY', '15'))  # seconds, until then
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', '1'))
+LLM_ERROR_PENALTY = float(os.getenv('LLM_ERROR_PENALTY', '4'))  # score multiplier per unit error rate
+
+class ModelStats:
+    """Rolling window of latencies and outcomes for one model"""
+
+    def __init__(self, window: int = LLM_ROUTER_WINDOW):
+        self.latencies: deque = deque(maxlen=window)
+        self.outcomes: deque = deque(maxlen=window)  # True = error
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def score(self) -> float:
+        """Lower is better: median latency inflated by recent errors; unseen models go first"""
+        p50 = self.percentile(0.5)
+        if p50 is None:
+            return 0.0
+        return p50 * (1 + LLM_ERROR_PENALTY * self.error_rate)
+
+class LLMRouter:
+    """Chooses models and runs hedged calls"""
+
+    def __init__(self, classes: Dict[str, List[str]] = LLM_MODEL_CLASSES):
+        self.classes = classes
+        self._stats: Dict[str, ModelStats] = {}
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def _model_stats(self, model: str) -> ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = ModelStats()
+        return stats
+
+    def record(self, model: str, latency: float, error: bool):
+        """
+        Add one completed call; only successes are latency samples. Cancelled
+        calls (hedge losers) are not recorded: their elapsed time is only a
+        lower bound and would pull the percentiles down.
+        """
+        with self._lock:
+            stats = self._model_stats(model)
+            if not error:
+                stats.latencies.append(latency)
+            stats.outcomes.append(error)
+
+    def model_class(self, model: str) -> Optional[str]:
+        for name, models in self.classes.items():
+            if model in models:
+                return name
+        return None
+
+    def route(self, model: str, available: Dict[str, bool]) -> List[str]:
+        """
+        Eligible models for a role's configured model, best first
+
+        With routing enabled these are the available models of the same
+        class ordered by score; otherwise the configured model leads and
+        the rest of its class are only failover/hedge alternates.
+        """
+        peers = self.classes.get(self.model_class(model), [model])
+        eligible = [m for m in peers if available.get(m, False)]
+        if not eligible:
+            return [model]
+        with self._lock:
+            if LLM_ROUTING_ENABLED:
+                return sorted(eligible, key=lambda m: self._model_stats(m).score())
+            return sorted(eligible, key=lambda m: (m != model, self._model_stats(m).score()))
+
+    def hedge_delay(self, model: str) -> float:
+        """How long the primary may run before a backup request is sent"""
+        with self._lock:
+            stats = self._model_stats(model)
+            p95 = stats.percentile(0.95) if len(stats.latencies) >= LLM_HEDGE_MIN_SAMPLES else None
+        return max(LLM_HEDGE_MIN_DELAY, p95 if p95 is not None else LLM_HEDGE_DEFAULT_DELAY)
+
+    async def hedged(self, models: List[str], call: Callable[[str], Awaitable[Any]]) -> Tuple[str, Any]:
+        """
+        Run call(models[0]); if it hasn't finished after its hedge delay (or
+        fails), start call(models[1]) and take whichever succeeds first,
+        cancelling the other. Returns (model, result). Cancelling the caller
+        cancels whichever calls are still running.
+        """
+        if not LLM_HEDGING_ENABLED or len(models) < 2:
+            return models[0], await call(models[0])
+
+        primary = asyncio.ensure_future(call(models[0]))
+        tasks = {primary: models[0]}
+        try:
+            done, _ = await asyncio.wait([primary], timeout=self.hedge_delay(models[0]))
+            if not done or primary.exception() is not None:
+                backup = asyncio.ensure_future(call(models[1]))
+                tasks[backup] = models[1]
+                self.hedges += 1
+
+            error: Optional[BaseException] = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return tasks[task], task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {
+                model: {
+                    'samples': len(s.latencies),
+                    'p50': round(s.percentile(0.5), 3) if s.latencies else None,
+                    'p95': round(s.percentile(0.95), 3) if s.latencies else None,
+                    'error_rate': round(s.error_rate, 3),
+                    'score': round(s.score(), 3),
+                }
+                for model, s in self._stats.items()
+            }
+        return {
+            'routing_enabled': LLM_ROUTING_ENABLED,
+            'hedging_enabled': LLM_HEDGING_ENABLED,
+            'classes': self.classes,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'models': models,
+        }
+
+# Global router instance
+llm_router = LLMRouter()
@@ -4,16 +4,111 @@ Supports multiple models: GPT-4, Claude, Gemini, etc.
 """
 import os
 import json
+import time
 import random
+import asyncio
+import importlib.util
+import httpx
 import requests
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, AsyncIterator
 from datetime import datetime
 
+from services.metrics import track_llm, record_llm_tokens, record_llm_ttft, record_llm_output
+from services.rate_limiter import rate_limits, estimate_tokens
+from services.llm_cache import llm_cache
+from services.llm_router import llm_router
+from services.usage_tracker import usage_tracker, usage_context
+from services.prompt_compiler import prompt_compiler, personality
+from services.memory_service import memory_service
+from services.post_dedup import post_dedup
+from services.structured_output import (
+    OutputSchema, OutputValidationError, CHAT_SCHEMA, post_schema, repair_prompt,
+    LLM_STRUCTURED_OUTPUT, LLM_REPAIR_ATTEMPTS,
+)
+from utils.json_stream import JSONFieldExtractor
+
 # API Keys from environment
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY', '')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
 
+# Base URL overrides point providers at a proxy or the local mock (mock_llm_server.py);
+# LLM_BASE_URL applies to all three, {PROVIDER}_BASE_URL to one
+LLM_BASE_URL = os.getenv('LLM_BASE_URL', '')
+
+def _base_url(provider: str, default: str) -> str:
+    return (os.getenv(f'{provider.upper()}_BASE_URL') or LLM_BASE_URL or default).rstrip('/')
+
+PROVIDER_BASE_URLS = {
+    'openai': _base_url('openai', 'https://api.openai.com'),
+    'anthropic': _base_url('anthropic', 'https://api.anthropic.com'),
+    'gemini': _base_url('gemini', 'https://generativelanguage.googleapis.com'),
+}
+
+MAX_OUTPUT_TOKENS = 1500
+# Sampling temperature of generated posts and chat (Anthropic calls use the provider default, 1.0)
+LLM_TEMPERATURE = 0.8
+
+# Shared by every role and task, so it is a common cacheable prefix for all calls;
+# the role persona follows it and task instructions go in the user message.
+# The output format of every task lives only here, not in the user prompt,
+# which also keeps the shared prefix above the providers' cache minimums
+SYSTEM_PREAMBLE = """你正在参与「AgentCircle」——一个由历史人物与虚构角色组成的社交社区。
+社区里的每个角色都有自己的身份、来源和性格，他们在圈子里发帖、在聊天室里交谈。
+
+扮演规则：
+- 始终以你所扮演角色的身份、口吻和世界观说话，不要跳出角色，不要提及自己是AI或语言模型。
+- 内容要体现角色的个人风格和所处时代，可以有观点、有情绪，但不要生硬地复述设定。
+- 角色不知道其所处时代之后发生的事，遇到陌生的事物时以角色自己的方式去理解和评论。
+- 使用中文写作，语言自然，避免空洞的套话；古代人物可以使用半文半白的语气，但要让现代读者读得懂。
+- 不涉及现实中的政治人物和时事争议，不写违法、暴力或色情的细节，不对其他角色进行人身攻击。
+
+输出规则：
+- 只返回一个JSON对象，不要包含任何JSON以外的说明文字，也不要使用Markdown代码块。
+- 字段名只使用下面列出的英文名称，字段值为字符串或对象；没有列出的字段不要添加。
+- 所有文字字段都不能为空；列举多项内容时用换行分隔写在同一个字符串里。
+- 字符串中的换行和引号要正确转义，保证JSON可以被直接解析。
+
+发帖：返回 title（标题）、content（正文内容）和 metadata（元数据对象）三个字段。
+各内容类型的写法与 metadata 字段如下（任务说明会指明本次的内容类型）：
+- text（随笔）：title 为简短有力的标题；content 为一篇完整的随笔，三百字左右，有具体的事例、场景或感受，不要只讲道理。
+- poem（诗词）：title 为诗题；content 为诗词正文，可在末尾附一两句创作缘由。古体诗注意对仗、押韵和平仄，现代诗注意意象和节奏。
+- song（歌曲）：content 讲述这首歌的创作背景；metadata 中 lyrics 为完整歌词，主歌和副歌分段；genre 为曲风；mood 为情绪基调；inspiration 为灵感来源。
+- recipe（菜谱）：content 分享这道菜背后的故事和烹饪心得；metadata 中 ingredients 列出食材和用量；steps 按顺序写出步骤；cooking_time 为所需时间；difficulty 为难度（简单、中等或困难）；taste 为口味特点。
+- sword_manual（剑谱、武功秘籍）：content 讲述这门功夫的来历和要义；metadata 中 moves 列出招式名称和要领；internal_skill 为配套的内功心法；origin 为出处或师承；power_level 为威力评价。
+- medicine（药方、医术心得）：content 记录一则医案或行医心得；metadata 中 herbs 列出药材和剂量；effects 为功效；usage 为用法用量；precautions 为禁忌和注意事项；origin 为方剂出处。
+- theorem（定理、发现）：content 阐述问题的背景和结论，讲清楚它为什么重要；metadata 中 formula 为核心公式；proof 为推导过程；application 为实际应用；discoverer 为发现者；field 为所属学科。
+- story（故事）：content 为一个完整的故事，有开端、发展和结局，可以是亲身经历，也可以是传说或虚构。
+- philosophy（哲思）：content 提出一个问题并展开论证，可以设问、举例、反驳，最后给出你自己的看法。
+- 没有列出字段的内容类型，metadata 为空对象即可。
+
+聊天回复：返回 content（回复内容）和 emotion（情绪标签）两个字段。
+- content 为一到三句自然的对话，回应聊天室里最近的发言，符合当前场景和你与对方的关系；不要重复别人说过的话，也不要每次都以相同的方式开头。
+- emotion 为一个表示当前情绪的词，如开心、思考、惊讶、平静、感慨、不满。
+- 记忆中的往事可以自然地提起，但不要逐字复述。
+"""
+
+# Minimum cacheable prefix, in tokens, below which providers silently skip prompt caching
+PROMPT_CACHE_MIN_TOKENS = {'openai': 1024, 'anthropic': 1024, 'claude-3-haiku': 2048}
+
+def prefix_tokens(text: str) -> int:
+    """Token estimate for cache sizing: about one per CJK character, one per four other characters"""
+    cjk = sum(1 for ch in text if ch >= '\u2e80')
+    return cjk + (len(text) - cjk + 3) // 4
+
+# Used when nothing in a role's model class has an API key
+FALLBACK_MODELS = ['gpt-4o-mini', 'claude-3-haiku', 'gemini-pro']
+
+# Provider connection pools
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '60'))  # seconds per read/write
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '10'))
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '20'))  # per provider
+LLM_MAX_KEEPALIVE = int(os.getenv('LLM_MAX_KEEPALIVE', '10'))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '60'))
+LLM_HTTP2 = os.getenv('LLM_HTTP2', 'true').lower() == 'true'
+# HTTP/2 needs the optional h2 package (pip install httpx[http2])
+_HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
 class LLMService:
     """Service for generating content using various LLM models"""
     
@@ -93,6 +188,24 @@ class LLMService:
     
     def __init__(self):
         self.available_models = self._check_available_models()
+        self._content_schemas = {
+            content_type: post_schema(content_type, template.get('metadata_fields'))
+            for content_type, template in self.CONTENT_TEMPLATES.items()
+        }
+        # Every output tool in a fixed order, so the Anthropic prefix (tools, then system)
+        # is the same for all calls; tool_choice picks the one a call needs
+        self._anthropic_tools = [schema.anthropic_tool() for schema in self._content_schemas.values()]
+        self._anthropic_tools.append(CHAT_SCHEMA.anthropic_tool())
+        self._anthropic_tools[-1]['cache_control'] = {'type': 'ephemeral'}
+        # Keep-alive pools: a requests session for sync callers, one async client per provider
+        self._session = requests.Session()
+        self._session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=LLM_MAX_CONNECTIONS))
+        self._async_clients: Dict[str, httpx.AsyncClient] = {}
+        if LLM_HTTP2 and not _HTTP2_AVAILABLE:
+            print("[LLM] LLM_HTTP2 is set but the h2 package is missing (pip install httpx[http2]); using HTTP/1.1")
+        if llm_cache and llm_cache.max_temperature < LLM_TEMPERATURE:
+            print(f"[LLM] Response cache enabled, but generations sample at temperature {LLM_TEMPERATURE} "
+                  f"> LLM_CACHE_MAX_TEMPERATURE={llm_cache.max_temperature}; nothing will be cached")
     
     def _check_available_models(self) -> Dict[str, bool]:
         """Check which LLM APIs are available"""
@@ -115,6 +228,33 @@ class LLMService:
         Returns:
             Dictionary with title, content, metadata
         """
+        plan = self._plan_content(role, content_type)
+        try:
+            with usage_context(role=role.get('id'), content_type=plan['content_type']):
+                content = self._call_validated(plan['model'], plan['system_prompt'], plan['user_prompt'], plan['schema'])
+        except Exception as e:
+            print(f"[LLM] Generation failed: {e}")
+            # Fallback to template content
+            content = self._generate_fallback_content(role, plan['content_type'], plan['topic'])
+        return self._content_result(plan, content)
+    
+    async def agenerate_content(self, role: Dict, content_type: Optional[str] = None) -> Dict[str, Any]:
+        """Async generate_content over the pooled provider clients"""
+        plan = self._plan_content(role, content_type)
+        try:
+            # Hedge a slow primary with the next model of its class
+            with usage_context(role=role.get('id'), content_type=plan['content_type']):
+                plan['model'], content = await llm_router.hedged(
+                    plan['models'],
+                    lambda m: self._acall_validated(m, plan['system_prompt'], plan['user_prompt'], plan['schema'])
+                )
+        except Exception as e:
+            print(f"[LLM] Generation failed: {e}")
+            content = self._generate_fallback_content(role, plan['content_type'], plan['topic'])
+        return self._content_result(plan, content)
+    
+    def _plan_content(self, role: Dict, content_type: Optional[str]) -> Dict[str, Any]:
+        """Pick content type, topic and model, and build the prompts"""
         # Select content type based on role's personality if not specified
         if not content_type:
             content_type = self._select_content_type(role)
@@ -122,49 +262,52 @@ class LLMService:
         # Get template
         template = self.CONTENT_TEMPLATES.get(content_type, self.CONTENT_TEMPLATES['text'])
         
-        # Select topic
-        topic = random.choice(self.TOPICS)
-        
-        # Build system prompt based on role's personality
-        system_prompt = self._build_system_prompt(role)
-        
-        # Build user prompt
-        user_prompt = template['prompt'].format(topic=topic)
-        
-        # Select model based on role config
-        model = role.get('llm_model', 'gpt-4o-mini')
-        if not self.available_models.get(model, False):
-            # Fallback to available model
-            for m in ['gpt-4o-mini', 'claude-3-haiku', 'gemini-pro']:
-                if self.available_models.get(m, False):
-                    model = m
-                    break
-        
-        # Generate content
-        try:
-            content = self._call_llm(model, system_prompt, user_prompt, content_type)
-        except Exception as e:
-            print(f"[LLM] Generation failed: {e}")
-            # Fallback to template content
-            content = self._generate_fallback_content(role, content_type, topic)
+        topic = self._select_topic(role)
+        models = self._route_models(role)
         
-        # Build result
-        result = {
+        return {
+            'content_type': content_type,
+            'template': template,
+            'topic': topic,
+            # Role persona (stable per role, cached by providers); the task goes in the user prompt,
+            # its output format is in the shared preamble
+            'system_prompt': self._build_system_prompt(role),
+            'user_prompt': f"{template['prompt'].format(topic=topic)}\n\n内容类型：{content_type}",
+            'schema': self._content_schemas.get(content_type, self._content_schemas['text']),
+            'model': models[0],
+            'models': models,
+        }
+    
+    def _select_topic(self, role: Dict) -> str:
+        """A random topic, avoiding the ones the role's latest posts covered"""
+        covered = post_dedup.recent_topics(role.get('id'), self.TOPICS)
+        fresh = [t for t in self.TOPICS if t not in covered]
+        return random.choice(fresh or self.TOPICS)
+    
+    def _route_models(self, role: Dict) -> List[str]:
+        """Eligible models for a role, fastest first; the rest are hedge alternates"""
+        model = role.get('llm_model') or 'gpt-4o-mini'
+        models = llm_router.route(model, self.available_models)
+        if not self.available_models.get(models[0], False):
+            models = [m for m in FALLBACK_MODELS if self.available_models.get(m, False)] or [model]
+        return models
+    
+    def _content_result(self, plan: Dict[str, Any], content: Dict) -> Dict[str, Any]:
+        topic = plan['topic']
+        return {
             'title': content.get('title', f'关于{topic}的思考'),
             'content': content.get('content', ''),
-            'content_type': content_type,
+            'content_type': plan['content_type'],
             'metadata': content.get('metadata', {}),
-            'circle': random.choice(template.get('circles', ['闲聊杂谈'])),
+            'circle': random.choice(plan['template'].get('circles', ['闲聊杂谈'])),
             'topic': topic,
-            'model_used': model,
+            'model_used': plan['model'],
         }
-        
-        return result
     
     def _select_content_type(self, role: Dict) -> str:
         """Select content type based on role's personality and camp"""
         camp = role.get('camp', '')
-        personality = role.get('personality', {})
+        traits = personality(role)
         
         # Camp-based preferences
         camp_preferences = {
@@ -177,11 +320,11 @@ class LLMService:
         }
         
         # Personality-based preferences
-        if personality.get('openness', 50) > 70:
+        if traits['openness'] > 70:
             # Creative types
             creative_types = ['poem', 'song', 'story', 'philosophy']
             weights = [0.3, 0.2, 0.3, 0.2]
-        elif personality.get('conscientiousness', 50) > 70:
+        elif traits['conscientiousness'] > 70:
             # Structured types
             creative_types = ['theorem', 'medicine', 'recipe', 'sword_manual']
             weights = [0.3, 0.25, 0.25, 0.2]
@@ -200,151 +343,387 @@ class LLMService:
         return random.choice(available_types)
     
     def _build_system_prompt(self, role: Dict) -> str:
-        """Build system prompt based on role's personality"""
-        name = role.get('name', '未知')
-        title = role.get('title', '')
-        description = role.get('description', '')
-        camp = role.get('camp', '')
-        source = role.get('source', '')
-        
-        personality = role.get('personality', {})
-        openness = personality.get('openness', 50)
-        conscientiousness = personality.get('conscientiousness', 50)
-        extraversion = personality.get('extraversion', 50)
-        agreeableness = personality.get('agreeableness', 50)
-        neuroticism = personality.get('neuroticism', 50)
-        
-        # Build personality description
-        traits = []
-        if openness > 60:
-            traits.append('富有创造力和好奇心')
-        if conscientiousness > 60:
-            traits.append('认真负责、有条理')
-        if extraversion > 60:
-            traits.append('外向活泼、善于社交')
-        elif extraversion < 40:
-            traits.append('内向沉稳、喜欢独处')
-        if agreeableness > 60:
-            traits.append('友善温和、乐于助人')
-        if neuroticism > 60:
-            traits.append('情绪敏感、容易焦虑')
-        
-        trait_desc = '，'.join(traits) if traits else '性格平和'
-        
-        system_prompt = f"""你是{name}，{title}。
-{description}
-来源：{source}
-阵营：{camp}
-
-你的性格特点：{trait_desc}
-
-请根据你的身份和性格特点来创作内容。内容要体现你的个人风格和世界观。
-请以JSON格式返回，包含以下字段：
-- title: 标题
-- content: 正文内容
-- metadata: 元数据对象（根据内容类型包含不同字段）
-"""
-        
-        return system_prompt
+        """Role persona compiled and stored by prompt_compiler; sent after SYSTEM_PREAMBLE"""
+        return prompt_compiler.persona(role)
     
-    def _call_llm(self, model: str, system_prompt: str, user_prompt: str, content_type: str) -> Dict:
-        """Call LLM API based on model type"""
+    def _provider_for(self, model: str) -> str:
+        """Provider name for a model id"""
         if model.startswith('gpt'):
-            return self._call_openai(model, system_prompt, user_prompt)
+            return 'openai'
         elif model.startswith('claude'):
-            return self._call_anthropic(model, system_prompt, user_prompt)
+            return 'anthropic'
         elif model.startswith('gemini'):
-            return self._call_gemini(model, system_prompt, user_prompt)
-        else:
-            raise ValueError(f"Unknown model: {model}")
-    
-    def _call_openai(self, model: str, system_prompt: str, user_prompt: str) -> Dict:
-        """Call OpenAI API"""
-        url = 'https://api.openai.com/v1/chat/completions'
-        headers = {
-            'Authorization': f'Bearer {OPENAI_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        data = {
-            'model': model,
-            'messages': [
-                {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': user_prompt}
-            ],
-            'temperature': 0.8,
-            'max_tokens': 1500,
-        }
-        
-        response = requests.post(url, headers=headers, json=data, timeout=60)
-        response.raise_for_status()
-        
-        result = response.json()
-        content = result['choices'][0]['message']['content']
+            return 'gemini'
+        raise ValueError(f"Unknown model: {model}")
+    
+    def _call_llm(self, model: str, system_prompt: str, user_prompt: str, schema: OutputSchema) -> Dict:
+        """Call LLM API based on model type (blocking, over the pooled requests session)"""
+        provider = self._provider_for(model)
+        url, headers, body = self._build_request(provider, model, system_prompt, user_prompt, schema)
+        cache_key, cached = llm_cache.lookup(provider, url, body) if llm_cache else (None, None)
+        if cached is not None:
+            return self._parse_response(provider, cached, schema)
+        
+        limiter = rate_limits[provider]
+        estimate = estimate_tokens(SYSTEM_PREAMBLE, system_prompt, user_prompt, max_output_tokens=MAX_OUTPUT_TOKENS)
+        attempt = 0
+        started = time.monotonic()
+        while True:
+            limiter.acquire_sync(estimate)
+            try:
+                with track_llm(provider, model):
+                    response = self._session.post(PROVIDER_BASE_URLS[provider] + url, headers=headers, json=body,
+                                                  timeout=(LLM_CONNECT_TIMEOUT, LLM_TIMEOUT))
+                    response.raise_for_status()
+                    result = response.json()
+            except Exception as e:
+                limiter.refund(estimate)
+                delay = limiter.retry_delay(e, attempt)
+                if delay is None:
+                    llm_router.record(model, time.monotonic() - started, error=True)
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            llm_router.record(model, time.monotonic() - started, error=False)
+            limiter.settle(estimate, self._record_usage(provider, model, result))
+            # Only usable outputs are cached
+            content = self._parse_response(provider, result, schema)
+            if cache_key:
+                llm_cache.put(cache_key, provider, model, result)
+            return content
+    
+    async def _acall_llm(self, model: str, system_prompt: str, user_prompt: str, schema: OutputSchema) -> Dict:
+        """Call LLM API based on model type over the provider's pooled async client"""
+        provider = self._provider_for(model)
+        url, headers, body = self._build_request(provider, model, system_prompt, user_prompt, schema)
+        cache_key, cached = (await asyncio.to_thread(llm_cache.lookup, provider, url, body)
+                             if llm_cache else (None, None))
+        if cached is not None:
+            return self._parse_response(provider, cached, schema)
+        
+        limiter = rate_limits[provider]
+        estimate = estimate_tokens(SYSTEM_PREAMBLE, system_prompt, user_prompt, max_output_tokens=MAX_OUTPUT_TOKENS)
+        attempt = 0
+        started = time.monotonic()
+        while True:
+            # Wait for quota, retrying throttled/transient failures with backoff
+            try:
+                await limiter.acquire(estimate)
+                with track_llm(provider, model):
+                    response = await self._async_client(provider).post(url, headers=headers, json=body)
+                    response.raise_for_status()
+                    result = response.json()
+            except asyncio.CancelledError:
+                # Lost a hedge race: neither a latency sample nor an error, and the quota goes back
+                limiter.refund(estimate)
+                raise
+            except Exception as e:
+                limiter.refund(estimate)
+                delay = limiter.retry_delay(e, attempt)
+                if delay is None:
+                    llm_router.record(model, time.monotonic() - started, error=True)
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            llm_router.record(model, time.monotonic() - started, error=False)
+            limiter.settle(estimate, self._record_usage(provider, model, result))
+            # Only usable outputs are cached
+            content = self._parse_response(provider, result, schema)
+            if cache_key:
+                await asyncio.to_thread(llm_cache.put, cache_key, provider, model, result)
+            return content
+    
+    def _call_validated(self, model: str, system_prompt: str, user_prompt: str, schema: OutputSchema) -> Dict:
+        """_call_llm, re-prompting with the validation errors when the output is unusable"""
+        prompt, repairs = user_prompt, 0
+        while True:
+            try:
+                content = self._call_llm(model, system_prompt, prompt, schema)
+            except OutputValidationError as e:
+                if repairs >= LLM_REPAIR_ATTEMPTS:
+                    record_llm_output(self._provider_for(model), 'invalid')
+                    raise
+                repairs += 1
+                prompt = repair_prompt(user_prompt, e)
+                continue
+            record_llm_output(self._provider_for(model), 'repaired' if repairs else 'valid')
+            return content
+    
+    async def _acall_validated(self, model: str, system_prompt: str, user_prompt: str, schema: OutputSchema,
+                               failed: Optional[OutputValidationError] = None) -> Dict:
+        """
+        _acall_llm, re-prompting with the validation errors when the output is unusable
         
-        # Try to parse JSON
+        `failed` starts with a repair of an output obtained elsewhere (a stream).
+        """
+        provider = self._provider_for(model)
+        prompt, repairs = user_prompt, 0
+        error = failed
+        while True:
+            if error is not None:
+                if repairs >= LLM_REPAIR_ATTEMPTS:
+                    record_llm_output(provider, 'invalid')
+                    raise error
+                repairs += 1
+                prompt = repair_prompt(user_prompt, error)
+            try:
+                content = await self._acall_llm(model, system_prompt, prompt, schema)
+            except OutputValidationError as e:
+                error = e
+                continue
+            record_llm_output(provider, 'repaired' if repairs else 'valid')
+            return content
+    
+    async def _avalidate_stream(self, model: str, system_prompt: str, user_prompt: str, schema: OutputSchema,
+                                text: str) -> Dict:
+        """Validated streamed output; an unusable one is repaired with a non-streamed re-prompt"""
         try:
-            return json.loads(content)
-        except:
-            # Extract JSON from markdown
-            if '```json' in content:
-                json_str = content.split('```json')[1].split('```')[0].strip()
-                return json.loads(json_str)
-            elif '```' in content:
-                json_str = content.split('```')[1].split('```')[0].strip()
-                return json.loads(json_str)
-            else:
-                # Return as plain content
-                return {'title': '思考', 'content': content, 'metadata': {}}
-    
-    def _call_anthropic(self, model: str, system_prompt: str, user_prompt: str) -> Dict:
-        """Call Anthropic Claude API"""
-        url = 'https://api.anthropic.com/v1/messages'
-        headers = {
-            'x-api-key': ANTHROPIC_API_KEY,
-            'Content-Type': 'application/json',
-            'anthropic-version': '2023-06-01'
-        }
-        data = {
-            'model': model,
-            'max_tokens': 1500,
-            'system': system_prompt,
-            'messages': [{'role': 'user', 'content': user_prompt}]
-        }
-        
-        response = requests.post(url, headers=headers, json=data, timeout=60)
-        response.raise_for_status()
-        
-        result = response.json()
-        content = result['content'][0]['text']
+            content = schema.parse(text)
+        except OutputValidationError as e:
+            print(f"[LLM] Streamed output invalid ({e}), re-prompting")
+            return await self._acall_validated(model, system_prompt, user_prompt, schema, failed=e)
+        record_llm_output(self._provider_for(model), 'valid')
+        return content
+    
+    async def _astream_llm(self, model: str, system_prompt: str, user_prompt: str,
+                           schema: OutputSchema) -> AsyncIterator[str]:
+        """
+        Stream generated text deltas over the provider's pooled async client
         
-        try:
-            return json.loads(content)
-        except:
-            return {'title': '思考', 'content': content, 'metadata': {}}
-    
-    def _call_gemini(self, model: str, system_prompt: str, user_prompt: str) -> Dict:
-        """Call Google Gemini API"""
-        url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent?key={GEMINI_API_KEY}'
-        data = {
+        Failures before the first delta are retried like _acall_llm; streamed
+        responses are not cached or hedged.
+        """
+        provider = self._provider_for(model)
+        url, headers, body = self._build_request(provider, model, system_prompt, user_prompt, schema, stream=True)
+        limiter = rate_limits[provider]
+        estimate = estimate_tokens(SYSTEM_PREAMBLE, system_prompt, user_prompt, max_output_tokens=MAX_OUTPUT_TOKENS)
+        attempt = 0
+        started = time.monotonic()
+        while True:
+            await limiter.acquire(estimate)
+            final: Dict[str, Any] = {}  # usage collected from the events, shaped like a full response
+            streamed = False
+            try:
+                with track_llm(provider, model):
+                    async with self._async_client(provider).stream('POST', url, headers=headers, json=body) as response:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            data = line[5:].strip() if line.startswith('data:') else ''
+                            if not data or data == '[DONE]':
+                                continue
+                            text = self._stream_text(provider, json.loads(data), final)
+                            if text:
+                                if not streamed:
+                                    streamed = True
+                                    record_llm_ttft(provider, model, time.monotonic() - started)
+                                yield text
+            except Exception as e:
+                limiter.refund(estimate)
+                delay = None if streamed else limiter.retry_delay(e, attempt)
+                if delay is None:
+                    llm_router.record(model, time.monotonic() - started, error=True)
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            llm_router.record(model, time.monotonic() - started, error=False)
+            limiter.settle(estimate, self._record_usage(provider, model, final))
+            return
+    
+    def _stream_text(self, provider: str, event: Dict, final: Dict) -> str:
+        """Text delta of one streamed event, collecting usage into final"""
+        if provider == 'openai':
+            if event.get('usage'):
+                final['usage'] = event['usage']
+            choices = event.get('choices') or []
+            return (choices[0].get('delta') or {}).get('content') or '' if choices else ''
+        
+        if provider == 'anthropic':
+            kind = event.get('type')
+            if kind == 'content_block_delta':
+                # Text, or the tool input JSON when output goes through the schema tool
+                delta = event.get('delta', {})
+                return delta.get('text') or delta.get('partial_json') or ''
+            if kind == 'message_start':
+                final.setdefault('usage', {}).update(event.get('message', {}).get('usage') or {})
+            elif kind == 'message_delta':
+                final.setdefault('usage', {}).update(event.get('usage') or {})
+            elif kind == 'error':
+                raise RuntimeError(f"Anthropic stream error: {event.get('error')}")
+            return ''
+        
+        if event.get('usageMetadata'):
+            final['usageMetadata'] = event['usageMetadata']
+        candidates = event.get('candidates') or [{}]
+        parts = (candidates[0].get('content') or {}).get('parts') or []
+        return ''.join(part.get('text', '') for part in parts)
+    
+    # -------- Connection pools --------
+    
+    def _async_client(self, provider: str) -> httpx.AsyncClient:
+        """Shared keep-alive client for a provider, created on first use"""
+        client = self._async_clients.get(provider)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                base_url=PROVIDER_BASE_URLS[provider],
+                http2=LLM_HTTP2 and _HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            )
+            self._async_clients[provider] = client
+        return client
+    
+    async def aclose(self):
+        """Close pooled connections (call on shutdown)"""
+        for client in self._async_clients.values():
+            await client.aclose()
+        self._async_clients.clear()
+        self._session.close()
+    
+    # -------- Provider request building / response parsing --------
+    
+    def _build_request(self, provider: str, model: str, system_prompt: str, user_prompt: str,
+                       schema: Optional[OutputSchema] = None, stream: bool = False):
+        """
+        (url, headers, body) for a provider call; url is relative to PROVIDER_BASE_URLS
+        
+        Every request starts with the shared preamble, then the role persona, then
+        the per-call user prompt, so providers can reuse the cached prefix:
+        OpenAI caches matching prefixes automatically (its response_format schema
+        comes first, so per content type), Anthropic gets explicit cache_control
+        breakpoints after the tools, the preamble and the persona. Prefixes under
+        PROMPT_CACHE_MIN_TOKENS are not cached; see cache_prefix_stats().
+        
+        With a schema (and LLM_STRUCTURED_OUTPUT) the output is constrained to it:
+        an OpenAI json_schema response_format, a forced Anthropic tool whose input
+        is the output (all tools are sent, in a fixed order), or a Gemini responseSchema.
+        """
+        if not LLM_STRUCTURED_OUTPUT:
+            schema = None
+        if provider == 'openai':
+            headers = {'Authorization': f'Bearer {OPENAI_API_KEY}'}
+            body = {
+                'model': model,
+                'messages': [
+                    {'role': 'system', 'content': SYSTEM_PREAMBLE + '\n' + system_prompt},
+                    {'role': 'user', 'content': user_prompt}
+                ],
+                'temperature': LLM_TEMPERATURE,
+                'max_tokens': MAX_OUTPUT_TOKENS,
+            }
+            if schema:
+                body['response_format'] = schema.openai_response_format()
+            if stream:
+                body['stream'] = True
+                body['stream_options'] = {'include_usage': True}
+            return '/v1/chat/completions', headers, body
+        
+        if provider == 'anthropic':
+            headers = {'x-api-key': ANTHROPIC_API_KEY, 'anthropic-version': '2023-06-01'}
+            body = {
+                'model': model,
+                'max_tokens': MAX_OUTPUT_TOKENS,
+                'system': [
+                    {'type': 'text', 'text': SYSTEM_PREAMBLE, 'cache_control': {'type': 'ephemeral'}},
+                    {'type': 'text', 'text': system_prompt, 'cache_control': {'type': 'ephemeral'}},
+                ],
+                'messages': [{'role': 'user', 'content': user_prompt}]
+            }
+            if schema:
+                tools = self._anthropic_tools
+                if not any(tool['name'] == schema.name for tool in tools):
+                    tools = [schema.anthropic_tool()]
+                body['tools'] = tools
+                body['tool_choice'] = {'type': 'tool', 'name': schema.name}
+            if stream:
+                body['stream'] = True
+            return '/v1/messages', headers, body
+        
+        headers = {'x-goog-api-key': GEMINI_API_KEY}
+        body = {
             'contents': [{
-                'parts': [{'text': system_prompt + '\n\n' + user_prompt}]
+                'parts': [{'text': SYSTEM_PREAMBLE + '\n' + system_prompt + '\n\n' + user_prompt}]
             }],
             'generationConfig': {
-                'temperature': 0.8,
-                'maxOutputTokens': 1500,
+                'temperature': LLM_TEMPERATURE,
+                'maxOutputTokens': MAX_OUTPUT_TOKENS,
             }
         }
+        if schema:
+            body['generationConfig']['responseMimeType'] = 'application/json'
+            body['generationConfig']['responseSchema'] = schema.gemini_response_schema()
+        if stream:
+            return f'/v1beta/models/{model}:streamGenerateContent?alt=sse', headers, body
+        return f'/v1beta/models/{model}:generateContent', headers, body
+    
+    def cache_prefix_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Per model: estimated tokens of the prompt prefix shared by all roles, and
+        whether it reaches the provider's caching minimum (Gemini is not cached)
+        """
+        preamble = prefix_tokens(SYSTEM_PREAMBLE)
+        schemas = [*self._content_schemas.values(), CHAT_SCHEMA] if LLM_STRUCTURED_OUTPUT else []
+        shared = {
+            'anthropic': preamble + (prefix_tokens(json.dumps(self._anthropic_tools, ensure_ascii=False)) if schemas else 0),
+            # response_format precedes the messages, so only the smallest schema is shared by every call
+            'openai': preamble + min((prefix_tokens(json.dumps(s.openai_response_format(), ensure_ascii=False))
+                                      for s in schemas), default=0),
+        }
+        stats = {}
+        for model in self.available_models:
+            provider = self._provider_for(model)
+            if provider in shared:
+                minimum = PROMPT_CACHE_MIN_TOKENS.get(model, PROMPT_CACHE_MIN_TOKENS[provider])
+                stats[model] = {'shared_prefix_tokens': shared[provider], 'min_tokens': minimum,
+                                'cacheable': shared[provider] >= minimum}
+        return stats
+    
+    def _record_usage(self, provider: str, model: str, result: Dict) -> int:
+        """
+        Report and account token usage from a provider response, returns total tokens
         
-        response = requests.post(url, json=data, timeout=60)
-        response.raise_for_status()
-        
-        result = response.json()
-        content = result['candidates'][0]['content']['parts'][0]['text']
-        
-        try:
-            return json.loads(content)
-        except:
-            return {'title': '思考', 'content': content, 'metadata': {}}
+        prompt counts all input tokens; cached is the part served from the
+        provider's prompt cache, cache_write the part written to it (Anthropic).
+        """
+        cache_write = 0
+        if provider == 'openai':
+            usage = result.get('usage') or {}
+            prompt, completion = usage.get('prompt_tokens') or 0, usage.get('completion_tokens') or 0
+            cached = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+        elif provider == 'anthropic':
+            # input_tokens excludes cache reads and writes
+            usage = result.get('usage') or {}
+            cached = usage.get('cache_read_input_tokens') or 0
+            cache_write = usage.get('cache_creation_input_tokens') or 0
+            prompt = (usage.get('input_tokens') or 0) + cached + cache_write
+            completion = usage.get('output_tokens') or 0
+        else:
+            usage = result.get('usageMetadata') or {}
+            prompt, completion = usage.get('promptTokenCount') or 0, usage.get('candidatesTokenCount') or 0
+            cached = usage.get('cachedContentTokenCount') or 0
+        record_llm_tokens(provider, model, prompt, completion, cached, cache_write)
+        usage_tracker.record(provider, model, prompt, completion, cached, cache_write)
+        return prompt + completion
+    
+    def _parse_response(self, provider: str, result: Dict, schema: OutputSchema) -> Dict:
+        """Validated output of a provider response; raises OutputValidationError when unusable"""
+        if provider == 'openai':
+            message = result['choices'][0]['message']
+            output = message.get('content') or message.get('refusal') or ''
+        elif provider == 'anthropic':
+            blocks = result.get('content') or []
+            tool_inputs = [block['input'] for block in blocks if block.get('type') == 'tool_use']
+            output = tool_inputs[0] if tool_inputs else ''.join(block.get('text', '') for block in blocks)
+        else:
+            parts = (result['candidates'][0].get('content') or {}).get('parts') or []
+            output = ''.join(part.get('text', '') for part in parts)
+        return schema.parse(output)
     
     def _generate_fallback_content(self, role: Dict, content_type: str, topic: str) -> Dict:
         """Generate fallback content when LLM fails"""
@@ -392,39 +771,96 @@ class LLMService:
     
     def generate_chat_message(self, role: Dict, context: List[Dict], scene: str) -> Dict:
         """Generate a chat message for a role in a conversation"""
+        memory_service.load(role.get('id'))
+        system_prompt, user_prompt, models = self._plan_chat(role, context, scene)
+        try:
+            with usage_context(role=role.get('id'), content_type='chat'):
+                result = self._call_validated(models[0], system_prompt, user_prompt, CHAT_SCHEMA)
+        except Exception as e:
+            print(f"[LLM] Chat generation failed: {e}")
+            return self._fallback_chat_message(role)
+        return self._chat_result(result)
+    
+    async def agenerate_chat_message(self, role: Dict, context: List[Dict], scene: str) -> Dict:
+        """Async generate_chat_message over the pooled provider clients"""
+        await memory_service.aload(role.get('id'))
+        system_prompt, user_prompt, models = self._plan_chat(role, context, scene)
+        try:
+            with usage_context(role=role.get('id'), content_type='chat'):
+                _, result = await llm_router.hedged(
+                    models, lambda m: self._acall_validated(m, system_prompt, user_prompt, CHAT_SCHEMA)
+                )
+        except Exception as e:
+            print(f"[LLM] Chat generation failed: {e}")
+            return self._fallback_chat_message(role)
+        return self._chat_result(result)
+    
+    async def astream_chat_message(self, role: Dict, context: List[Dict], scene: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming generate_chat_message: yields {'field', 'text'} deltas of the
+        content and emotion as they parse, then {'message': ...} with the full reply
+        """
+        await memory_service.aload(role.get('id'))
+        system_prompt, user_prompt, models = self._plan_chat(role, context, scene)
+        extractor = JSONFieldExtractor(['content', 'emotion'])
+        chunks = []
+        try:
+            with usage_context(role=role.get('id'), content_type='chat'):
+                async for text in self._astream_llm(models[0], system_prompt, user_prompt, CHAT_SCHEMA):
+                    chunks.append(text)
+                    for field, delta, _ in extractor.feed(text):
+                        if delta:
+                            yield {'field': field, 'text': delta}
+                result = await self._avalidate_stream(models[0], system_prompt, user_prompt, CHAT_SCHEMA,
+                                                      ''.join(chunks))
+            message = self._chat_result(result)
+        except Exception as e:
+            print(f"[LLM] Streaming chat generation failed: {e}")
+            message = self._fallback_chat_message(role)
+        yield {'message': message}
+    
+    def _plan_chat(self, role: Dict, context: List[Dict], scene: str):
+        """(system_prompt, user_prompt, candidate models) for a chat reply"""
         system_prompt = self._build_system_prompt(role)
         
         # Build context
+        recent = context[-5:]  # Last 5 messages
         context_str = '\n'.join([
             f"{msg.get('sender_name', '某人')}: {msg.get('content', '')}"
-            for msg in context[-5:]  # Last 5 messages
+            for msg in recent
         ])
         
+        # Older memories relevant to the scene and recent messages, within a fixed prompt budget;
+        # the quoted messages themselves are remembered too, so they are excluded from recall
+        sent_at = [msg['created_at'] for msg in recent if msg.get('created_at')]
+        memories = memory_service.context_for(
+            role.get('id'), f"{scene}\n{context_str}",
+            before=min(sent_at) if sent_at else None,
+            exclude=[msg.get('content', '') for msg in recent],
+        )
+        memory_str = f"\n你记得的往事：\n{memories}\n" if memories else ''
+        
         user_prompt = f"""场景：{scene}
-
+{memory_str}
 对话历史：
 {context_str}
 
-请根据场景和对话历史，以你的身份回复一条消息。保持你的性格特点，回复要自然、有深度。
-
-请以JSON格式返回：
-- content: 回复内容
-- emotion: 情绪标签（如：开心、思考、惊讶、平静等）
+请根据场景、你的记忆和对话历史，以你的身份回复一条消息。保持你的性格特点，回复要自然、有深度。
 """
         
-        model = role.get('llm_model', 'gpt-4o-mini')
-        try:
-            result = self._call_llm(model, system_prompt, user_prompt, 'chat')
-            return {
-                'content': result.get('content', '...'),
-                'emotion': result.get('emotion', 'neutral')
-            }
-        except Exception as e:
-            print(f"[LLM] Chat generation failed: {e}")
-            return {
-                'content': f"{role.get('name', '我')}沉思片刻，缓缓开口...",
-                'emotion': 'thinking'
-            }
+        return system_prompt, user_prompt, self._route_models(role)
+    
+    def _chat_result(self, result: Dict) -> Dict:
+        return {
+            'content': result.get('content', '...'),
+            'emotion': result.get('emotion', 'neutral')
+        }
+    
+    def _fallback_chat_message(self, role: Dict) -> Dict:
+        return {
+            'content': f"{role.get('name', '我')}沉思片刻，缓缓开口...",
+            'emotion': 'thinking'
+        }
 
 # Global LLM service instance
 llm_service = LLMService()
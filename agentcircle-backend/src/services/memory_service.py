@@ -0,0 +1,289 @@
+"""
+Role memory retrieval
+Memories are embedded locally with hashed character n-grams and kept per role in
+a contiguous NumPy matrix; recall scores similarity, recency and importance in
+one vectorized pass
+"""
+import os
+import re
+import uuid
+import asyncio
+import zlib
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Iterable, Tuple
+
+import numpy as np
+
+from services.storage_service import storage
+
+MEMORY_ENABLED = os.getenv('MEMORY_ENABLED', 'true').lower() == 'true'
+MEMORY_DIM = int(os.getenv('MEMORY_DIM', '1024'))  # hashed feature buckets
+MEMORY_MAX_PER_ROLE = int(os.getenv('MEMORY_MAX_PER_ROLE', '2000'))  # newest kept in the index
+MEMORY_TOP_K = int(os.getenv('MEMORY_TOP_K', '4'))
+MEMORY_HALF_LIFE_HOURS = float(os.getenv('MEMORY_HALF_LIFE_HOURS', '72'))
+MEMORY_MIN_SIMILARITY = float(os.getenv('MEMORY_MIN_SIMILARITY', '0.1'))
+# score = similarity * w_sim + recency * w_rec + importance * w_imp, each term in [0, 1]
+MEMORY_SIMILARITY_WEIGHT = float(os.getenv('MEMORY_SIMILARITY_WEIGHT', '1.0'))
+MEMORY_RECENCY_WEIGHT = float(os.getenv('MEMORY_RECENCY_WEIGHT', '0.3'))
+MEMORY_IMPORTANCE_WEIGHT = float(os.getenv('MEMORY_IMPORTANCE_WEIGHT', '0.2'))
+# Prompt budget for recalled memories, and the share of it one memory may take
+MEMORY_CONTEXT_CHARS = int(os.getenv('MEMORY_CONTEXT_CHARS', '600'))
+MEMORY_ITEM_CHARS = int(os.getenv('MEMORY_ITEM_CHARS', '150'))
+# Only the tail of a long query is embedded
+MEMORY_QUERY_CHARS = 400
+
+# Default importance (0-100) by memory type
+MEMORY_IMPORTANCE = {'post': 60, 'said': 40, 'heard': 30}
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+def _features(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    """(bucket, sign) of each character bigram and trigram"""
+    text = _NON_WORD.sub(' ', text.lower()).strip()
+    hashes = [
+        zlib.crc32(text[i:i + n].encode('utf-8'))
+        for n in (2, 3) for i in range(len(text) - n + 1)
+        if ' ' not in text[i:i + n]
+    ]
+    if not hashes:
+        hashes = [zlib.crc32(text.encode('utf-8'))] if text else []
+    h = np.fromiter(hashes, dtype=np.uint32, count=len(hashes))
+    return (h % MEMORY_DIM).astype(np.intp), np.where(h & 0x80000000, -1.0, 1.0)
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """L2-normalized hashed n-gram vectors, one float32 row per text"""
+    vectors = np.zeros((len(texts), MEMORY_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        buckets, signs = _features(text)
+        if len(buckets):
+            vectors[row] = np.bincount(buckets, weights=signs, minlength=MEMORY_DIM)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+def _timestamp(value: Optional[str]) -> float:
+    """Epoch seconds of a stored created_at (naive values are UTC)"""
+    if not value:
+        return time.time()
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return time.time()
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+class MemoryIndex:
+    """One role's memories: embedding matrix rows with parallel created/importance arrays"""
+
+    def __init__(self, capacity: int = 64):
+        self.vectors = np.zeros((capacity, MEMORY_DIM), dtype=np.float32)
+        self.created = np.zeros(capacity, dtype=np.float64)
+        self.importance = np.zeros(capacity, dtype=np.float32)
+        self.memories: List[Dict[str, Any]] = []
+
+    @property
+    def size(self) -> int:
+        return len(self.memories)
+
+    def add(self, memories: List[Dict[str, Any]], vectors: np.ndarray):
+        """Append rows, growing the arrays geometrically; trims to the newest MEMORY_MAX_PER_ROLE"""
+        start, end = self.size, self.size + len(memories)
+        if end > len(self.vectors):
+            capacity = max(end, 2 * len(self.vectors))
+            for name in ('vectors', 'created', 'importance'):
+                old = getattr(self, name)
+                grown = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+                grown[:start] = old[:start]
+                setattr(self, name, grown)
+        self.vectors[start:end] = vectors
+        self.created[start:end] = [_timestamp(m.get('created_at')) for m in memories]
+        self.importance[start:end] = [(m.get('importance') or 50) / 100 for m in memories]
+        self.memories.extend(memories)
+        # Some slack so trimming (a full copy) is amortized over many adds
+        if self.size > MEMORY_MAX_PER_ROLE + MEMORY_MAX_PER_ROLE // 8:
+            self._trim()
+
+    def _trim(self):
+        keep = np.sort(np.argsort(self.created[:self.size], kind='stable')[-MEMORY_MAX_PER_ROLE:])
+        n = len(keep)
+        self.vectors[:n] = self.vectors[keep]
+        self.created[:n] = self.created[keep]
+        self.importance[:n] = self.importance[keep]
+        self.memories = [self.memories[i] for i in keep]
+
+    def search(self, query: np.ndarray, k: int, now: float,
+               before: Optional[float] = None) -> List[Tuple[float, Dict[str, Any]]]:
+        """Top k (score, memory) by combined similarity, recency and importance, optionally only those created before a time"""
+        n = self.size
+        if not n or k <= 0:
+            return []
+        similarity = self.vectors[:n] @ query
+        recency = np.exp2((self.created[:n] - now) / (MEMORY_HALF_LIFE_HOURS * 3600))
+        scores = (MEMORY_SIMILARITY_WEIGHT * similarity + MEMORY_RECENCY_WEIGHT * recency
+                  + MEMORY_IMPORTANCE_WEIGHT * self.importance[:n])
+        # Recency and importance rank relevant memories; they don't make irrelevant ones relevant
+        scores[similarity < MEMORY_MIN_SIMILARITY] = -np.inf
+        if before is not None:
+            scores[self.created[:n] >= before] = -np.inf
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.memories[i]) for i in top if np.isfinite(scores[i])]
+
+class MemoryService:
+    """
+    Per-role memory indexes, loaded from storage before first use and updated as memories are added
+
+    load() does the storage read and embedding; recall() only searches indexes
+    already in memory, so it never blocks on storage.
+    """
+
+    def __init__(self):
+        self._indexes: Dict[str, MemoryIndex] = {}
+        # role_id -> memories remembered while its index was being loaded
+        self._loading: Dict[str, List[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self.recalls = 0
+        self.recall_seconds = 0.0
+        self.max_recall_seconds = 0.0
+
+    def load(self, role_id: str):
+        """Build a role's index from its stored memories unless loaded (blocking; run it in a thread)"""
+        if not MEMORY_ENABLED or not role_id or role_id in self._indexes:
+            return
+        with self._lock:
+            if role_id in self._indexes:
+                return
+            arrived = self._loading.setdefault(role_id, [])
+        try:
+            rows = storage.get_memories(role_id, limit=MEMORY_MAX_PER_ROLE)[::-1]
+        except Exception as e:
+            # Recall finds nothing for the role until a later load succeeds
+            print(f"[Memory] Failed to load memories for {role_id}: {e}")
+            return
+        index = MemoryIndex(capacity=max(64, len(rows)))
+        index.add(rows, embed_texts([row['content'] for row in rows]))
+        with self._lock:
+            if role_id in self._indexes:
+                return
+            # Memories stored after the read above would otherwise be missing until restart
+            loaded = {row['id'] for row in rows}
+            missed = [m for m in arrived if m['id'] not in loaded]
+            if missed:
+                index.add(missed, embed_texts([m['content'] for m in missed]))
+            self._indexes[role_id] = index
+            self._loading.pop(role_id, None)
+
+    async def aload(self, role_id: str):
+        """load() on a worker thread, skipped when the index is already in memory"""
+        if MEMORY_ENABLED and role_id and role_id not in self._indexes:
+            await asyncio.to_thread(self.load, role_id)
+
+    def remember(self, memories: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Store memories and add them to the indexes already loaded"""
+        if not MEMORY_ENABLED or not memories:
+            return []
+        for memory in memories:
+            memory.setdefault('id', f"mem_{uuid.uuid4().hex[:16]}")
+            memory.setdefault('memory_type', 'experience')
+            memory.setdefault('importance', MEMORY_IMPORTANCE.get(memory['memory_type'], 50))
+        storage.create_memories(memories)
+
+        by_role: Dict[str, List[Dict[str, Any]]] = {}
+        for memory in memories:
+            by_role.setdefault(memory['role_id'], []).append(memory)
+        with self._lock:
+            for role_id, rows in by_role.items():
+                index = self._indexes.get(role_id)
+                if index is not None:
+                    index.add(rows, embed_texts([row['content'] for row in rows]))
+                elif role_id in self._loading:
+                    self._loading[role_id].extend(rows)
+        return memories
+
+    def recall(self, role_id: str, query: str, k: int = MEMORY_TOP_K, before: Optional[str] = None,
+               exclude: Iterable[str] = ()) -> List[Dict[str, Any]]:
+        """
+        The role's k most relevant memories for a query, with their scores
+
+        Searches only a loaded index (nothing before load()). Memories created
+        at or after `before`, or recording one of the `exclude` texts, are
+        skipped, so the messages a prompt already quotes are not recalled too.
+        """
+        if not MEMORY_ENABLED or not role_id or not query.strip():
+            return []
+        exclude = [text for text in exclude if text]
+        started = time.perf_counter()
+        query_vector = embed_texts([query[-MEMORY_QUERY_CHARS:]])[0]
+        with self._lock:
+            index = self._indexes.get(role_id)
+            if index is None:
+                return []
+            hits = index.search(query_vector, k + len(exclude), time.time(),
+                                before=_timestamp(before) if before else None)
+            elapsed = time.perf_counter() - started
+            self.recalls += 1
+            self.recall_seconds += elapsed
+            self.max_recall_seconds = max(self.max_recall_seconds, elapsed)
+        hits = [(score, memory) for score, memory in hits
+                if not any(memory['content'].endswith(text) for text in exclude)][:k]
+        return [{**memory, 'score': round(score, 4)} for score, memory in hits]
+
+    def context_for(self, role_id: str, query: str, before: Optional[str] = None,
+                    exclude: Iterable[str] = ()) -> str:
+        """Recalled memories as prompt lines, within MEMORY_CONTEXT_CHARS"""
+        lines, used = [], 0
+        for memory in self.recall(role_id, query, before=before, exclude=exclude):
+            content = memory['content']
+            if len(content) > MEMORY_ITEM_CHARS:
+                content = content[:MEMORY_ITEM_CHARS] + '…'
+            if used + len(content) > MEMORY_CONTEXT_CHARS:
+                break
+            lines.append(f"- {content}")
+            used += len(content)
+        return '\n'.join(lines)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sizes = [index.size for index in self._indexes.values()]
+        return {
+            'enabled': MEMORY_ENABLED,
+            'loaded_roles': len(sizes),
+            'indexed_memories': sum(sizes),
+            'recalls': self.recalls,
+            'avg_recall_ms': round(self.recall_seconds / self.recalls * 1000, 3) if self.recalls else 0.0,
+            'max_recall_ms': round(self.max_recall_seconds * 1000, 3),
+        }
+
+def chat_memories(message: Dict[str, Any], room: Dict[str, Any], speaker_name: str) -> List[Dict[str, Any]]:
+    """What the speaker said, and what each other participant heard"""
+    where = room.get('name') or '聊天室'
+    others = [rid for rid in room.get('participant_ids', []) if rid != message['sender_id']]
+    memories = [{
+        'role_id': message['sender_id'],
+        'content': f"在「{where}」里，我说：{message['content']}",
+        'memory_type': 'said',
+        'related_role_ids': others,
+    }]
+    memories += [{
+        'role_id': role_id,
+        'content': f"在「{where}」里，{speaker_name}说：{message['content']}",
+        'memory_type': 'heard',
+        'related_role_ids': [message['sender_id']],
+    } for role_id in others]
+    return memories
+
+def post_memory(post: Dict[str, Any], circle_name: Optional[str] = None) -> Dict[str, Any]:
+    """The author's memory of publishing a post"""
+    where = f"在{circle_name}" if circle_name else ''
+    return {
+        'role_id': post['author_id'],
+        'content': f"我{where}发表了《{post['title']}》：{post['content'][:MEMORY_ITEM_CHARS]}",
+        'memory_type': 'post',
+    }
+
+# Global memory service
+memory_service = MemoryService()
@@ -0,0 +1,246 @@
+"""
+Prometheus metrics for AgentCircle
+Route, storage, LLM and scheduler instrumentation exposed on /metrics
+"""
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Any
+
+from prometheus_client import Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+# Latency buckets (seconds): fast storage reads up to multi-second LLM calls
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# ==================== HTTP ====================
+
+HTTP_REQUEST_DURATION = Histogram(
+    'agentcircle_http_request_duration_seconds',
+    'HTTP request latency by route template',
+    ['method', 'route', 'status'],
+    buckets=FAST_BUCKETS,
+)
+
+# ==================== Storage ====================
+
+STORAGE_DURATION = Histogram(
+    'agentcircle_storage_operation_duration_seconds',
+    'StorageService method latency by backend',
+    ['method', 'backend'],
+    buckets=FAST_BUCKETS,
+)
+STORAGE_ERRORS = Counter(
+    'agentcircle_storage_errors_total',
+    'StorageService backend errors',
+    ['method', 'backend'],
+)
+STORAGE_FALLBACKS = Counter(
+    'agentcircle_storage_fallbacks_total',
+    'Reads served by SQLite after Supabase failed',
+    ['method'],
+)
+
+# ==================== LLM ====================
+
+LLM_REQUEST_DURATION = Histogram(
+    'agentcircle_llm_request_duration_seconds',
+    'LLM provider call latency',
+    ['provider', 'model'],
+    buckets=SLOW_BUCKETS,
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    'agentcircle_llm_time_to_first_token_seconds',
+    'Time until a streamed LLM call produced its first text',
+    ['provider', 'model'],
+    buckets=SLOW_BUCKETS,
+)
+LLM_ERRORS = Counter(
+    'agentcircle_llm_errors_total',
+    'Failed LLM provider calls',
+    ['provider', 'model', 'error'],
+)
+LLM_TOKENS = Counter(
+    'agentcircle_llm_tokens_total',
+    'Tokens reported by LLM providers',
+    ['provider', 'model', 'kind'],
+)
+LLM_COST = Counter(
+    'agentcircle_llm_cost_usd_total',
+    'Estimated LLM spend from reported token usage',
+    ['provider', 'model'],
+)
+LLM_RETRIES = Counter(
+    'agentcircle_llm_retries_total',
+    'LLM calls retried after a retryable failure',
+    ['provider', 'reason'],
+)
+LLM_OUTPUTS = Counter(
+    'agentcircle_llm_outputs_total',
+    'Generated outputs by validation outcome (valid, repaired, invalid)',
+    ['provider', 'outcome'],
+)
+LLM_CACHE_REQUESTS = Counter(
+    'agentcircle_llm_cache_requests_total',
+    'LLM response cache lookups by result (hit, miss, bypass)',
+    ['provider', 'result'],
+)
+
+# ==================== Content ====================
+
+POST_DUPLICATES = Counter(
+    'agentcircle_post_duplicates_total',
+    'Generated posts dropped as near-duplicates of recent posts',
+    ['content_type'],
+)
+
+# ==================== Scheduler ====================
+
+SCHEDULER_JOB_DURATION = Histogram(
+    'agentcircle_scheduler_job_duration_seconds',
+    'Scheduler job run duration',
+    ['job'],
+    buckets=SLOW_BUCKETS,
+)
+SCHEDULER_JOB_RUNS = Counter(
+    'agentcircle_scheduler_job_runs_total',
+    'Scheduler job runs by outcome',
+    ['job', 'status'],
+)
+SCHEDULER_JOB_ITEMS = Counter(
+    'agentcircle_scheduler_job_items_total',
+    'Items (posts, messages, roles...) processed by scheduler jobs',
+    ['job'],
+)
+SCHEDULER_JOB_ITEM_OUTCOMES = Counter(
+    'agentcircle_scheduler_job_item_outcomes_total',
+    'Fanned-out scheduler job items by outcome',
+    ['job', 'outcome'],
+)
+
+@contextmanager
+def track_storage(method: str, backend: str, fallback: bool = False):
+    """Time a storage backend call; on failure count an error (and a fallback for reads)"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STORAGE_ERRORS.labels(method, backend).inc()
+        if fallback:
+            STORAGE_FALLBACKS.labels(method).inc()
+        raise
+    finally:
+        STORAGE_DURATION.labels(method, backend).observe(time.perf_counter() - started)
+
+@contextmanager
+def track_llm(provider: str, model: str):
+    """Time an LLM provider call and count its failures"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        LLM_ERRORS.labels(provider, model, type(e).__name__).inc()
+        raise
+    finally:
+        LLM_REQUEST_DURATION.labels(provider, model).observe(time.perf_counter() - started)
+
+def record_llm_ttft(provider: str, model: str, seconds: float):
+    LLM_TIME_TO_FIRST_TOKEN.labels(provider, model).observe(seconds)
+
+def record_llm_tokens(provider: str, model: str, prompt_tokens: int, completion_tokens: int,
+                      cached_tokens: int = 0, cache_write_tokens: int = 0):
+    """cached/cache_write are the parts of prompt_tokens read from / written to the provider's prompt cache"""
+    for kind, count in (('prompt', prompt_tokens), ('completion', completion_tokens),
+                        ('cached', cached_tokens), ('cache_write', cache_write_tokens)):
+        if count:
+            LLM_TOKENS.labels(provider, model, kind).inc(count)
+
+def record_llm_cost(provider: str, model: str, usd: float):
+    if usd:
+        LLM_COST.labels(provider, model).inc(usd)
+
+def record_llm_retry(provider: str, reason: str):
+    LLM_RETRIES.labels(provider, reason).inc()
+
+def record_llm_output(provider: str, outcome: str):
+    LLM_OUTPUTS.labels(provider, outcome).inc()
+
+def record_llm_cache(provider: str, result: str):
+    LLM_CACHE_REQUESTS.labels(provider, result).inc()
+
+def record_duplicate_post(content_type: str):
+    POST_DUPLICATES.labels(content_type).inc()
+
+def record_job_run(job: str, duration: float, items: int, status: str):
+    SCHEDULER_JOB_DURATION.labels(job).observe(duration)
+    SCHEDULER_JOB_RUNS.labels(job, status).inc()
+    if items:
+        SCHEDULER_JOB_ITEMS.labels(job).inc(items)
+
+def record_job_items(job: str, succeeded: int, failed: int, timed_out: int):
+    for outcome, count in (('succeeded', succeeded), ('failed', failed), ('timed_out', timed_out)):
+        if count:
+            SCHEDULER_JOB_ITEM_OUTCOMES.labels(job, outcome).inc(count)
+
+class StatsCollector:
+    """Exports in-process stats dicts (admission, single-flight) at scrape time"""
+
+    def __init__(self, admission_stats: Callable[[], Dict[str, Any]], single_flight_stats: Callable[[], Dict[str, Any]]):
+        self.admission_stats = admission_stats
+        self.single_flight_stats = single_flight_stats
+
+    def collect(self):
+        admission = self.admission_stats()
+        active = GaugeMetricFamily('agentcircle_admission_active', 'Requests holding a slot', labels=['route_class'])
+        depth = GaugeMetricFamily('agentcircle_admission_queue_depth', 'Requests waiting for a slot', labels=['route_class'])
+        shed = CounterMetricFamily('agentcircle_admission_shed', 'Requests rejected with 503', labels=['route_class', 'reason'])
+        for route_class, s in admission.items():
+            active.add_metric([route_class], s['active'])
+            depth.add_metric([route_class], s['queue_depth'])
+            shed.add_metric([route_class, 'queue_full'], s['shed_queue_full'])
+            shed.add_metric([route_class, 'queue_timeout'], s['shed_timeout'])
+        yield active
+        yield depth
+        yield shed
+
+        flights = self.single_flight_stats()
+        requests = CounterMetricFamily('agentcircle_singleflight_requests', 'Requests through single-flight', labels=['route'])
+        coalesced = CounterMetricFamily('agentcircle_singleflight_coalesced', 'Requests that shared an in-flight result', labels=['route'])
+        for route, s in flights['routes'].items():
+            requests.add_metric([route], s['requests'])
+            coalesced.add_metric([route], s['coalesced'])
+        yield requests
+        yield coalesced
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency by route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {'code': 500}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope; templates keep cardinality bounded
+            route = scope.get('route')
+            label = getattr(route, 'path', None) or 'unmatched'
+            HTTP_REQUEST_DURATION.labels(scope['method'], label, str(status['code'])).observe(
+                time.perf_counter() - started
+            )
+
+def render_metrics():
+    """Prometheus text exposition of the default registry"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
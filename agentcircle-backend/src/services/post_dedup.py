@@ -0,0 +1,163 @@
+"""
+Near-duplicate post detection
+MinHash signatures of recent posts in a sliding window; a new post whose
+estimated Jaccard similarity to any of them reaches the threshold is a duplicate.
+Also remembers what each role wrote about recently, for topic steering.
+"""
+import os
+import re
+import zlib
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, List, Iterable, Set, Deque, Tuple
+
+import numpy as np
+
+from services.storage_service import storage
+
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'true').lower() == 'true'
+DEDUP_SIMILARITY_THRESHOLD = float(os.getenv('DEDUP_SIMILARITY_THRESHOLD', '0.7'))  # estimated Jaccard
+DEDUP_WINDOW = int(os.getenv('DEDUP_WINDOW', '2000'))  # most recent posts compared against
+DEDUP_NUM_PERM = int(os.getenv('DEDUP_NUM_PERM', '64'))
+DEDUP_SHINGLE_CHARS = int(os.getenv('DEDUP_SHINGLE_CHARS', '3'))
+# A role's last N posts count as its recently covered topics
+RECENT_TOPICS_PER_ROLE = int(os.getenv('RECENT_TOPICS_PER_ROLE', '8'))
+
+# Universal hashing modulo a Mersenne prime; a * h stays below 2**62, so uint64 never overflows
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20240501)  # fixed, so signatures are comparable across restarts
+_A = _rng.integers(1, _PRIME, size=(DEDUP_NUM_PERM, 1), dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, size=(DEDUP_NUM_PERM, 1), dtype=np.uint64)
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+def signature(text: str) -> Optional[np.ndarray]:
+    """MinHash of the text's character shingles (whitespace and punctuation ignored), None if empty"""
+    text = _NON_WORD.sub('', text.lower())
+    if not text:
+        return None
+    n = DEDUP_SHINGLE_CHARS
+    shingles = {text[i:i + n] for i in range(max(1, len(text) - n + 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) % _PRIME for s in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    return ((_A * hashes + _B) % _PRIME).min(axis=1).astype(np.uint32)
+
+def post_text(post: Dict[str, Any]) -> str:
+    return f"{post.get('title') or ''}\n{post.get('content') or ''}"
+
+class PostDedupIndex:
+    """Ring buffer of recent post signatures, compared in one vectorized pass"""
+
+    def __init__(self, window: int = DEDUP_WINDOW):
+        self.window = window
+        self.signatures = np.zeros((window, DEDUP_NUM_PERM), dtype=np.uint32)
+        self.post_ids: List[Optional[str]] = [None] * window
+        self.active = np.zeros(window, dtype=bool)  # slot holds a post that is still compared against
+        self.count = 0  # posts added so far; slot = count % window
+        # role_id -> (post_id, title, topic) of its latest posts
+        self.recent: Dict[str, Deque[Tuple[Optional[str], str, Optional[str]]]] = {}
+        self.checked = 0
+        self.duplicates = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Seed from the newest stored posts, once (blocking; run it in a thread)
+
+        The storage read and hashing happen outside the lock; posts the
+        window already holds are not added twice.
+        """
+        if self._loaded:
+            return
+        try:
+            posts = storage.get_posts(limit=self.window, order_by='created_at',
+                                      fields=['id', 'author_id', 'title', 'content'])
+        except Exception as e:
+            print(f"[Dedup] Failed to load recent posts: {e}")
+            return
+        signed = [(post, signature(post_text(post))) for post in reversed(posts)]
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            indexed = set(self.post_ids)
+            for post, sig in signed:
+                if sig is not None and post.get('id') not in indexed:
+                    self._add(post, sig, None)
+
+    def _add(self, post: Dict[str, Any], sig: np.ndarray, topic: Optional[str]):
+        slot = self.count % self.window
+        self.signatures[slot] = sig
+        self.post_ids[slot] = post.get('id')
+        self.active[slot] = True
+        self.count += 1
+        if post.get('author_id'):
+            recent = self.recent.setdefault(post['author_id'], deque(maxlen=RECENT_TOPICS_PER_ROLE))
+            recent.append((post.get('id'), post.get('title') or '', topic))
+
+    def _match(self, sig: np.ndarray) -> Tuple[Optional[str], float]:
+        n = min(self.count, self.window)
+        if not n:
+            return None, 0.0
+        similarity = (self.signatures[:n] == sig).mean(axis=1)
+        similarity[~self.active[:n]] = 0.0
+        best = int(similarity.argmax())
+        return self.post_ids[best], float(similarity[best])
+
+    def check_and_add(self, post: Dict[str, Any], topic: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        {'post_id', 'similarity'} of the recent post this one nearly duplicates,
+        else None after adding it to the window (discard() it if the post is not stored)
+        """
+        if not DEDUP_ENABLED:
+            return None
+        sig = signature(post_text(post))
+        if sig is None:
+            return None
+        with self._lock:
+            self.checked += 1
+            post_id, similarity = self._match(sig)
+            if similarity >= DEDUP_SIMILARITY_THRESHOLD:
+                self.duplicates += 1
+                return {'post_id': post_id, 'similarity': round(similarity, 3)}
+            self._add(post, sig, topic)
+        return None
+
+    def recent_topics(self, role_id: str, vocabulary: Iterable[str]) -> Set[str]:
+        """Topics of the role's latest posts: the ones recorded, plus vocabulary words in their titles"""
+        if not DEDUP_ENABLED or not role_id:
+            return set()
+        with self._lock:
+            recent = list(self.recent.get(role_id, ()))
+        topics = {topic for _, _, topic in recent if topic}
+        titles = [title for _, title, _ in recent]
+        topics.update(word for word in vocabulary if any(word in title for title in titles))
+        return topics
+
+    def discard(self, post_ids: Iterable[str]):
+        """Take posts that were checked but never stored back out of the window"""
+        post_ids = set(post_ids)
+        with self._lock:
+            for slot, post_id in enumerate(self.post_ids):
+                if post_id in post_ids:
+                    self.post_ids[slot] = None
+                    self.active[slot] = False
+            for role_id, recent in self.recent.items():
+                kept = [entry for entry in recent if entry[0] not in post_ids]
+                if len(kept) != len(recent):
+                    self.recent[role_id] = deque(kept, maxlen=RECENT_TOPICS_PER_ROLE)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': DEDUP_ENABLED,
+            'threshold': DEDUP_SIMILARITY_THRESHOLD,
+            'window': self.window,
+            'loaded': self._loaded,
+            'indexed_posts': int(self.active.sum()),
+            'checked': self.checked,
+            'duplicates': self.duplicates,
+        }
+
+# Global index of recent posts
+post_dedup = PostDedupIndex()
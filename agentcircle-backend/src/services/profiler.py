@@ -0,0 +1,276 @@
+"""
+On-demand sampling profiler
+Samples thread stacks while armed and aggregates flamegraph-ready collapsed stacks
+"""
+import os
+import sys
+import time
+import uuid
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional, List, Dict, Any
+
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '300'))
+PROFILE_HISTORY_SIZE = int(os.getenv('PROFILE_HISTORY_SIZE', '20'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', '')  # optional: also write <id>.collapsed files here
+
+# Leaf frames of threads parked waiting for work; sampling them is noise
+IDLE_LEAVES = {
+    ('selectors.py', 'select'),
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'),
+    ('thread.py', '_worker'),
+    ('_base.py', 'wait'),
+}
+
+# Routes never claimed by a request session (polling a profile shouldn't use it up)
+EXCLUDED_PATHS = ('/api/admin/profiles', '/metrics')
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+class ProfileSession:
+    """One profiling request: the next N requests, a time window, or a scheduler job"""
+
+    def __init__(self, mode: str, requests: int = 0, seconds: float = 0.0, job: Optional[str] = None,
+                 interval_ms: float = PROFILE_INTERVAL_MS):
+        self.id = f"prof_{uuid.uuid4().hex[:12]}"
+        self.mode = mode  # requests, window, job
+        self.job = job
+        self.interval = max(interval_ms, 1.0) / 1000.0
+        self.remaining_requests = requests
+        self.created_at = datetime.utcnow().isoformat()
+        self.finished_at: Optional[str] = None
+        self.expires_at = time.monotonic() + min(seconds or PROFILE_MAX_SECONDS, PROFILE_MAX_SECONDS)
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.profiled = 0  # requests or job runs covered
+        self.active = 0  # requests/job runs currently being recorded
+        self.done = False
+
+    @property
+    def recording(self) -> bool:
+        return not self.done and (self.mode == 'window' or self.active > 0)
+
+    def collapsed(self) -> str:
+        """Brendan Gregg collapsed-stack format: 'frame;frame;frame count' per line"""
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'mode': self.mode,
+            'job': self.job,
+            'status': 'done' if self.done else ('recording' if self.recording else 'armed'),
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'interval_ms': self.interval * 1000,
+            'remaining_requests': self.remaining_requests,
+            'profiled': self.profiled,
+            'samples': self.samples,
+            'unique_stacks': len(self.stacks),
+        }
+
+class SamplingProfiler:
+    """Wall-clock sampler over sys._current_frames(); the sampler thread only runs while armed"""
+
+    def __init__(self):
+        self._sessions: 'OrderedDict[str, ProfileSession]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.armed = False  # fast path flag checked on every request
+
+    # -------- Arming --------
+
+    def start(self, requests: int = 0, seconds: float = 0.0, job: Optional[str] = None,
+              interval_ms: float = PROFILE_INTERVAL_MS) -> ProfileSession:
+        """Arm a session for the next N requests, a time window, or the next run of a job"""
+        if job:
+            session = ProfileSession('job', requests=1, seconds=seconds, job=job, interval_ms=interval_ms)
+        elif requests:
+            session = ProfileSession('requests', requests=requests, seconds=seconds, interval_ms=interval_ms)
+        else:
+            session = ProfileSession('window', seconds=seconds or 10.0, interval_ms=interval_ms)
+        self._register(session)
+        return session
+
+    def _register(self, session: ProfileSession):
+        """Track a session and make sure the sampler thread is running"""
+        with self._lock:
+            self._sessions[session.id] = session
+            while len(self._sessions) > PROFILE_HISTORY_SIZE:
+                oldest = next(iter(self._sessions.values()))
+                if not oldest.done:
+                    break
+                self._sessions.popitem(last=False)
+            self.armed = True
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+                self._thread.start()
+
+    def get(self, session_id: str) -> Optional[ProfileSession]:
+        return self._sessions.get(session_id)
+
+    def list(self) -> List[ProfileSession]:
+        return list(reversed(self._sessions.values()))
+
+    def stop(self, session_id: str) -> Optional[ProfileSession]:
+        session = self._sessions.get(session_id)
+        if session:
+            with self._lock:
+                self._finish(session)
+        return session
+
+    # -------- Request / job hooks --------
+
+    def claim_request(self) -> Optional[ProfileSession]:
+        """Take one request slot from an armed request session"""
+        if not self.armed:
+            return None
+        with self._lock:
+            for session in self._sessions.values():
+                if session.mode == 'requests' and not session.done and session.remaining_requests > 0:
+                    session.remaining_requests -= 1
+                    session.active += 1
+                    return session
+        return None
+
+    def adhoc_request(self) -> ProfileSession:
+        """Session covering exactly one, already running request (header-triggered)"""
+        session = ProfileSession('requests')
+        session.active = 1
+        self._register(session)
+        return session
+
+    def release(self, session: ProfileSession):
+        """A profiled request or job run finished"""
+        with self._lock:
+            session.active -= 1
+            session.profiled += 1
+            if session.remaining_requests <= 0 and session.active <= 0:
+                self._finish(session)
+
+    @contextmanager
+    def profile_job(self, job_id: str):
+        """Record a scheduler job run if a session is armed for it"""
+        session = None
+        if self.armed:
+            with self._lock:
+                for s in self._sessions.values():
+                    if s.mode == 'job' and s.job == job_id and not s.done and s.remaining_requests > 0:
+                        s.remaining_requests -= 1
+                        s.active += 1
+                        session = s
+                        break
+        try:
+            yield session
+        finally:
+            if session is not None:
+                self.release(session)
+
+    # -------- Sampling --------
+
+    def _finish(self, session: ProfileSession):
+        """Mark a session done (caller holds the lock)"""
+        if session.done:
+            return
+        session.done = True
+        session.finished_at = datetime.utcnow().isoformat()
+        self.armed = any(not s.done for s in self._sessions.values())
+        if PROFILE_DIR:
+            try:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                with open(os.path.join(PROFILE_DIR, f"{session.id}.collapsed"), 'w') as f:
+                    f.write(session.collapsed())
+            except OSError as e:
+                print(f"[Profiler] Failed to write {session.id}: {e}")
+        print(f"[Profiler] Session {session.id} done: {session.samples} samples")
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                for session in list(self._sessions.values()):
+                    if not session.done and now >= session.expires_at:
+                        self._finish(session)
+                live = [s for s in self._sessions.values() if not s.done]
+                if not live:
+                    self.armed = False
+                    self._thread = None
+                    return
+                recording = [s for s in live if s.recording]
+                interval = min(s.interval for s in live)
+
+            if recording:
+                stacks = self._collect(own_id)
+                with self._lock:
+                    for session in recording:
+                        session.samples += 1
+                        session.stacks.update(stacks)
+            time.sleep(interval)
+
+    def _collect(self, own_id: int) -> List[str]:
+        """Collapsed stacks of all busy threads right now"""
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+            if leaf in IDLE_LEAVES:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(_frame_label(frame))
+                frame = frame.f_back
+            frames.append(names.get(thread_id, f"thread-{thread_id}"))
+            stacks.append(';'.join(reversed(frames)))
+        return stacks
+
+class ProfilerMiddleware:
+    """ASGI middleware attaching armed or header-requested profiles to requests"""
+
+    def __init__(self, app, profiler: SamplingProfiler, is_admin):
+        self.app = app
+        self.profiler = profiler
+        self.is_admin = is_admin  # callable(scope) -> bool
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'].startswith(EXCLUDED_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        session = None
+        if self.profiler.armed:
+            session = self.profiler.claim_request()
+        if session is None and _header(scope, b'x-profile') == b'1' and self.is_admin(scope):
+            session = self.profiler.adhoc_request()
+        if session is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                message.setdefault('headers', [])
+                message['headers'] = list(message['headers']) + [(b'x-profile-id', session.id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.profiler.release(session)
+
+def _header(scope, name: bytes) -> Optional[bytes]:
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value
+    return None
+
+# Global profiler instance
+profiler = SamplingProfiler()
@@ -0,0 +1,178 @@
+"""
+Persona prompt compiler
+Renders a role's persona prompt from its flat storage fields, stores it with a
+template version and a hash of the persona fields, and recompiles only when they change.
+Recompiled prompts are written behind, off the request path.
+"""
+import os
+import asyncio
+import hashlib
+import threading
+from typing import Dict, Optional, Tuple
+
+from services.storage_service import storage
+
+# Bump when the template or trait rules change; stored prompts of older versions are recompiled
+PROMPT_VERSION = 2
+# How often recompiled prompts are written back to their role rows
+PROMPT_FLUSH_SECONDS = float(os.getenv('PROMPT_FLUSH_SECONDS', '30'))
+
+TRAIT_NAMES = ('openness', 'conscientiousness', 'extraversion', 'agreeableness', 'neuroticism')
+
+# Role fields the persona prompt is rendered from
+IDENTITY_FIELDS = ('name', 'title', 'description', 'source', 'camp')
+PERSONA_FIELDS = IDENTITY_FIELDS + TRAIT_NAMES
+
+# trait -> (description above HIGH, description below LOW)
+TRAIT_HIGH = 70
+TRAIT_LOW = 30
+TRAIT_DESCRIPTIONS = {
+    'openness': ('富有创造力和好奇心', '传统保守'),
+    'conscientiousness': ('认真负责、有条理', '随性而为'),
+    'extraversion': ('外向活泼、善于社交', '内向沉稳、喜欢独处'),
+    'agreeableness': ('友善温和、乐于助人', '直率甚至有点刻薄'),
+    'neuroticism': ('情绪敏感、容易焦虑', '情绪稳定、处变不惊'),
+}
+
+PERSONA_TEMPLATE = """你是{name}，{title}。
+{description}
+来源：{source}
+阵营：{camp}
+
+你的性格特点：{traits}
+
+内容应该符合你的知识背景和时代背景，表达风格要符合你的性格特点，可以引用你的名言或作品（如果有的话）。
+"""
+
+def personality(role: Dict) -> Dict[str, int]:
+    """Big Five scores of a role; reads flat storage columns or a nested API-shaped 'personality'"""
+    nested = role.get('personality') or {}
+    scores = {}
+    for trait in TRAIT_NAMES:
+        value = role.get(trait)
+        scores[trait] = int(value if value is not None else nested.get(trait, 50))
+    return scores
+
+def persona_key(role: Dict) -> tuple:
+    """Values of the persona fields, in PERSONA_FIELDS order"""
+    scores = personality(role)
+    return tuple(str(role.get(f) or '') for f in IDENTITY_FIELDS) + tuple(scores[t] for t in TRAIT_NAMES)
+
+def persona_hash(role: Dict) -> str:
+    """Stable hash of the template version and the persona fields"""
+    parts = [str(PROMPT_VERSION)] + [str(value) for value in persona_key(role)]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+def compile_persona(role: Dict) -> str:
+    """Render the persona prompt for a role"""
+    scores = personality(role)
+    traits = []
+    for trait in TRAIT_NAMES:
+        high, low = TRAIT_DESCRIPTIONS[trait]
+        if scores[trait] > TRAIT_HIGH:
+            traits.append(high)
+        elif scores[trait] < TRAIT_LOW:
+            traits.append(low)
+    return PERSONA_TEMPLATE.format(
+        name=role.get('name') or '未知',
+        title=role.get('title') or '',
+        description=role.get('description') or '',
+        source=role.get('source') or '',
+        camp=role.get('camp') or '',
+        traits='，'.join(traits) if traits else '性格平和',
+    )
+
+def compiled_fields(role: Dict) -> Dict:
+    """Columns to store with a role: system_prompt, prompt_version and prompt_hash"""
+    return {
+        'system_prompt': compile_persona(role),
+        'prompt_version': PROMPT_VERSION,
+        'prompt_hash': persona_hash(role),
+    }
+
+class PromptCompiler:
+    """Persona prompts per role, memoized in process and persisted on the role row"""
+
+    def __init__(self):
+        # role_id -> (persona field values, prompt)
+        self._compiled: Dict[str, Tuple[tuple, str]] = {}
+        # role_id -> compiled_fields() not yet written to storage
+        self._pending: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Future] = None
+        self.compiles = 0
+        self.stored_hits = 0
+
+    def persona(self, role: Dict) -> str:
+        """Persona prompt for a role, recompiling only when its persona fields changed (never blocks on storage)"""
+        role_id = role.get('id')
+        key = persona_key(role)
+        cached = self._compiled.get(role_id) if role_id else None
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        prompt = role.get('system_prompt')
+        if prompt and role.get('prompt_hash') == persona_hash(role):
+            self.stored_hits += 1
+        else:
+            fields = compiled_fields(role)
+            prompt = fields['system_prompt']
+            self.compiles += 1
+            if role_id:
+                with self._lock:
+                    self._pending[role_id] = fields
+        if role_id:
+            with self._lock:
+                self._compiled[role_id] = (key, prompt)
+        return prompt
+
+    def flush(self) -> int:
+        """Write pending recompiled prompts to their roles (blocking), returns how many were stored"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        stored = 0
+        for role_id, fields in pending.items():
+            try:
+                storage.update_role(role_id, dict(fields))
+                stored += 1
+            except Exception as e:
+                # The in-process copy still serves; the next process recompiles
+                print(f"[Prompts] Failed to store prompt for {role_id}: {e}")
+        return stored
+
+    def start(self):
+        """Flush on an interval on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(PROMPT_FLUSH_SECONDS)
+            await loop.run_in_executor(None, self.flush)
+
+    async def stop(self):
+        """Stop the flush loop and write what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.flush()
+
+    def invalidate(self, role_id: Optional[str] = None):
+        with self._lock:
+            if role_id is None:
+                self._compiled.clear()
+            else:
+                self._compiled.pop(role_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'version': PROMPT_VERSION,
+            'memoized_roles': len(self._compiled),
+            'compiles': self.compiles,
+            'stored_hits': self.stored_hits,
+            'pending_writes': len(self._pending),
+        }
+
+# Global prompt compiler
+prompt_compiler = PromptCompiler()
@@ -0,0 +1,114 @@
+"""
+SQL query statistics and slow query log
+Aggregates timing and row counts per statement shape for the SQLite backend
+"""
+import os
+import re
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Callable, Optional, List, Dict, Any, Sequence
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '100'))
+SLOW_QUERY_LOG_SIZE = int(os.getenv('SLOW_QUERY_LOG_SIZE', '50'))
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+def normalize_sql(sql: str) -> str:
+    """Statement shape: literals and placeholder lists collapsed, whitespace squeezed"""
+    shape = _WHITESPACE.sub(' ', sql).strip()
+    shape = _STRING_LITERAL.sub('?', shape)
+    shape = _NUMBER_LITERAL.sub('?', shape)
+    return _PLACEHOLDER_LIST.sub('(...)', shape)
+
+def _format_params(params: Sequence[Any], max_len: int = 80) -> List[str]:
+    """Parameter reprs, truncated so message bodies don't flood the log"""
+    formatted = []
+    for p in params or ():
+        text = repr(p)
+        formatted.append(text if len(text) <= max_len else text[:max_len] + '...')
+    return formatted
+
+class QueryStats:
+    """Per statement shape counters plus a bounded log of slow executions"""
+
+    def __init__(self, slow_ms: float = SLOW_QUERY_MS, log_size: int = SLOW_QUERY_LOG_SIZE):
+        self.slow_ms = slow_ms
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._slow: deque = deque(maxlen=log_size)
+        self._lock = threading.Lock()
+
+    def record(self, sql: str, params: Sequence[Any], elapsed: float, rows: int,
+               explain: Optional[Callable[[], List[str]]] = None):
+        """
+        Account one execution; slow ones are logged with their query plan
+
+        Args:
+            elapsed: Seconds spent executing (and fetching, for reads)
+            rows: Rows returned for reads, rows affected for writes
+            explain: Callable returning EXPLAIN QUERY PLAN lines, only run when slow
+        """
+        shape = normalize_sql(sql)
+        elapsed_ms = elapsed * 1000
+        with self._lock:
+            s = self._stats.get(shape)
+            if s is None:
+                s = self._stats[shape] = {
+                    'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'slow': 0,
+                }
+            s['calls'] += 1
+            s['total_ms'] += elapsed_ms
+            s['max_ms'] = max(s['max_ms'], elapsed_ms)
+            s['rows'] += max(rows, 0)
+            is_slow = elapsed_ms >= self.slow_ms
+            if is_slow:
+                s['slow'] += 1
+
+        if not is_slow:
+            return
+
+        plan: List[str] = []
+        if explain is not None:
+            try:
+                plan = explain()
+            except Exception as e:
+                plan = [f"unavailable: {e}"]
+        entry = {
+            'at': datetime.utcnow().isoformat(),
+            'elapsed_ms': round(elapsed_ms, 2),
+            'rows': rows,
+            'sql': _WHITESPACE.sub(' ', sql).strip(),
+            'params': _format_params(params),
+            'plan': plan,
+        }
+        with self._lock:
+            self._slow.append(entry)
+        print(f"[Storage] Slow query ({entry['elapsed_ms']}ms, {rows} rows): {entry['sql']} "
+              f"params={entry['params']} plan={' | '.join(plan)}")
+
+    def top(self, limit: int = 20, order_by: str = 'total_ms') -> List[Dict[str, Any]]:
+        """Statement shapes sorted by total_ms, max_ms, calls, rows or slow"""
+        with self._lock:
+            items = [{'statement': shape, **dict(s)} for shape, s in self._stats.items()]
+        for item in items:
+            item['avg_ms'] = round(item['total_ms'] / item['calls'], 3)
+            item['total_ms'] = round(item['total_ms'], 3)
+            item['max_ms'] = round(item['max_ms'], 3)
+        items.sort(key=lambda item: item[order_by], reverse=True)
+        return items[:limit]
+
+    def slow_log(self) -> List[Dict[str, Any]]:
+        """Recent slow executions, newest first"""
+        with self._lock:
+            return list(reversed(self._slow))
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow.clear()
+
+# Global query statistics instance
+query_stats = QueryStats()
@@ -0,0 +1,215 @@
+"""
+Provider-aware rate limiting and retry policy for LLM calls
+Token buckets for requests and tokens per minute, backoff with jitter, Retry-After, per-job retry budgets
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any
+
+import httpx
+import requests
+
+from services.metrics import record_llm_retry
+
+def _limit(provider: str, kind: str, default: int) -> int:
+    return int(os.getenv(f'{provider.upper()}_{kind}', str(default)))
+
+# Per-provider quotas (0 disables a bucket); defaults sit below common tier-1 limits
+PROVIDER_LIMITS = {
+    'openai': {'rpm': _limit('openai', 'RPM', 500), 'tpm': _limit('openai', 'TPM', 200000)},
+    'anthropic': {'rpm': _limit('anthropic', 'RPM', 50), 'tpm': _limit('anthropic', 'TPM', 40000)},
+    'gemini': {'rpm': _limit('gemini', 'RPM', 60), 'tpm': _limit('gemini', 'TPM', 120000)},
+}
+
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '4'))  # per call
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '1.0'))  # seconds
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', '30.0'))
+LLM_JOB_RETRY_BUDGET = int(os.getenv('LLM_JOB_RETRY_BUDGET', '20'))  # retries shared by one job run
+
+# 529 is Anthropic's "overloaded"
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+class TokenBucket:
+    """Refills at per_minute/60 per second up to one minute's worth; reservations may go negative"""
+
+    def __init__(self, per_minute: int):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take amount now; returns seconds until the reservation is covered"""
+        self._refill(now)
+        self.level -= amount
+        return max(0.0, -self.level / self.rate)
+
+    def adjust(self, amount: float, now: float):
+        """Give back (positive) or charge (negative) tokens after the fact"""
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+class RetryBudget:
+    """Retries allowed across all LLM calls of one job run"""
+
+    def __init__(self, retries: int):
+        self.remaining = retries
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            self.used += 1
+            return True
+
+_retry_budget: contextvars.ContextVar[Optional[RetryBudget]] = contextvars.ContextVar('llm_retry_budget', default=None)
+
+@contextmanager
+def retry_budget(retries: int = LLM_JOB_RETRY_BUDGET):
+    """Share a retry budget between every LLM call made inside the block (tasks inherit it)"""
+    budget = RetryBudget(retries)
+    token = _retry_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _retry_budget.reset(token)
+
+def _error_response(error: Exception):
+    if isinstance(error, (httpx.HTTPStatusError, requests.HTTPError)):
+        return error.response
+    return None
+
+def _retry_after(response) -> Optional[float]:
+    """Retry-After header in seconds (delta-seconds or HTTP-date)"""
+    value = response.headers.get('retry-after') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class ProviderLimiter:
+    """Request and token buckets for one provider, plus its retry decisions"""
+
+    def __init__(self, provider: str, rpm: int, tpm: int):
+        self.provider = provider
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.paused_until = 0.0
+        self.throttled_seconds = 0.0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        now = time.monotonic()
+        with self._lock:
+            delay = max(0.0, self.paused_until - now)
+            if self.requests:
+                delay = max(delay, self.requests.reserve(1, now))
+            if self.tokens:
+                delay = max(delay, self.tokens.reserve(tokens, now))
+            self.throttled_seconds += delay
+        return delay
+
+    async def acquire(self, tokens: int):
+        """Wait until a request of about `tokens` tokens fits the provider quota"""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire_sync(self, tokens: int):
+        delay = self._reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    def settle(self, estimated: int, actual: int):
+        """Correct the token bucket once the provider reports real usage"""
+        if self.tokens and actual:
+            with self._lock:
+                self.tokens.adjust(estimated - actual, time.monotonic())
+
+    def refund(self, estimated: int):
+        """Return the token reservation of an attempt that failed"""
+        if self.tokens:
+            with self._lock:
+                self.tokens.adjust(estimated, time.monotonic())
+
+    def retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """
+        Seconds to wait before retrying a failed call, None to give up
+
+        Retries 408/409/429/5xx/529 and transport errors with full-jitter
+        exponential backoff, never sooner than the provider's Retry-After.
+        A 429 also pauses the whole provider for that long.
+        """
+        response = _error_response(error)
+        if response is not None:
+            if response.status_code not in RETRYABLE_STATUS:
+                return None
+            reason = str(response.status_code)
+        elif isinstance(error, (httpx.TransportError, requests.ConnectionError, requests.Timeout)):
+            reason = 'transport'
+        else:
+            return None
+
+        if attempt >= LLM_MAX_RETRIES:
+            return None
+        budget = _retry_budget.get()
+        if budget is not None and not budget.take():
+            print(f"[RateLimit] Job retry budget exhausted, not retrying {self.provider}")
+            return None
+
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+        retry_after = _retry_after(response)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, LLM_BACKOFF_MAX))
+        if reason == '429':
+            with self._lock:
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+        self.retries += 1
+        record_llm_retry(self.provider, reason)
+        print(f"[RateLimit] {self.provider} {reason}, retry {attempt + 1}/{LLM_MAX_RETRIES} in {delay:.1f}s")
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            if self.requests:
+                self.requests._refill(now)
+            if self.tokens:
+                self.tokens._refill(now)
+            return {
+                'rpm': int(self.requests.capacity) if self.requests else 0,
+                'tpm': int(self.tokens.capacity) if self.tokens else 0,
+                'requests_available': round(self.requests.level, 1) if self.requests else None,
+                'tokens_available': round(self.tokens.level) if self.tokens else None,
+                'paused_for': round(max(0.0, self.paused_until - now), 2),
+                'throttled_seconds': round(self.throttled_seconds, 2),
+                'retries': self.retries,
+            }
+
+def estimate_tokens(*texts: str, max_output_tokens: int = 0) -> int:
+    """Rough pre-call token estimate; CJK text is about one token per character"""
+    return sum(len(t) for t in texts) + max_output_tokens
+
+# Global per-provider limiters
+rate_limits = {provider: ProviderLimiter(provider, **limits) for provider, limits in PROVIDER_LIMITS.items()}
@@ -0,0 +1,69 @@
+"""
+Single-flight request coalescing
+Concurrent identical reads share one in-flight computation and its result
+"""
+import asyncio
+from typing import Callable, Dict, Any, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key"""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    async def do(self, key: str, fn: Callable, *args, name: Optional[str] = None, **kwargs) -> Any:
+        """
+        Run fn(*args, **kwargs) in the threadpool unless an identical call is
+        already in flight, in which case wait for and share its result.
+
+        The computation runs as its own task, so a cancelled caller (e.g. a
+        disconnected client) doesn't abort the work for the others.
+        """
+        stats = self._route_stats(name or key)
+        stats['requests'] += 1
+
+        task = self._inflight.get(key)
+        if task is not None:
+            stats['coalesced'] += 1
+        else:
+            stats['executions'] += 1
+            task = asyncio.ensure_future(run_in_threadpool(fn, *args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, key=key, stats=stats: self._finish(key, t, stats))
+
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Future, stats: Dict[str, int]):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            stats['errors'] += 1
+
+    def _route_stats(self, name: str) -> Dict[str, int]:
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = {'requests': 0, 'executions': 0, 'coalesced': 0, 'errors': 0}
+        return stats
+
+    def stats(self) -> Dict[str, Any]:
+        """Coalescing counters, totals and per route"""
+        totals = {'requests': 0, 'executions': 0, 'coalesced': 0, 'errors': 0}
+        for route_stats in self._stats.values():
+            for k in totals:
+                totals[k] += route_stats[k]
+        return {
+            **totals,
+            'inflight': len(self._inflight),
+            'routes': {name: dict(s) for name, s in self._stats.items()},
+        }
+
+def flight_key(path: str, query_items) -> str:
+    """Normalized key: path plus query parameters in sorted order"""
+    query = '&'.join(f"{k}={v}" for k, v in sorted(query_items))
+    return f"{path}?{query}" if query else path
+
+# Global single-flight instance
+single_flight = SingleFlight()
@@ -3,17 +3,72 @@ Dual storage service: Supabase (primary) + SQLite (fallback)
 """
 import os
 import json
+import time
 import sqlite3
-from typing import Optional, List, Dict, Any, Union
+import threading
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any, Union, Iterator, Tuple
 from datetime import datetime
 from dotenv import load_dotenv
 
+from services.event_bus import event_bus, room_topic, ROOMS_TOPIC
+from services.metrics import track_storage
+from services.query_stats import query_stats
+
 # Load environment variables
 load_dotenv()
 
 SUPABASE_URL = os.getenv('SUPABASE_URL', '')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY', '')
-SQLITE_DB_PATH = os.path.join(os.path.dirname(__file__), '../../data/agentcircle.db')
+SQLITE_DB_PATH = os.getenv('SQLITE_DB_PATH') or os.path.join(os.path.dirname(__file__), '../../data/agentcircle.db')
+
+# Tables copied by sync_from_supabase, and rows fetched per request
+SYNC_TABLES = ['roles', 'circles', 'posts']
+SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', '500'))
+
+# Readable columns per table, used to validate field projections
+TABLE_COLUMNS = {
+    'roles': [
+        'id', 'name', 'avatar_url', 'camp', 'is_historical', 'title', 'description', 'source',
+        'openness', 'conscientiousness', 'extraversion', 'agreeableness', 'neuroticism',
+        'birth_date', 'death_date', 'is_alive', 'age', 'health', 'mood',
+        'reputation', 'post_count', 'follower_count', 'following_count',
+        'llm_model', 'system_prompt', 'prompt_version', 'prompt_hash',
+        'created_at', 'updated_at', 'last_active_at',
+    ],
+    'circles': ['id', 'name', 'description', 'icon', 'category', 'post_count', 'created_at'],
+    'posts': [
+        'id', 'author_id', 'circle_id', 'title', 'content', 'content_type', 'metadata',
+        'likes_count', 'comments_count', 'views_count', 'is_pinned', 'is_deleted',
+        'created_at', 'updated_at',
+    ],
+    'chat_rooms': ['id', 'name', 'type', 'scene', 'participant_ids', 'created_at', 'last_message_at'],
+    'chat_messages': ['id', 'room_id', 'sender_id', 'content', 'message_type', 'emotion', 'created_at'],
+    'memories': ['id', 'role_id', 'content', 'memory_type', 'importance', 'related_role_ids', 'created_at'],
+    'wiki_entries': [
+        'id', 'title', 'content', 'category', 'related_role_ids', 'created_by',
+        'created_at', 'updated_at', 'version', 'is_published',
+    ],
+}
+
+# Columns stored as JSON text in SQLite
+JSON_COLUMNS = {
+    'posts': ['metadata'],
+    'chat_rooms': ['participant_ids'],
+    'memories': ['related_role_ids'],
+    'wiki_entries': ['related_role_ids'],
+}
+
+# Rows per fetchmany() batch when streaming an export
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+
+# Compact projections for list views (no persona prompt or long description)
+ROLE_LIST_FIELDS = [
+    c for c in TABLE_COLUMNS['roles']
+    if c not in ('description', 'system_prompt', 'prompt_version', 'prompt_hash', 'updated_at')
+]
+POST_LIST_FIELDS = [c for c in TABLE_COLUMNS['posts'] if c not in ('is_deleted', 'updated_at')]
+AUTHOR_FIELDS = ['id', 'name', 'avatar_url', 'camp', 'is_historical', 'title']
 
 class StorageService:
     """Dual storage service with Supabase as primary and SQLite as fallback"""
@@ -22,6 +77,9 @@ class StorageService:
         self.supabase = None
         self.sqlite_conn = None
         self.use_supabase = False
+        # Serializes use of the shared SQLite connection across threads, so a
+        # group of writes and its commit never interleave with another thread's
+        self._sqlite_lock = threading.RLock()
         
         # Try to connect to Supabase
         if SUPABASE_URL and SUPABASE_KEY:
@@ -75,11 +133,18 @@ class StorageService:
                 following_count INTEGER DEFAULT 0,
                 llm_model TEXT DEFAULT 'gpt-4o-mini',
                 system_prompt TEXT,
+                prompt_version INTEGER,
+                prompt_hash TEXT,
                 created_at TEXT DEFAULT CURRENT_TIMESTAMP,
                 updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
                 last_active_at TEXT DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        # Databases created before compiled persona prompts
+        role_columns = {row[1] for row in cursor.execute('PRAGMA table_info(roles)')}
+        for column, column_type in (('prompt_version', 'INTEGER'), ('prompt_hash', 'TEXT')):
+            if column not in role_columns:
+                cursor.execute(f'ALTER TABLE roles ADD COLUMN {column} {column_type}')
         
         # Circles table
         cursor.execute('''
@@ -162,6 +227,11 @@ class StorageService:
                 created_at TEXT DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        # Tail reads and before/after cursors seek on (room_id, created_at), id breaks ties
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_chat_messages_room_created
+            ON chat_messages (room_id, created_at, id)
+        ''')
         
         # Memories table
         cursor.execute('''
@@ -175,6 +245,11 @@ class StorageService:
                 created_at TEXT DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        # A role's memory index loads its newest memories
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_memories_role_created
+            ON memories (role_id, created_at)
+        ''')
         
         # Wiki entries table
         cursor.execute('''
@@ -221,46 +296,113 @@ class StorageService:
         self.sqlite_conn.commit()
         print(f"[Storage] SQLite initialized: {SQLITE_DB_PATH}")
     
+    # ==================== Field Projection ====================
+    
+    def resolve_fields(self, table: str, fields: Optional[List[str]]) -> Optional[List[str]]:
+        """Validate a field projection for a table; None means all columns"""
+        if not fields:
+            return None
+        columns = TABLE_COLUMNS[table]
+        resolved = ['id']
+        for field in fields:
+            field = field.strip()
+            if not field or field in resolved:
+                continue
+            if field not in columns:
+                raise ValueError(f"Unknown field for {table}: {field}")
+            resolved.append(field)
+        return resolved
+    
+    def _sql_columns(self, table: str, fields: Optional[List[str]]) -> str:
+        """SQL column list for a projection"""
+        fields = self.resolve_fields(table, fields)
+        return ', '.join(fields) if fields else '*'
+    
+    def _supabase_columns(self, table: str, fields: Optional[List[str]]) -> str:
+        """Supabase select string for a projection"""
+        fields = self.resolve_fields(table, fields)
+        return ','.join(fields) if fields else '*'
+    
+    # ==================== SQL Helpers ====================
+    
+    @contextmanager
+    def _transaction(self):
+        """Hold the connection for a group of writes; commit them on success, roll back on error"""
+        with self._sqlite_lock:
+            try:
+                yield
+            except BaseException:
+                self.sqlite_conn.rollback()
+                raise
+            self.sqlite_conn.commit()
+    
+    def _query(self, sql: str, params: Union[List, tuple] = ()) -> List[sqlite3.Row]:
+        """Run a SELECT and fetch its rows, recording per-statement stats"""
+        started = time.perf_counter()
+        with self._sqlite_lock:
+            rows = self.sqlite_conn.execute(sql, params).fetchall()
+        query_stats.record(sql, params, time.perf_counter() - started, len(rows),
+                           explain=lambda: self._explain(sql, params))
+        return rows
+    
+    def _execute(self, sql: str, params: Union[List, tuple] = (), many: bool = False) -> sqlite3.Cursor:
+        """Run a write statement (executemany with many=True) inside _transaction(), recording per-statement stats"""
+        started = time.perf_counter()
+        if many:
+            cursor = self.sqlite_conn.executemany(sql, params)
+        else:
+            cursor = self.sqlite_conn.execute(sql, params)
+        sample = (params[0] if params else ()) if many else params
+        query_stats.record(sql, sample, time.perf_counter() - started, cursor.rowcount,
+                           explain=lambda: self._explain(sql, sample))
+        return cursor
+    
+    def _explain(self, sql: str, params: Union[List, tuple]) -> List[str]:
+        """EXPLAIN QUERY PLAN detail lines for a statement"""
+        with self._sqlite_lock:
+            return [row[3] for row in self.sqlite_conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+    
     # ==================== Role Operations ====================
     
-    def get_roles(self, limit: int = 100, offset: int = 0, camp: Optional[str] = None) -> List[Dict]:
-        """Get roles from storage"""
+    def get_roles(self, limit: int = 100, offset: int = 0, camp: Optional[str] = None,
+                  fields: Optional[List[str]] = None) -> List[Dict]:
+        """Get roles from storage, optionally projected to the given fields"""
         if self.use_supabase:
             try:
-                query = self.supabase.table('roles').select('*')
-                if camp:
-                    query = query.eq('camp', camp)
-                result = query.limit(limit).offset(offset).execute()
-                return result.data or []
+                with track_storage('get_roles', 'supabase', fallback=True):
+                    query = self.supabase.table('roles').select(self._supabase_columns('roles', fields))
+                    if camp:
+                        query = query.eq('camp', camp)
+                    result = query.limit(limit).offset(offset).execute()
+                    return result.data or []
             except Exception as e:
                 print(f"[Storage] Supabase get_roles failed, using SQLite: {e}")
         
         # Fallback to SQLite
-        cursor = self.sqlite_conn.cursor()
-        sql = 'SELECT * FROM roles'
-        params = []
-        if camp:
-            sql += ' WHERE camp = ?'
-            params.append(camp)
-        sql += ' LIMIT ? OFFSET ?'
-        params.extend([limit, offset])
-        cursor.execute(sql, params)
-        rows = cursor.fetchall()
-        return [dict(row) for row in rows]
-    
-    def get_role_by_id(self, role_id: str) -> Optional[Dict]:
+        with track_storage('get_roles', 'sqlite'):
+            sql = f"SELECT {self._sql_columns('roles', fields)} FROM roles"
+            params = []
+            if camp:
+                sql += ' WHERE camp = ?'
+                params.append(camp)
+            sql += ' LIMIT ? OFFSET ?'
+            params.extend([limit, offset])
+            rows = self._query(sql, params)
+            return [dict(row) for row in rows]
+    
+    def get_role_by_id(self, role_id: str, fields: Optional[List[str]] = None) -> Optional[Dict]:
         """Get a single role by ID"""
         if self.use_supabase:
             try:
-                result = self.supabase.table('roles').select('*').eq('id', role_id).single().execute()
-                return result.data
+                with track_storage('get_role_by_id', 'supabase', fallback=True):
+                    result = self.supabase.table('roles').select(self._supabase_columns('roles', fields)).eq('id', role_id).single().execute()
+                    return result.data
             except Exception as e:
                 print(f"[Storage] Supabase get_role_by_id failed: {e}")
         
-        cursor = self.sqlite_conn.cursor()
-        cursor.execute('SELECT * FROM roles WHERE id = ?', (role_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        with track_storage('get_role_by_id', 'sqlite'):
+            rows = self._query(f"SELECT {self._sql_columns('roles', fields)} FROM roles WHERE id = ?", (role_id,))
+            return dict(rows[0]) if rows else None
     
     def create_role(self, role_data: Dict) -> Dict:
         """Create a new role"""
@@ -271,18 +413,19 @@ class StorageService:
         # Insert to Supabase if available
         if self.use_supabase:
             try:
-                result = self.supabase.table('roles').insert(role_data).execute()
-                print(f"[Storage] Role created in Supabase: {role_data['id']}")
+                with track_storage('create_role', 'supabase'):
+                    result = self.supabase.table('roles').insert(role_data).execute()
+                    print(f"[Storage] Role created in Supabase: {role_data['id']}")
             except Exception as e:
                 print(f"[Storage] Supabase create_role failed: {e}")
         
         # Always insert to SQLite
-        cursor = self.sqlite_conn.cursor()
-        fields = list(role_data.keys())
-        placeholders = ', '.join(['?' for _ in fields])
-        sql = f"INSERT OR REPLACE INTO roles ({', '.join(fields)}) VALUES ({placeholders})"
-        cursor.execute(sql, [role_data.get(f) for f in fields])
-        self.sqlite_conn.commit()
+        with track_storage('create_role', 'sqlite'):
+            fields = list(role_data.keys())
+            placeholders = ', '.join(['?' for _ in fields])
+            sql = f"INSERT OR REPLACE INTO roles ({', '.join(fields)}) VALUES ({placeholders})"
+            with self._transaction():
+                self._execute(sql, [role_data.get(f) for f in fields])
         
         return role_data
     
@@ -292,69 +435,90 @@ class StorageService:
         
         if self.use_supabase:
             try:
-                self.supabase.table('roles').update(updates).eq('id', role_id).execute()
+                with track_storage('update_role', 'supabase'):
+                    self.supabase.table('roles').update(updates).eq('id', role_id).execute()
             except Exception as e:
                 print(f"[Storage] Supabase update_role failed: {e}")
         
-        cursor = self.sqlite_conn.cursor()
-        fields = list(updates.keys())
-        set_clause = ', '.join([f"{f} = ?" for f in fields])
-        sql = f"UPDATE roles SET {set_clause} WHERE id = ?"
-        cursor.execute(sql, [updates.get(f) for f in fields] + [role_id])
-        self.sqlite_conn.commit()
+        with track_storage('update_role', 'sqlite'):
+            fields = list(updates.keys())
+            set_clause = ', '.join([f"{f} = ?" for f in fields])
+            sql = f"UPDATE roles SET {set_clause} WHERE id = ?"
+            with self._transaction():
+                self._execute(sql, [updates.get(f) for f in fields] + [role_id])
         
         return self.get_role_by_id(role_id)
     
+    def touch_roles(self, role_ids: List[str]):
+        """Mark several roles active now in one write per backend"""
+        if not role_ids:
+            return
+        now = datetime.utcnow().isoformat()
+        
+        if self.use_supabase:
+            try:
+                with track_storage('touch_roles', 'supabase'):
+                    self.supabase.table('roles').update({'last_active_at': now, 'updated_at': now}).in_('id', role_ids).execute()
+            except Exception as e:
+                print(f"[Storage] Supabase touch_roles failed: {e}")
+        
+        with track_storage('touch_roles', 'sqlite'):
+            with self._transaction():
+                self._execute('UPDATE roles SET last_active_at = ?, updated_at = ? WHERE id = ?',
+                              [(now, now, role_id) for role_id in role_ids], many=True)
+    
     # ==================== Post Operations ====================
     
     def get_posts(self, limit: int = 20, offset: int = 0, circle_id: Optional[str] = None, 
-                  author_id: Optional[str] = None, order_by: str = 'created_at') -> List[Dict]:
-        """Get posts from storage"""
+                  author_id: Optional[str] = None, order_by: str = 'created_at',
+                  fields: Optional[List[str]] = None) -> List[Dict]:
+        """Get posts from storage, optionally projected to the given fields"""
         if self.use_supabase:
             try:
-                query = self.supabase.table('posts').select('*')
-                if circle_id:
-                    query = query.eq('circle_id', circle_id)
-                if author_id:
-                    query = query.eq('author_id', author_id)
-                query = query.eq('is_deleted', False)
-                if order_by == 'likes':
-                    query = query.order('likes_count', desc=True)
-                elif order_by == 'created_at':
-                    query = query.order('created_at', desc=True)
-                result = query.limit(limit).offset(offset).execute()
-                return result.data or []
+                with track_storage('get_posts', 'supabase', fallback=True):
+                    query = self.supabase.table('posts').select(self._supabase_columns('posts', fields))
+                    if circle_id:
+                        query = query.eq('circle_id', circle_id)
+                    if author_id:
+                        query = query.eq('author_id', author_id)
+                    query = query.eq('is_deleted', False)
+                    if order_by == 'likes':
+                        query = query.order('likes_count', desc=True)
+                    elif order_by == 'created_at':
+                        query = query.order('created_at', desc=True)
+                    result = query.limit(limit).offset(offset).execute()
+                    return result.data or []
             except Exception as e:
                 print(f"[Storage] Supabase get_posts failed: {e}")
         
-        cursor = self.sqlite_conn.cursor()
-        sql = 'SELECT * FROM posts WHERE is_deleted = 0'
-        params = []
-        if circle_id:
-            sql += ' AND circle_id = ?'
-            params.append(circle_id)
-        if author_id:
-            sql += ' AND author_id = ?'
-            params.append(author_id)
-        
-        if order_by == 'likes':
-            sql += ' ORDER BY likes_count DESC'
-        else:
-            sql += ' ORDER BY created_at DESC'
-        
-        sql += ' LIMIT ? OFFSET ?'
-        params.extend([limit, offset])
-        cursor.execute(sql, params)
-        rows = cursor.fetchall()
-        posts = []
-        for row in rows:
-            post = dict(row)
-            try:
-                post['metadata'] = json.loads(post.get('metadata', '{}'))
-            except:
-                post['metadata'] = {}
-            posts.append(post)
-        return posts
+        with track_storage('get_posts', 'sqlite'):
+            sql = f"SELECT {self._sql_columns('posts', fields)} FROM posts WHERE is_deleted = 0"
+            params = []
+            if circle_id:
+                sql += ' AND circle_id = ?'
+                params.append(circle_id)
+            if author_id:
+                sql += ' AND author_id = ?'
+                params.append(author_id)
+        
+            if order_by == 'likes':
+                sql += ' ORDER BY likes_count DESC'
+            else:
+                sql += ' ORDER BY created_at DESC'
+        
+            sql += ' LIMIT ? OFFSET ?'
+            params.extend([limit, offset])
+            rows = self._query(sql, params)
+            posts = []
+            for row in rows:
+                post = dict(row)
+                if 'metadata' in post:
+                    try:
+                        post['metadata'] = json.loads(post.get('metadata', '{}'))
+                    except:
+                        post['metadata'] = {}
+                posts.append(post)
+            return posts
     
     def create_post(self, post_data: Dict) -> Dict:
         """Create a new post"""
@@ -366,44 +530,80 @@ class StorageService:
         
         if self.use_supabase:
             try:
-                self.supabase.table('posts').insert(post_data).execute()
+                with track_storage('create_post', 'supabase'):
+                    self.supabase.table('posts').insert(post_data).execute()
             except Exception as e:
                 print(f"[Storage] Supabase create_post failed: {e}")
         
-        cursor = self.sqlite_conn.cursor()
-        fields = list(post_data.keys())
-        placeholders = ', '.join(['?' for _ in fields])
-        sql = f"INSERT INTO posts ({', '.join(fields)}) VALUES ({placeholders})"
-        cursor.execute(sql, [post_data.get(f) for f in fields])
-        self.sqlite_conn.commit()
-        
-        # Update role post count
-        if post_data.get('author_id'):
-            self._increment_role_post_count(post_data['author_id'])
+        with track_storage('create_post', 'sqlite'):
+            fields = list(post_data.keys())
+            placeholders = ', '.join(['?' for _ in fields])
+            sql = f"INSERT INTO posts ({', '.join(fields)}) VALUES ({placeholders})"
+            with self._transaction():
+                self._execute(sql, [post_data.get(f) for f in fields])
+                # Update role post count
+                if post_data.get('author_id'):
+                    self._increment_role_post_count(post_data['author_id'])
         
         return post_data
     
+    def create_posts(self, posts: List[Dict]) -> List[Dict]:
+        """Create several posts with one batched insert and a single commit"""
+        if not posts:
+            return []
+        now = datetime.utcnow().isoformat()
+        for post_data in posts:
+            post_data['created_at'] = now
+            post_data['updated_at'] = now
+            if 'metadata' in post_data and isinstance(post_data['metadata'], dict):
+                post_data['metadata'] = json.dumps(post_data['metadata'])
+        
+        if self.use_supabase:
+            try:
+                with track_storage('create_posts', 'supabase'):
+                    self.supabase.table('posts').insert(posts).execute()
+            except Exception as e:
+                print(f"[Storage] Supabase create_posts failed: {e}")
+        
+        with track_storage('create_posts', 'sqlite'):
+            author_ids = [p['author_id'] for p in posts if p.get('author_id')]
+            with self._transaction():
+                self._insert_many('posts', posts)
+                if author_ids:
+                    self._execute('UPDATE roles SET post_count = post_count + 1 WHERE id = ?',
+                                  [(author_id,) for author_id in author_ids], many=True)
+        
+        return posts
+    
+    def _insert_many(self, table: str, rows: List[Dict]):
+        """executemany INSERT, one statement per distinct column set (no commit)"""
+        groups: Dict[tuple, List[Dict]] = {}
+        for row in rows:
+            groups.setdefault(tuple(row.keys()), []).append(row)
+        for fields, group in groups.items():
+            placeholders = ', '.join(['?' for _ in fields])
+            sql = f"INSERT INTO {table} ({', '.join(fields)}) VALUES ({placeholders})"
+            self._execute(sql, [[row.get(f) for f in fields] for row in group], many=True)
+    
     def _increment_role_post_count(self, role_id: str):
-        """Increment role's post count"""
-        cursor = self.sqlite_conn.cursor()
-        cursor.execute('UPDATE roles SET post_count = post_count + 1 WHERE id = ?', (role_id,))
-        self.sqlite_conn.commit()
+        """Increment role's post count (no commit)"""
+        self._execute('UPDATE roles SET post_count = post_count + 1 WHERE id = ?', (role_id,))
     
     # ==================== Circle Operations ====================
     
-    def get_circles(self) -> List[Dict]:
+    def get_circles(self, fields: Optional[List[str]] = None) -> List[Dict]:
         """Get all circles"""
         if self.use_supabase:
             try:
-                result = self.supabase.table('circles').select('*').execute()
-                return result.data or []
+                with track_storage('get_circles', 'supabase', fallback=True):
+                    result = self.supabase.table('circles').select(self._supabase_columns('circles', fields)).execute()
+                    return result.data or []
             except Exception as e:
                 print(f"[Storage] Supabase get_circles failed: {e}")
         
-        cursor = self.sqlite_conn.cursor()
-        cursor.execute('SELECT * FROM circles ORDER BY post_count DESC')
-        rows = cursor.fetchall()
-        return [dict(row) for row in rows]
+        with track_storage('get_circles', 'sqlite'):
+            rows = self._query(f"SELECT {self._sql_columns('circles', fields)} FROM circles ORDER BY post_count DESC")
+            return [dict(row) for row in rows]
     
     def create_circle(self, circle_data: Dict) -> Dict:
         """Create a new circle"""
@@ -411,56 +611,121 @@ class StorageService:
         
         if self.use_supabase:
             try:
-                self.supabase.table('circles').insert(circle_data).execute()
+                with track_storage('create_circle', 'supabase'):
+                    self.supabase.table('circles').insert(circle_data).execute()
             except Exception as e:
                 print(f"[Storage] Supabase create_circle failed: {e}")
         
-        cursor = self.sqlite_conn.cursor()
-        fields = list(circle_data.keys())
-        placeholders = ', '.join(['?' for _ in fields])
-        sql = f"INSERT INTO circles ({', '.join(fields)}) VALUES ({placeholders})"
-        cursor.execute(sql, [circle_data.get(f) for f in fields])
-        self.sqlite_conn.commit()
+        with track_storage('create_circle', 'sqlite'):
+            fields = list(circle_data.keys())
+            placeholders = ', '.join(['?' for _ in fields])
+            sql = f"INSERT INTO circles ({', '.join(fields)}) VALUES ({placeholders})"
+            with self._transaction():
+                self._execute(sql, [circle_data.get(f) for f in fields])
         
         return circle_data
     
     # ==================== Chat Operations ====================
     
-    def get_chat_rooms(self, limit: int = 100) -> List[Dict]:
+    def get_chat_rooms(self, limit: int = 100, fields: Optional[List[str]] = None) -> List[Dict]:
         """Get chat rooms"""
         if self.use_supabase:
             try:
-                result = self.supabase.table('chat_rooms').select('*').limit(limit).execute()
-                return result.data or []
+                with track_storage('get_chat_rooms', 'supabase', fallback=True):
+                    result = self.supabase.table('chat_rooms').select(self._supabase_columns('chat_rooms', fields)).limit(limit).execute()
+                    return result.data or []
             except Exception as e:
                 print(f"[Storage] Supabase get_chat_rooms failed: {e}")
         
-        cursor = self.sqlite_conn.cursor()
-        cursor.execute('SELECT * FROM chat_rooms ORDER BY last_message_at DESC LIMIT ?', (limit,))
-        rows = cursor.fetchall()
-        rooms = []
-        for row in rows:
-            room = dict(row)
-            try:
-                room['participant_ids'] = json.loads(room.get('participant_ids', '[]'))
-            except:
-                room['participant_ids'] = []
-            rooms.append(room)
-        return rooms
-    
-    def get_chat_messages(self, room_id: str, limit: int = 50) -> List[Dict]:
-        """Get chat messages for a room"""
+        with track_storage('get_chat_rooms', 'sqlite'):
+            rows = self._query(f"SELECT {self._sql_columns('chat_rooms', fields)} FROM chat_rooms ORDER BY last_message_at DESC LIMIT ?", (limit,))
+            rooms = []
+            for row in rows:
+                room = dict(row)
+                if 'participant_ids' in room:
+                    try:
+                        room['participant_ids'] = json.loads(room.get('participant_ids', '[]'))
+                    except:
+                        room['participant_ids'] = []
+                rooms.append(room)
+            return rooms
+    
+    def get_chat_messages(self, room_id: str, limit: int = 50, fields: Optional[List[str]] = None,
+                          before: Optional[str] = None, after: Optional[str] = None) -> List[Dict]:
+        """
+        Get chat messages for a room, always in chronological order
+        
+        Without a cursor this returns the newest `limit` messages (the tail).
+        `before` pages backwards from a message id, `after` returns the oldest
+        `limit` messages following a message id. Raises ValueError for an
+        unknown cursor id.
+        """
+        if before and after:
+            raise ValueError("Use either before or after, not both")
+        
         if self.use_supabase:
             try:
-                result = self.supabase.table('chat_messages').select('*').eq('room_id', room_id).order('created_at').limit(limit).execute()
-                return result.data or []
+                with track_storage('get_chat_messages', 'supabase', fallback=True):
+                    return self._get_chat_messages_supabase(room_id, limit, fields, before, after)
+            except ValueError:
+                raise
             except Exception as e:
                 print(f"[Storage] Supabase get_chat_messages failed: {e}")
         
-        cursor = self.sqlite_conn.cursor()
-        cursor.execute('SELECT * FROM chat_messages WHERE room_id = ? ORDER BY created_at LIMIT ?', (room_id, limit))
-        rows = cursor.fetchall()
-        return [dict(row) for row in rows]
+        with track_storage('get_chat_messages', 'sqlite'):
+            sql = f"SELECT {self._sql_columns('chat_messages', fields)} FROM chat_messages WHERE room_id = ?"
+            params: List[Any] = [room_id]
+            cursor_id = before or after
+            if cursor_id:
+                anchor = self._query('SELECT created_at, id FROM chat_messages WHERE id = ? AND room_id = ?',
+                                     (cursor_id, room_id))
+                if not anchor:
+                    raise ValueError(f"Unknown message cursor: {cursor_id}")
+                sql += ' AND (created_at, id) > (?, ?)' if after else ' AND (created_at, id) < (?, ?)'
+                params.extend([anchor[0]['created_at'], anchor[0]['id']])
+            # Seek from the right end of the index so the cost doesn't grow with room size
+            sql += ' ORDER BY created_at, id LIMIT ?' if after else ' ORDER BY created_at DESC, id DESC LIMIT ?'
+            params.append(limit)
+            rows = [dict(row) for row in self._query(sql, params)]
+            return rows if after else rows[::-1]
+    
+    def _get_chat_messages_supabase(self, room_id: str, limit: int, fields: Optional[List[str]],
+                                    before: Optional[str], after: Optional[str]) -> List[Dict]:
+        """Supabase side of get_chat_messages (keyset pagination on created_at, id)"""
+        query = self.supabase.table('chat_messages').select(self._supabase_columns('chat_messages', fields)).eq('room_id', room_id)
+        cursor_id = before or after
+        if cursor_id:
+            anchor = self.supabase.table('chat_messages').select('created_at, id').eq('id', cursor_id).eq('room_id', room_id).execute().data
+            if not anchor:
+                raise ValueError(f"Unknown message cursor: {cursor_id}")
+            ts, mid = anchor[0]['created_at'], anchor[0]['id']
+            op = 'gt' if after else 'lt'
+            query = query.or_(f'created_at.{op}."{ts}",and(created_at.eq."{ts}",id.{op}."{mid}")')
+        desc = not after
+        result = query.order('created_at', desc=desc).order('id', desc=desc).limit(limit).execute()
+        rows = result.data or []
+        return rows if after else rows[::-1]
+    
+    def get_chat_messages_since(self, cursor: Optional[int], limit: int = 500) -> Tuple[List[Dict], int]:
+        """
+        Messages of every room stored in the shared SQLite file after a rowid
+        cursor, in insertion order, and the cursor for the next call
+
+        Rowids grow in commit order, so unlike created_at a tail read never
+        skips a message that committed late. Without a cursor no messages
+        are returned, only the current end of the table.
+        """
+        with track_storage('get_chat_messages_since', 'sqlite'):
+            if cursor is None:
+                return [], self._query('SELECT COALESCE(MAX(rowid), 0) FROM chat_messages')[0][0]
+            rows = self._query(f"SELECT rowid AS seq, {', '.join(TABLE_COLUMNS['chat_messages'])} FROM chat_messages "
+                               'WHERE rowid > ? ORDER BY rowid LIMIT ?', (cursor, limit))
+            messages = [dict(row) for row in rows]
+            if messages:
+                cursor = messages[-1]['seq']
+            for message in messages:
+                del message['seq']
+            return messages, cursor
     
     def create_chat_message(self, message_data: Dict) -> Dict:
         """Create a chat message"""
@@ -468,57 +733,152 @@ class StorageService:
         
         if self.use_supabase:
             try:
-                self.supabase.table('chat_messages').insert(message_data).execute()
+                with track_storage('create_chat_message', 'supabase'):
+                    self.supabase.table('chat_messages').insert(message_data).execute()
             except Exception as e:
                 print(f"[Storage] Supabase create_chat_message failed: {e}")
         
-        cursor = self.sqlite_conn.cursor()
-        fields = list(message_data.keys())
-        placeholders = ', '.join(['?' for _ in fields])
-        sql = f"INSERT INTO chat_messages ({', '.join(fields)}) VALUES ({placeholders})"
-        cursor.execute(sql, [message_data.get(f) for f in fields])
-        self.sqlite_conn.commit()
+        with track_storage('create_chat_message', 'sqlite'):
+            fields = list(message_data.keys())
+            placeholders = ', '.join(['?' for _ in fields])
+            sql = f"INSERT INTO chat_messages ({', '.join(fields)}) VALUES ({placeholders})"
+            with self._transaction():
+                self._execute(sql, [message_data.get(f) for f in fields])
+                # Update room last message time
+                self._execute('UPDATE chat_rooms SET last_message_at = ? WHERE id = ?',
+                              (message_data['created_at'], message_data['room_id']))
         
-        # Update room last message time
-        cursor.execute('UPDATE chat_rooms SET last_message_at = ? WHERE id = ?', 
-                      (message_data['created_at'], message_data['room_id']))
-        self.sqlite_conn.commit()
+        self.publish_chat_message(message_data)
         
         return message_data
     
+    def create_chat_messages(self, messages: List[Dict]) -> List[Dict]:
+        """Create several chat messages with one batched insert, then publish each"""
+        if not messages:
+            return []
+        now = datetime.utcnow().isoformat()
+        for message_data in messages:
+            message_data['created_at'] = now
+        
+        if self.use_supabase:
+            try:
+                with track_storage('create_chat_messages', 'supabase'):
+                    self.supabase.table('chat_messages').insert(messages).execute()
+            except Exception as e:
+                print(f"[Storage] Supabase create_chat_messages failed: {e}")
+        
+        with track_storage('create_chat_messages', 'sqlite'):
+            room_ids = sorted({m['room_id'] for m in messages})
+            with self._transaction():
+                self._insert_many('chat_messages', messages)
+                self._execute('UPDATE chat_rooms SET last_message_at = ? WHERE id = ?',
+                              [(now, room_id) for room_id in room_ids], many=True)
+        
+        for message_data in messages:
+            self.publish_chat_message(message_data)
+        
+        return messages
+    
+    def publish_chat_message(self, message_data: Dict):
+        """Push a new message to room and room-list subscribers of this worker's event bus"""
+        message = dict(message_data)
+        message.setdefault('message_type', 'text')
+        message.setdefault('emotion', None)
+        event_bus.publish(room_topic(message['room_id']), 'message', message['id'], message)
+        event_bus.publish(ROOMS_TOPIC, 'room', message['id'], {
+            'room_id': message['room_id'],
+            'last_message_at': message['created_at'],
+            'message': message,
+        })
+    
+    # ==================== Memory Operations ====================
+    
+    def get_memories(self, role_id: str, limit: int = 1000, fields: Optional[List[str]] = None) -> List[Dict]:
+        """A role's newest memories, newest first"""
+        if self.use_supabase:
+            try:
+                with track_storage('get_memories', 'supabase', fallback=True):
+                    result = (self.supabase.table('memories').select(self._supabase_columns('memories', fields))
+                              .eq('role_id', role_id).order('created_at', desc=True).limit(limit).execute())
+                    return result.data or []
+            except Exception as e:
+                print(f"[Storage] Supabase get_memories failed: {e}")
+        
+        with track_storage('get_memories', 'sqlite'):
+            rows = self._query(
+                f"SELECT {self._sql_columns('memories', fields)} FROM memories "
+                "WHERE role_id = ? ORDER BY created_at DESC LIMIT ?",
+                (role_id, limit)
+            )
+            memories = []
+            for row in rows:
+                memory = dict(row)
+                if 'related_role_ids' in memory:
+                    try:
+                        memory['related_role_ids'] = json.loads(memory.get('related_role_ids') or '[]')
+                    except:
+                        memory['related_role_ids'] = []
+                memories.append(memory)
+            return memories
+    
+    def create_memories(self, memories: List[Dict]) -> List[Dict]:
+        """Create several memories with one batched insert and a single commit"""
+        if not memories:
+            return []
+        now = datetime.utcnow().isoformat()
+        for memory_data in memories:
+            memory_data.setdefault('created_at', now)
+        
+        if self.use_supabase:
+            try:
+                with track_storage('create_memories', 'supabase'):
+                    self.supabase.table('memories').insert(memories).execute()
+            except Exception as e:
+                print(f"[Storage] Supabase create_memories failed: {e}")
+        
+        with track_storage('create_memories', 'sqlite'):
+            with self._transaction():
+                self._insert_many('memories', [
+                    {**m, 'related_role_ids': json.dumps(m.get('related_role_ids') or [])} for m in memories
+                ])
+        
+        return memories
+    
     # ==================== Wiki Operations ====================
     
-    def get_wiki_entries(self, category: Optional[str] = None, limit: int = 100) -> List[Dict]:
+    def get_wiki_entries(self, category: Optional[str] = None, limit: int = 100,
+                         fields: Optional[List[str]] = None) -> List[Dict]:
         """Get wiki entries"""
         if self.use_supabase:
             try:
-                query = self.supabase.table('wiki_entries').select('*').eq('is_published', True)
-                if category:
-                    query = query.eq('category', category)
-                result = query.limit(limit).execute()
-                return result.data or []
+                with track_storage('get_wiki_entries', 'supabase', fallback=True):
+                    query = self.supabase.table('wiki_entries').select(self._supabase_columns('wiki_entries', fields)).eq('is_published', True)
+                    if category:
+                        query = query.eq('category', category)
+                    result = query.limit(limit).execute()
+                    return result.data or []
             except Exception as e:
                 print(f"[Storage] Supabase get_wiki_entries failed: {e}")
         
-        cursor = self.sqlite_conn.cursor()
-        sql = 'SELECT * FROM wiki_entries WHERE is_published = 1'
-        params = []
-        if category:
-            sql += ' AND category = ?'
-            params.append(category)
-        sql += ' ORDER BY updated_at DESC LIMIT ?'
-        params.append(limit)
-        cursor.execute(sql, params)
-        rows = cursor.fetchall()
-        entries = []
-        for row in rows:
-            entry = dict(row)
-            try:
-                entry['related_role_ids'] = json.loads(entry.get('related_role_ids', '[]'))
-            except:
-                entry['related_role_ids'] = []
-            entries.append(entry)
-        return entries
+        with track_storage('get_wiki_entries', 'sqlite'):
+            sql = f"SELECT {self._sql_columns('wiki_entries', fields)} FROM wiki_entries WHERE is_published = 1"
+            params = []
+            if category:
+                sql += ' AND category = ?'
+                params.append(category)
+            sql += ' ORDER BY updated_at DESC LIMIT ?'
+            params.append(limit)
+            rows = self._query(sql, params)
+            entries = []
+            for row in rows:
+                entry = dict(row)
+                if 'related_role_ids' in entry:
+                    try:
+                        entry['related_role_ids'] = json.loads(entry.get('related_role_ids', '[]'))
+                    except:
+                        entry['related_role_ids'] = []
+                entries.append(entry)
+            return entries
     
     def create_wiki_entry(self, entry_data: Dict) -> Dict:
         """Create a wiki entry"""
@@ -530,23 +890,75 @@ class StorageService:
         
         if self.use_supabase:
             try:
-                self.supabase.table('wiki_entries').insert(entry_data).execute()
+                with track_storage('create_wiki_entry', 'supabase'):
+                    self.supabase.table('wiki_entries').insert(entry_data).execute()
             except Exception as e:
                 print(f"[Storage] Supabase create_wiki_entry failed: {e}")
         
-        cursor = self.sqlite_conn.cursor()
-        fields = list(entry_data.keys())
-        placeholders = ', '.join(['?' for _ in fields])
-        sql = f"INSERT INTO wiki_entries ({', '.join(fields)}) VALUES ({placeholders})"
-        cursor.execute(sql, [entry_data.get(f) for f in fields])
-        self.sqlite_conn.commit()
+        with track_storage('create_wiki_entry', 'sqlite'):
+            fields = list(entry_data.keys())
+            placeholders = ', '.join(['?' for _ in fields])
+            sql = f"INSERT INTO wiki_entries ({', '.join(fields)}) VALUES ({placeholders})"
+            with self._transaction():
+                self._execute(sql, [entry_data.get(f) for f in fields])
         
         return entry_data
     
+    # ==================== Export Operations ====================
+    
+    def iter_export_batches(self, table: str, since: Optional[str] = None,
+                            fields: Optional[List[str]] = None,
+                            batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[List[Dict]]:
+        """
+        Stream a table from SQLite in fetchmany() batches
+        
+        Uses a dedicated read-only connection so a long export neither holds
+        the shared connection nor loads the table into memory. Rows come in
+        rowid order (no sort), optionally limited to created_at > since.
+        """
+        columns = self._sql_columns(table, self.resolve_fields(table, fields))
+        sql = f"SELECT {columns} FROM {table}"
+        params = []
+        if since:
+            sql += ' WHERE created_at > ?'
+            params.append(since)
+        sql += ' ORDER BY rowid'
+        
+        json_columns = JSON_COLUMNS.get(table, [])
+        conn = sqlite3.connect(f"file:{os.path.abspath(SQLITE_DB_PATH)}?mode=ro", uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                batch = []
+                for row in rows:
+                    item = dict(row)
+                    for column in json_columns:
+                        if isinstance(item.get(column), str):
+                            try:
+                                item[column] = json.loads(item[column])
+                            except ValueError:
+                                pass
+                    batch.append(item)
+                yield batch
+        finally:
+            conn.close()
+    
     # ==================== Sync Operations ====================
     
-    def sync_from_supabase(self) -> bool:
-        """Sync all data from Supabase to SQLite"""
+    def sync_from_supabase(self, job=None) -> bool:
+        """
+        Sync all data from Supabase to SQLite
+        
+        Tables are copied page by page, committing after each page so the
+        SQLite write lock is never held for the whole sync.
+        
+        Args:
+            job: Optional background Job for progress reporting and cancellation
+        """
         if not self.use_supabase:
             print("[Storage] Supabase not configured, skipping sync")
             return False
@@ -554,45 +966,53 @@ class StorageService:
         try:
             print("[Storage] Starting sync from Supabase to SQLite...")
             
-            # Sync roles
-            result = self.supabase.table('roles').select('*').execute()
-            roles = result.data or []
-            cursor = self.sqlite_conn.cursor()
-            for role in roles:
-                fields = list(role.keys())
-                placeholders = ', '.join(['?' for _ in fields])
-                sql = f"INSERT OR REPLACE INTO roles ({', '.join(fields)}) VALUES ({placeholders})"
-                cursor.execute(sql, [role.get(f) for f in fields])
-            print(f"[Storage] Synced {len(roles)} roles")
+            for table in SYNC_TABLES:
+                count = self._sync_table(table, job)
+                print(f"[Storage] Synced {count} {table}")
             
-            # Sync circles
-            result = self.supabase.table('circles').select('*').execute()
-            circles = result.data or []
-            for circle in circles:
-                fields = list(circle.keys())
-                placeholders = ', '.join(['?' for _ in fields])
-                sql = f"INSERT OR REPLACE INTO circles ({', '.join(fields)}) VALUES ({placeholders})"
-                cursor.execute(sql, [circle.get(f) for f in fields])
-            print(f"[Storage] Synced {len(circles)} circles")
-            
-            # Sync posts
-            result = self.supabase.table('posts').select('*').execute()
-            posts = result.data or []
-            for post in posts:
-                fields = list(post.keys())
-                placeholders = ', '.join(['?' for _ in fields])
-                sql = f"INSERT OR REPLACE INTO posts ({', '.join(fields)}) VALUES ({placeholders})"
-                cursor.execute(sql, [post.get(f) for f in fields])
-            print(f"[Storage] Synced {len(posts)} posts")
-            
-            self.sqlite_conn.commit()
             print("[Storage] Sync completed successfully")
             return True
             
         except Exception as e:
-            print(f"[Storage] Sync failed: {e}")
+            if job is not None and job.cancel_requested:
+                print("[Storage] Sync cancelled")
+            else:
+                print(f"[Storage] Sync failed: {e}")
             return False
     
+    def _sync_table(self, table: str, job=None) -> int:
+        """Copy one table from Supabase in pages, returns rows synced"""
+        total = None
+        if job is not None:
+            result = self.supabase.table(table).select('id', count='exact').limit(1).execute()
+            total = result.count
+            job.update_progress(table, 0, total)
+        
+        synced = 0
+        while True:
+            if job is not None:
+                job.check_cancelled()
+            # Postgres only keeps row order stable between pages under an explicit ORDER BY
+            result = (self.supabase.table(table).select('*').order('id')
+                      .range(synced, synced + SYNC_PAGE_SIZE - 1).execute())
+            rows = result.data or []
+            if not rows:
+                break
+            
+            fields = list(rows[0].keys())
+            placeholders = ', '.join(['?' for _ in fields])
+            sql = f"INSERT OR REPLACE INTO {table} ({', '.join(fields)}) VALUES ({placeholders})"
+            with self._transaction():
+                self._execute(sql, [[row.get(f) for f in fields] for row in rows], many=True)
+            
+            synced += len(rows)
+            if job is not None:
+                job.update_progress(table, synced, total)
+            if len(rows) < SYNC_PAGE_SIZE:
+                break
+        
+        return synced
+    
     def close(self):
         """Close database connections"""
         if self.sqlite_conn:
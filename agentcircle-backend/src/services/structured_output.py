@@ -0,0 +1,163 @@
+"""
+Structured LLM output
+Per content type JSON schemas, sent as an OpenAI response_format, an Anthropic
+tool input_schema or a Gemini responseSchema, and the tolerant parser and
+validator applied to what the provider returns
+"""
+import os
+import re
+import json
+from typing import Optional, Dict, Any, List, Iterable, Union
+
+# Ask providers for schema-constrained output; validation and repair apply either way
+LLM_STRUCTURED_OUTPUT = os.getenv('LLM_STRUCTURED_OUTPUT', 'true').lower() == 'true'
+# Re-prompts with the validation errors before an output is given up on
+LLM_REPAIR_ATTEMPTS = int(os.getenv('LLM_REPAIR_ATTEMPTS', '1'))
+# Characters of the rejected output quoted back in a repair prompt
+REPAIR_QUOTE_CHARS = 2000
+
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+# strict=False accepts raw newlines inside strings, a common model slip
+_DECODER = json.JSONDecoder(strict=False)
+
+class OutputValidationError(ValueError):
+    """Model output that is not JSON or does not match its schema"""
+
+    def __init__(self, errors: List[str], text: str):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+        self.text = text
+
+def parse_json_output(text: str) -> Optional[Dict[str, Any]]:
+    """
+    The first JSON object in model output, or None
+
+    Decodes from the first opening brace and ignores whatever follows the
+    object, so code fences and trailing remarks need no separate pass.
+    Trailing commas are dropped on a second try.
+    """
+    start = text.find('{')
+    if start < 0:
+        return None
+    try:
+        data, _ = _DECODER.raw_decode(text, start)
+    except ValueError:
+        try:
+            data, _ = _DECODER.raw_decode(_TRAILING_COMMA.sub(r'\1', text[start:]))
+        except ValueError:
+            return None
+    return data if isinstance(data, dict) else None
+
+def _is_closed(schema: Dict[str, Any]) -> bool:
+    """Every object lists its properties, all required, with no extras (OpenAI strict mode)"""
+    if schema.get('type') != 'object':
+        return True
+    properties = schema.get('properties') or {}
+    return (
+        bool(properties)
+        and schema.get('additionalProperties') is False
+        and set(schema.get('required', [])) == set(properties)
+        and all(_is_closed(p) for p in properties.values())
+    )
+
+def _gemini_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """OpenAPI-style responseSchema; objects without properties are left out (Gemini rejects them)"""
+    out: Dict[str, Any] = {'type': schema['type'].upper()}
+    if 'description' in schema:
+        out['description'] = schema['description']
+    properties = {
+        name: prop for name, prop in (schema.get('properties') or {}).items()
+        if prop.get('type') != 'object' or prop.get('properties')
+    }
+    if properties:
+        out['properties'] = {name: _gemini_schema(prop) for name, prop in properties.items()}
+        out['required'] = [name for name in schema.get('required', []) if name in properties]
+        out['propertyOrdering'] = list(properties)
+    return out
+
+class OutputSchema:
+    """A JSON schema for one kind of generated output, in each provider's request format"""
+
+    def __init__(self, name: str, description: str, schema: Dict[str, Any]):
+        self.name = name
+        self.description = description
+        self.schema = schema
+        self.strict = _is_closed(schema)
+        self._gemini = _gemini_schema(schema)
+
+    def openai_response_format(self) -> Dict[str, Any]:
+        return {'type': 'json_schema', 'json_schema': {'name': self.name, 'schema': self.schema, 'strict': self.strict}}
+
+    def anthropic_tool(self) -> Dict[str, Any]:
+        return {'name': self.name, 'description': self.description, 'input_schema': self.schema}
+
+    def gemini_response_schema(self) -> Dict[str, Any]:
+        return self._gemini
+
+    def validate(self, data: Dict[str, Any]) -> List[str]:
+        """Problems with the top-level fields; required strings must be non-empty"""
+        errors = []
+        for name in self.schema.get('required', []):
+            expected = self.schema['properties'][name].get('type')
+            value = data.get(name)
+            if value is None:
+                errors.append(f'缺少字段 {name}')
+            elif expected == 'string' and not (isinstance(value, str) and value.strip()):
+                errors.append(f'字段 {name} 应为非空字符串')
+            elif expected == 'object' and not isinstance(value, dict):
+                errors.append(f'字段 {name} 应为JSON对象')
+        return errors
+
+    def parse(self, output: Union[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Validated output; raises OutputValidationError when it is unusable"""
+        text = output if isinstance(output, str) else json.dumps(output, ensure_ascii=False)
+        data = parse_json_output(output) if isinstance(output, str) else output
+        if data is None:
+            raise OutputValidationError(['输出不是有效的JSON对象'], text)
+        errors = self.validate(data)
+        if errors:
+            raise OutputValidationError(errors, text)
+        return data
+
+def post_schema(content_type: str, metadata_fields: Optional[Iterable[str]] = None) -> OutputSchema:
+    """Schema of a generated post; metadata is closed when the content type lists its fields"""
+    fields = list(metadata_fields or [])
+    if fields:
+        metadata = {
+            'type': 'object',
+            'description': '元数据',
+            'properties': {field: {'type': 'string'} for field in fields},
+            'required': fields,
+            'additionalProperties': False,
+        }
+    else:
+        metadata = {'type': 'object', 'description': '元数据，根据内容类型包含不同字段'}
+    return OutputSchema(f'{content_type}_post', '发布一篇帖子', {
+        'type': 'object',
+        'properties': {
+            'title': {'type': 'string', 'description': '标题'},
+            'content': {'type': 'string', 'description': '正文内容'},
+            'metadata': metadata,
+        },
+        'required': ['title', 'content'] + (['metadata'] if fields else []),
+        'additionalProperties': False,
+    })
+
+CHAT_SCHEMA = OutputSchema('chat_message', '在聊天室里发送一条消息', {
+    'type': 'object',
+    'properties': {
+        'content': {'type': 'string', 'description': '回复内容'},
+        'emotion': {'type': 'string', 'description': '情绪标签（如：开心、思考、惊讶、平静等）'},
+    },
+    'required': ['content', 'emotion'],
+    'additionalProperties': False,
+})
+
+def repair_prompt(user_prompt: str, error: OutputValidationError) -> str:
+    """The original task followed by the rejected output and what was wrong with it"""
+    return (
+        f"{user_prompt}\n\n"
+        f"你上一次的输出不符合要求（{'；'.join(error.errors)}）：\n"
+        f"{error.text[:REPAIR_QUOTE_CHARS]}\n\n"
+        "请修正以上问题，只返回符合要求的JSON对象。"
+    )
@@ -0,0 +1,265 @@
+"""
+LLM token and cost accounting
+Usage is attributed to the role, content type and scheduler job in context, aggregated
+in memory and flushed periodically into the llm_usage table
+"""
+import os
+import json
+import asyncio
+import sqlite3
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+
+from services.metrics import record_llm_cost
+from services.storage_service import SQLITE_DB_PATH
+
+LLM_USAGE_FLUSH_SECONDS = float(os.getenv('LLM_USAGE_FLUSH_SECONDS', '60'))
+# USD per UTC day across all LLM calls; 0 disables the cap
+LLM_DAILY_SPEND_CAP = float(os.getenv('LLM_DAILY_SPEND_CAP', '0'))
+# Per-job daily caps, e.g. "content_generation=2.5,chat_activity=1"
+LLM_JOB_DAILY_SPEND_CAPS = {
+    job.strip(): float(cap)
+    for job, cap in (part.split('=', 1) for part in os.getenv('LLM_JOB_DAILY_SPEND_CAPS', '').split(',') if '=' in part)
+}
+
+# USD per million (prompt, completion) tokens; override with LLM_PRICES='{"gpt-4o": [2.5, 10]}'
+MODEL_PRICES = {
+    'gpt-4o': (2.5, 10.0),
+    'gpt-4o-mini': (0.15, 0.6),
+    'claude-3-sonnet': (3.0, 15.0),
+    'claude-3-haiku': (0.25, 1.25),
+    'gemini-pro': (0.5, 1.5),
+}
+MODEL_PRICES.update({m: tuple(p) for m, p in json.loads(os.getenv('LLM_PRICES', '{}')).items()})
+
+# Prompt cache pricing relative to the input price: (cache read, cache write)
+CACHE_PRICE_FACTORS = {
+    'openai': (0.5, 1.0),
+    'anthropic': (0.1, 1.25),
+    'gemini': (0.25, 1.0),
+}
+
+ROLLUP_DIMENSIONS = ('role_id', 'model', 'content_type', 'job', 'day')
+
+_usage_labels: contextvars.ContextVar[Dict[str, str]] = contextvars.ContextVar('llm_usage_labels', default={})
+
+@contextmanager
+def usage_context(**labels: Optional[str]):
+    """Attribute LLM usage inside the block to these labels (role, content_type, job)"""
+    token = _usage_labels.set({**_usage_labels.get(), **{k: v for k, v in labels.items() if v}})
+    try:
+        yield
+    finally:
+        _usage_labels.reset(token)
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+def cost_of(provider: str, model: str, prompt_tokens: int, completion_tokens: int,
+            cached_tokens: int = 0, cache_write_tokens: int = 0) -> float:
+    """USD for one call; cached and cache-write tokens are the parts of prompt_tokens billed at cache rates"""
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    read_factor, write_factor = CACHE_PRICE_FACTORS.get(provider, (1.0, 1.0))
+    uncached = max(0, prompt_tokens - cached_tokens - cache_write_tokens)
+    prompt_cost = (uncached + cached_tokens * read_factor + cache_write_tokens * write_factor) * prompt_price
+    return (prompt_cost + completion_tokens * completion_price) / 1_000_000
+
+class UsageTracker:
+    """In-memory usage aggregates with periodic flush, daily rollups and spend caps"""
+
+    def __init__(self, db_path: str = SQLITE_DB_PATH):
+        self.db_path = db_path
+        # (day, job, role_id, model, content_type) -> [calls, prompt, completion, cached, cache_write, cost]
+        self._pending: Dict[Tuple[str, str, str, str, str], List[float]] = {}
+        # (day, job) -> spend, flushed or not; '' is the all-jobs total
+        self._spend: Dict[Tuple[str, str], float] = {}
+        self._spend_loaded_for: Optional[str] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()  # in-memory aggregates
+        # Connection use; a flush holds it from taking pending rows until they are committed,
+        # so a spend reload sees each row either pending or in the table, never both or neither
+        self._db_lock = threading.RLock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Shared connection (caller holds _db_lock)"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, timeout=5.0, check_same_thread=False)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_usage (
+                    day TEXT NOT NULL,
+                    job TEXT NOT NULL,
+                    role_id TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    content_type TEXT NOT NULL,
+                    calls INTEGER NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL,
+                    cached_tokens INTEGER NOT NULL DEFAULT 0,
+                    cache_write_tokens INTEGER NOT NULL DEFAULT 0,
+                    cost_usd REAL NOT NULL,
+                    PRIMARY KEY (day, job, role_id, model, content_type)
+                )
+            ''')
+            # Tables created before prompt cache accounting
+            columns = {row[1] for row in self._conn.execute('PRAGMA table_info(llm_usage)')}
+            for column in ('cached_tokens', 'cache_write_tokens'):
+                if column not in columns:
+                    self._conn.execute(f'ALTER TABLE llm_usage ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0')
+            self._conn.commit()
+        return self._conn
+
+    # -------- Recording --------
+
+    def record(self, provider: str, model: str, prompt_tokens: int, completion_tokens: int,
+               cached_tokens: int = 0, cache_write_tokens: int = 0) -> float:
+        """Account one call against the labels in context; returns its cost in USD"""
+        labels = _usage_labels.get()
+        day = _today()
+        job = labels.get('job', '')
+        cost = cost_of(provider, model, prompt_tokens, completion_tokens, cached_tokens, cache_write_tokens)
+        key = (day, job, labels.get('role', ''), model, labels.get('content_type', ''))
+        with self._lock:
+            row = self._pending.setdefault(key, [0, 0, 0, 0, 0, 0.0])
+            for i, value in enumerate((1, prompt_tokens, completion_tokens, cached_tokens, cache_write_tokens, cost)):
+                row[i] += value
+            self._spend[(day, '')] = self._spend.get((day, ''), 0.0) + cost
+            if job:
+                self._spend[(day, job)] = self._spend.get((day, job), 0.0) + cost
+        record_llm_cost(provider, model, cost)
+        return cost
+
+    def flush(self):
+        """Write pending aggregates to llm_usage (blocking)"""
+        with self._db_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            conn = self._connect()
+            try:
+                conn.executemany('''
+                    INSERT INTO llm_usage (day, job, role_id, model, content_type, calls, prompt_tokens, completion_tokens,
+                                           cached_tokens, cache_write_tokens, cost_usd)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(day, job, role_id, model, content_type) DO UPDATE SET
+                        calls = calls + excluded.calls,
+                        prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                        completion_tokens = completion_tokens + excluded.completion_tokens,
+                        cached_tokens = cached_tokens + excluded.cached_tokens,
+                        cache_write_tokens = cache_write_tokens + excluded.cache_write_tokens,
+                        cost_usd = cost_usd + excluded.cost_usd
+                ''', [key + tuple(row) for key, row in pending.items()])
+                conn.commit()
+            except Exception as e:
+                # Keep the aggregates for the next flush
+                print(f"[Usage] Flush failed: {e}")
+                with self._lock:
+                    for key, row in pending.items():
+                        merged = self._pending.setdefault(key, [0, 0, 0, 0, 0, 0.0])
+                        for i, value in enumerate(row):
+                            merged[i] += value
+
+    # -------- Spend caps --------
+
+    def _load_spend(self, day: str):
+        """Rebuild today's totals from flushed rows (plus unflushed ones) so caps survive a restart"""
+        with self._db_lock:
+            rows = self._connect().execute(
+                'SELECT job, SUM(cost_usd) FROM llm_usage WHERE day = ? GROUP BY job', (day,)
+            ).fetchall()
+            with self._lock:
+                rows += [(key[1], row[-1]) for key, row in self._pending.items() if key[0] == day]
+                self._spend = {}
+                for job, cost in rows:
+                    self._spend[(day, '')] = self._spend.get((day, ''), 0.0) + cost
+                    if job:
+                        self._spend[(day, job)] = self._spend.get((day, job), 0.0) + cost
+                self._spend_loaded_for = day
+
+    def spend_today(self, job: str = '') -> float:
+        day = _today()
+        if self._spend_loaded_for != day:
+            self._load_spend(day)
+        return self._spend.get((day, job), 0.0)
+
+    def over_cap(self, job: Optional[str] = None) -> Optional[str]:
+        """Reason string when today's global or job spend cap is reached, else None"""
+        if LLM_DAILY_SPEND_CAP > 0:
+            spent = self.spend_today()
+            if spent >= LLM_DAILY_SPEND_CAP:
+                return f"daily LLM spend ${spent:.2f} reached cap ${LLM_DAILY_SPEND_CAP:.2f}"
+        cap = LLM_JOB_DAILY_SPEND_CAPS.get(job or '', 0)
+        if cap > 0:
+            spent = self.spend_today(job)
+            if spent >= cap:
+                return f"{job} LLM spend ${spent:.2f} reached daily cap ${cap:.2f}"
+        return None
+
+    # -------- Reporting --------
+
+    def rollup(self, group_by: str, days: int = 7) -> List[Dict[str, Any]]:
+        """Usage totals grouped by one dimension over the last `days` UTC days"""
+        if group_by not in ROLLUP_DIMENSIONS:
+            raise ValueError(f"Unknown rollup dimension: {group_by}")
+        since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        with self._db_lock:
+            self.flush()
+            rows = self._connect().execute(f'''
+                SELECT {group_by}, SUM(calls), SUM(prompt_tokens), SUM(completion_tokens),
+                       SUM(cached_tokens), SUM(cache_write_tokens), SUM(cost_usd)
+                FROM llm_usage WHERE day >= ?
+                GROUP BY {group_by} ORDER BY SUM(cost_usd) DESC
+            ''', (since,)).fetchall()
+        return [
+            {
+                group_by: key, 'calls': calls, 'prompt_tokens': prompt, 'completion_tokens': completion,
+                'cached_tokens': cached, 'cache_write_tokens': cache_write,
+                # Share of input tokens served from the provider's prompt cache
+                'cache_hit_rate': round(cached / prompt, 3) if prompt else 0.0,
+                'avg_completion_tokens': round(completion / calls, 1) if calls else 0,
+                'cost_usd': round(cost, 6),
+            }
+            for key, calls, prompt, completion, cached, cache_write, cost in rows
+        ]
+
+    def caps(self) -> Dict[str, Any]:
+        """Caps and today's spend (blocking on the first call of a day)"""
+        return {
+            'daily_cap_usd': LLM_DAILY_SPEND_CAP,
+            'spent_today_usd': round(self.spend_today(), 6),
+            'jobs': {
+                job: {'cap_usd': cap, 'spent_today_usd': round(self.spend_today(job), 6)}
+                for job, cap in LLM_JOB_DAILY_SPEND_CAPS.items()
+            },
+        }
+
+    # -------- Background flush --------
+
+    def start(self):
+        """Flush on an interval on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(LLM_USAGE_FLUSH_SECONDS)
+            await loop.run_in_executor(None, self.flush)
+
+    async def stop(self):
+        """Stop the flush loop and write what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        with self._db_lock:
+            self.flush()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+# Global usage tracker, flushing into the main SQLite database
+usage_tracker = UsageTracker()
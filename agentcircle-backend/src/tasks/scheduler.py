@@ -4,9 +4,11 @@ Runs periodic tasks like content generation, life cycle updates, etc.
 """
 import os
 import sys
+import time
 import random
 import asyncio
 from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
@@ -15,6 +17,20 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from services.storage_service import storage
 from services.llm_service import llm_service
+from services.event_bus import event_bus, room_topic
+from services.metrics import record_job_run, record_job_items, record_duplicate_post
+from services.profiler import profiler
+from services.rate_limiter import retry_budget
+from services.usage_tracker import usage_tracker, usage_context
+from services.prompt_compiler import personality
+from services.memory_service import memory_service, chat_memories, post_memory
+from services.post_dedup import post_dedup
+
+# Concurrent LLM calls per job run, and the time budget for each item
+SCHEDULER_CONCURRENCY = int(os.getenv('SCHEDULER_CONCURRENCY', '5'))
+SCHEDULER_ITEM_TIMEOUT = float(os.getenv('SCHEDULER_ITEM_TIMEOUT', '90'))
+# Stream chat replies and publish partial text to room SSE subscribers as it is generated
+CHAT_STREAM_DELTAS = os.getenv('CHAT_STREAM_DELTAS', 'false').lower() == 'true'
 
 class AgentCircleScheduler:
     """Scheduler for automated tasks"""
@@ -30,7 +46,8 @@ class AgentCircleScheduler:
         
         # Content generation task - every hour
         self.scheduler.add_job(
-            self._generate_content_task,
+            self._run_job,
+            args=['content_generation', self._generate_content_task],
             trigger=IntervalTrigger(hours=1),
             id='content_generation',
             name='Generate content for random roles',
@@ -39,7 +56,8 @@ class AgentCircleScheduler:
         
         # Life cycle update task - every 6 hours
         self.scheduler.add_job(
-            self._update_life_cycle_task,
+            self._run_job,
+            args=['life_cycle_update', self._update_life_cycle_task],
             trigger=IntervalTrigger(hours=6),
             id='life_cycle_update',
             name='Update role life cycles',
@@ -48,7 +66,8 @@ class AgentCircleScheduler:
         
         # Social interaction task - every 2 hours
         self.scheduler.add_job(
-            self._social_interaction_task,
+            self._run_job,
+            args=['social_interaction', self._social_interaction_task],
             trigger=IntervalTrigger(hours=2),
             id='social_interaction',
             name='Generate social interactions',
@@ -57,7 +76,8 @@ class AgentCircleScheduler:
         
         # Chat room activity task - every 30 minutes
         self.scheduler.add_job(
-            self._chat_room_activity_task,
+            self._run_job,
+            args=['chat_activity', self._chat_room_activity_task],
             trigger=IntervalTrigger(minutes=30),
             id='chat_activity',
             name='Generate chat room messages',
@@ -80,13 +100,64 @@ class AgentCircleScheduler:
             self.is_running = False
             print("[Scheduler] Stopped")
     
+    async def _run_job(self, job_id: str, task):
+        """Run a job with a shared LLM retry budget and usage attribution, recording metrics (and a profile if armed)"""
+        started = time.monotonic()
+        status = 'success'
+        items = 0
+        try:
+            reason = await asyncio.to_thread(usage_tracker.over_cap, job_id)
+            if reason:
+                status = 'skipped'
+                print(f"[Scheduler] Skipping {job_id}: {reason}")
+                return
+            with profiler.profile_job(job_id), retry_budget(), usage_context(job=job_id):
+                items = await task() or 0
+        except Exception as e:
+            status = 'error'
+            print(f"[Scheduler] Job {job_id} raised: {e}")
+        finally:
+            record_job_run(job_id, time.monotonic() - started, items, status)
+    
+    async def _fan_out(self, job_id: str, items: List[Any], worker: Callable[[Any], Awaitable[Any]]) -> List[Any]:
+        """
+        Run worker(item) for all items, at most SCHEDULER_CONCURRENCY at a time
+        
+        Each item gets SCHEDULER_ITEM_TIMEOUT seconds; failures and timeouts are
+        counted and logged without affecting the other items. Items not yet
+        started once a spend cap is reached are skipped. Returns the non-None
+        results of the items that succeeded.
+        """
+        semaphore = asyncio.Semaphore(SCHEDULER_CONCURRENCY)
+        
+        async def run(item):
+            async with semaphore:
+                if await asyncio.to_thread(usage_tracker.over_cap, job_id):
+                    return None
+                return await asyncio.wait_for(worker(item), timeout=SCHEDULER_ITEM_TIMEOUT)
+        
+        outcomes = await asyncio.gather(*[run(item) for item in items], return_exceptions=True)
+        results, failed, timed_out = [], 0, 0
+        for outcome in outcomes:
+            if isinstance(outcome, asyncio.TimeoutError):
+                timed_out += 1
+            elif isinstance(outcome, Exception):
+                failed += 1
+                print(f"[Scheduler] {job_id} item failed: {outcome}")
+            elif outcome is not None:
+                results.append(outcome)
+        record_job_items(job_id, succeeded=len(results), failed=failed, timed_out=timed_out)
+        if failed or timed_out:
+            print(f"[Scheduler] {job_id}: {len(results)} succeeded, {failed} failed, {timed_out} timed out")
+        return results
+    
     async def _generate_content_task(self):
         """Generate content (posts) for random roles"""
         print(f"[Scheduler] Content generation task started at {datetime.now()}")
         
         try:
             # Get all active roles
-            roles = storage.get_roles(limit=1000)
+            roles = await asyncio.to_thread(storage.get_roles, limit=1000)
             alive_roles = [r for r in roles if r.get('is_alive', True)]
             
             if not alive_roles:
@@ -96,108 +167,117 @@ class AgentCircleScheduler:
             # Select 5-10 random roles to generate content
             num_roles = random.randint(5, 10)
             selected_roles = random.sample(alive_roles, min(num_roles, len(alive_roles)))
+            circles = await asyncio.to_thread(storage.get_circles, fields=['name'])
+            circle_ids = {c['name']: c['id'] for c in circles}
+            await asyncio.to_thread(post_dedup.load)
             
-            for role in selected_roles:
-                try:
-                    # Generate content
-                    content = llm_service.generate_content(role)
-                    
-                    # Find circle ID
-                    circle_name = content.get('circle', '闲聊杂谈')
-                    circles = storage.get_circles()
-                    circle_id = None
-                    for c in circles:
-                        if c['name'] == circle_name:
-                            circle_id = c['id']
-                            break
-                    
-                    # Create post
-                    post_data = {
-                        'id': f"post_{datetime.now().timestamp()}_{role['id']}",
-                        'author_id': role['id'],
-                        'circle_id': circle_id,
-                        'title': content['title'],
-                        'content': content['content'],
-                        'content_type': content['content_type'],
-                        'metadata': content.get('metadata', {}),
-                    }
-                    
-                    storage.create_post(post_data)
-                    
-                    # Update role last active time
-                    storage.update_role(role['id'], {
-                        'last_active_at': datetime.utcnow().isoformat()
-                    })
-                    
-                    print(f"[Scheduler] Created {content['content_type']} post for {role['name']}: {content['title'][:30]}...")
-                    
-                except Exception as e:
-                    print(f"[Scheduler] Failed to generate content for {role.get('name', 'unknown')}: {e}")
+            async def generate(role):
+                content = await llm_service.agenerate_content(role)
+                post = {
+                    'id': f"post_{datetime.now().timestamp()}_{role['id']}",
+                    'author_id': role['id'],
+                    'circle_id': circle_ids.get(content.get('circle', '闲聊杂谈')),
+                    'title': content['title'],
+                    'content': content['content'],
+                    'content_type': content['content_type'],
+                    'metadata': content.get('metadata', {}),
+                }
+                # Drop near-duplicates of recent posts (including fallback template content)
+                duplicate = post_dedup.check_and_add(post, topic=content.get('topic'))
+                if duplicate:
+                    record_duplicate_post(content['content_type'])
+                    print(f"[Scheduler] Dropped post for {role['name']}: {duplicate['similarity']:.0%} similar to {duplicate['post_id']}")
+                    return None
+                print(f"[Scheduler] Generated {content['content_type']} post for {role['name']}: {content['title'][:30]}...")
+                return post
+            
+            # Generate concurrently, then write all posts in one batch
+            posts = await self._fan_out('content_generation', selected_roles, generate)
+            try:
+                await asyncio.to_thread(storage.create_posts, posts)
+            except Exception:
+                # Unstored posts must not suppress their retries as duplicates
+                post_dedup.discard(p['id'] for p in posts)
+                raise
+            await asyncio.to_thread(storage.touch_roles, [p['author_id'] for p in posts])
+            circle_names = {circle_id: name for name, circle_id in circle_ids.items()}
+            await asyncio.to_thread(memory_service.remember, [
+                post_memory(p, circle_names.get(p['circle_id'])) for p in posts
+            ])
             
-            print(f"[Scheduler] Content generation completed. Generated {len(selected_roles)} posts.")
+            print(f"[Scheduler] Content generation completed. Generated {len(posts)} posts.")
+            return len(posts)
             
         except Exception as e:
             print(f"[Scheduler] Content generation task failed: {e}")
+            raise
     
     async def _update_life_cycle_task(self):
         """Update role life cycles (age, health, mood, etc.)"""
         print(f"[Scheduler] Life cycle update task started at {datetime.now()}")
         
         try:
-            roles = storage.get_roles(limit=1000)
-            
-            for role in roles:
-                try:
-                    updates = {}
-                    
-                    # Age increment (1 year per 6 hours of real time = accelerated aging)
-                    current_age = role.get('age', 25)
-                    updates['age'] = current_age + 1
-                    
-                    # Health changes based on age
-                    if updates['age'] > 60:
-                        health_change = random.randint(-5, 2)
-                    elif updates['age'] > 40:
-                        health_change = random.randint(-3, 3)
-                    else:
-                        health_change = random.randint(-2, 5)
-                    
-                    current_health = role.get('health', 100)
-                    new_health = max(0, min(100, current_health + health_change))
-                    updates['health'] = new_health
-                    
-                    # Mood changes randomly
-                    moods = ['happy', 'sad', 'angry', 'excited', 'neutral', 'thoughtful', 'tired']
-                    personality = role.get('personality', {})
-                    
-                    # Mood influenced by neuroticism
-                    if personality.get('neuroticism', 50) > 70:
-                        # More likely to be sad or angry
-                        weights = [0.1, 0.25, 0.2, 0.1, 0.15, 0.1, 0.1]
-                    elif personality.get('extraversion', 50) > 70:
-                        # More likely to be happy or excited
-                        weights = [0.3, 0.05, 0.05, 0.25, 0.15, 0.1, 0.1]
-                    else:
-                        weights = [0.2, 0.1, 0.1, 0.15, 0.25, 0.1, 0.1]
-                    
-                    updates['mood'] = random.choices(moods, weights=weights)[0]
-                    
-                    # Check for death
-                    if new_health <= 0 or updates['age'] > 100:
-                        updates['is_alive'] = False
-                        updates['death_date'] = datetime.utcnow().isoformat()
-                        print(f"[Scheduler] {role['name']} has passed away at age {updates['age']}")
-                    
-                    # Update role
-                    storage.update_role(role['id'], updates)
-                    
-                except Exception as e:
-                    print(f"[Scheduler] Failed to update life cycle for {role.get('name', 'unknown')}: {e}")
-            
+            roles = await asyncio.to_thread(storage.get_roles, limit=1000)
+            updated = await asyncio.to_thread(self._update_life_cycles, roles)
             print(f"[Scheduler] Life cycle update completed for {len(roles)} roles.")
+            return updated
             
         except Exception as e:
             print(f"[Scheduler] Life cycle update task failed: {e}")
+            raise
+    
+    def _update_life_cycles(self, roles: List[Dict]) -> int:
+        """Age each role and roll its health and mood (blocking storage writes; run in a thread)"""
+        updated = 0
+        for role in roles:
+            try:
+                updates = {}
+                
+                # Age increment (1 year per 6 hours of real time = accelerated aging)
+                current_age = role.get('age', 25)
+                updates['age'] = current_age + 1
+                
+                # Health changes based on age
+                if updates['age'] > 60:
+                    health_change = random.randint(-5, 2)
+                elif updates['age'] > 40:
+                    health_change = random.randint(-3, 3)
+                else:
+                    health_change = random.randint(-2, 5)
+                
+                current_health = role.get('health', 100)
+                new_health = max(0, min(100, current_health + health_change))
+                updates['health'] = new_health
+                
+                # Mood changes randomly
+                moods = ['happy', 'sad', 'angry', 'excited', 'neutral', 'thoughtful', 'tired']
+                traits = personality(role)
+                
+                # Mood influenced by neuroticism
+                if traits['neuroticism'] > 70:
+                    # More likely to be sad or angry
+                    weights = [0.1, 0.25, 0.2, 0.1, 0.15, 0.1, 0.1]
+                elif traits['extraversion'] > 70:
+                    # More likely to be happy or excited
+                    weights = [0.3, 0.05, 0.05, 0.25, 0.15, 0.1, 0.1]
+                else:
+                    weights = [0.2, 0.1, 0.1, 0.15, 0.25, 0.1, 0.1]
+                
+                updates['mood'] = random.choices(moods, weights=weights)[0]
+                
+                # Check for death
+                if new_health <= 0 or updates['age'] > 100:
+                    updates['is_alive'] = False
+                    updates['death_date'] = datetime.utcnow().isoformat()
+                    print(f"[Scheduler] {role['name']} has passed away at age {updates['age']}")
+                
+                # Update role
+                storage.update_role(role['id'], updates)
+                updated += 1
+                
+            except Exception as e:
+                print(f"[Scheduler] Failed to update life cycle for {role.get('name', 'unknown')}: {e}")
+        return updated
     
     async def _social_interaction_task(self):
         """Generate social interactions (likes, comments)"""
@@ -205,14 +285,16 @@ class AgentCircleScheduler:
         
         try:
             # Get recent posts
-            posts = storage.get_posts(limit=50, order_by='created_at')
-            roles = storage.get_roles(limit=200)
+            posts = await asyncio.to_thread(storage.get_posts, limit=50, order_by='created_at')
+            roles = await asyncio.to_thread(storage.get_roles, limit=200)
             alive_roles = [r for r in roles if r.get('is_alive', True)]
             
             if not posts or not alive_roles:
                 print("[Scheduler] No posts or alive roles for social interaction")
                 return
             
+            interactions = 0
+            
             # Generate likes
             for post in random.sample(posts, min(10, len(posts))):
                 try:
@@ -228,6 +310,7 @@ class AgentCircleScheduler:
                                 'role_id': liker['id'],
                             }
                             # Insert like (simplified - would need storage method)
+                            interactions += 1
                             print(f"[Scheduler] {liker['name']} liked post by {post.get('author_id', 'unknown')}")
                     
                 except Exception as e:
@@ -258,79 +341,117 @@ class AgentCircleScheduler:
                                 'author_id': commenter['id'],
                                 'content': random.choice(comment_templates),
                             }
+                            interactions += 1
                             print(f"[Scheduler] {commenter['name']} commented on post")
                     
                 except Exception as e:
                     print(f"[Scheduler] Failed to generate comments: {e}")
             
             print(f"[Scheduler] Social interaction task completed.")
+            return interactions
             
         except Exception as e:
             print(f"[Scheduler] Social interaction task failed: {e}")
+            raise
     
     async def _chat_room_activity_task(self):
         """Generate chat room messages"""
         print(f"[Scheduler] Chat room activity task started at {datetime.now()}")
         
         try:
-            # Get active chat rooms
-            rooms = storage.get_chat_rooms(limit=20)
+            role_cache: Dict[str, Optional[Dict]] = {}
             
-            for room in rooms:
-                try:
+            def get_role(role_id: str) -> Optional[Dict]:
+                if role_id not in role_cache:
+                    role_cache[role_id] = storage.get_role_by_id(role_id)
+                return role_cache[role_id]
+            
+            def prepare():
+                """Active rooms, and a speaker and context per room (storage reads only; run in a thread)"""
+                rooms = storage.get_chat_rooms(limit=20)
+                turns = []
+                for room in rooms:
                     participant_ids = room.get('participant_ids', [])
                     if not participant_ids:
                         continue
                     
                     # Get participants
-                    participants = []
-                    for pid in participant_ids:
-                        role = storage.get_role_by_id(pid)
-                        if role and role.get('is_alive', True):
-                            participants.append(role)
-                    
+                    participants = [r for r in map(get_role, participant_ids) if r and r.get('is_alive', True)]
                     if len(participants) < 2:
                         continue
                     
-                    # Get recent messages for context
-                    messages = storage.get_chat_messages(room['id'], limit=10)
-                    
-                    # Select a random participant to speak
-                    speaker = random.choice(participants)
-                    
-                    # Generate message
+                    # Get the latest messages for context (tail read, chronological)
+                    messages = storage.get_chat_messages(room['id'], limit=5, fields=['sender_id', 'content', 'created_at'])
                     context = [
                         {
-                            'sender_name': storage.get_role_by_id(m['sender_id'])['name'] if storage.get_role_by_id(m['sender_id']) else '未知',
-                            'content': m['content']
+                            'sender_name': (get_role(m['sender_id']) or {}).get('name', '未知'),
+                            'content': m['content'],
+                            'created_at': m['created_at'],
                         }
-                        for m in messages[-5:]
+                        for m in messages
                     ]
                     
-                    result = llm_service.generate_chat_message(
+                    # Select a random participant to speak
+                    turns.append((room, random.choice(participants), context))
+                return rooms, turns
+            
+            rooms, turns = await asyncio.to_thread(prepare)
+            
+            async def speak(turn):
+                room, speaker, context = turn
+                message_id = f"msg_{datetime.now().timestamp()}_{speaker['id']}"
+                if CHAT_STREAM_DELTAS:
+                    result = await self._stream_chat_message(message_id, room, speaker, context)
+                else:
+                    result = await llm_service.agenerate_chat_message(
                         speaker,
                         context,
                         room.get('scene', '一般对话')
                     )
-                    
-                    message_data = {
-                        'id': f"msg_{datetime.now().timestamp()}_{speaker['id']}",
-                        'room_id': room['id'],
-                        'sender_id': speaker['id'],
-                        'content': result['content'],
-                        'emotion': result['emotion'],
-                    }
-                    
-                    storage.create_chat_message(message_data)
-                    print(f"[Scheduler] {speaker['name']} spoke in {room['name']}: {result['content'][:30]}...")
-                    
-                except Exception as e:
-                    print(f"[Scheduler] Failed to generate chat message: {e}")
+                print(f"[Scheduler] {speaker['name']} spoke in {room['name']}: {result['content'][:30]}...")
+                return {
+                    'id': message_id,
+                    'room_id': room['id'],
+                    'sender_id': speaker['id'],
+                    'content': result['content'],
+                    'emotion': result['emotion'],
+                }
+            
+            # Generate concurrently, then write (and publish) all messages in one batch
+            messages = await self._fan_out('chat_activity', turns, speak)
+            await asyncio.to_thread(storage.create_chat_messages, messages)
+            
+            # Speakers remember what they said, the other participants what they heard
+            rooms_by_id = {room['id']: room for room in rooms}
+            names = {m['sender_id']: (role_cache.get(m['sender_id']) or {}).get('name', '某人') for m in messages}
+            await asyncio.to_thread(memory_service.remember, [
+                memory for m in messages
+                for memory in chat_memories(m, rooms_by_id[m['room_id']], names[m['sender_id']])
+            ])
             
             print(f"[Scheduler] Chat room activity task completed.")
+            return len(messages)
             
         except Exception as e:
             print(f"[Scheduler] Chat room activity task failed: {e}")
+            raise
+
+    async def _stream_chat_message(self, message_id: str, room: Dict, speaker: Dict, context: List[Dict]) -> Dict:
+        """Generate a chat reply, publishing its text deltas to the room's SSE subscribers"""
+        topic = room_topic(room['id'])
+        result = None
+        async for chunk in llm_service.astream_chat_message(speaker, context, room.get('scene', '一般对话')):
+            if 'message' in chunk:
+                result = chunk['message']
+            else:
+                event_bus.publish(topic, 'message_delta', None, {
+                    'id': message_id,
+                    'room_id': room['id'],
+                    'sender_id': speaker['id'],
+                    'field': chunk['field'],
+                    'text': chunk['text'],
+                }, ephemeral=True)
+        return result
 
 # Global scheduler instance
 scheduler = AgentCircleScheduler()
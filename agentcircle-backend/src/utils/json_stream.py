@@ -0,0 +1,136 @@
+"""
+Incremental JSON field extraction
+Emits the text of selected top-level string fields while a model's JSON output is still streaming
+"""
+from typing import Iterable, List, Optional, Tuple
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+class JSONFieldExtractor:
+    """
+    Feed raw model output chunk by chunk; get back (field, text, done) tuples
+
+    Only string values of the top-level object are tracked. Text before the
+    opening brace (e.g. a ```json fence) is skipped, escapes are decoded as
+    they complete, and nested values are stepped over. `done` is True on the
+    tuple that closes a field's string.
+    """
+
+    def __init__(self, fields: Optional[Iterable[str]] = None):
+        self.fields = set(fields) if fields is not None else None
+        self.values = {}  # field -> decoded text so far
+        self._state = 'start'
+        self._key = ''
+        self._field: Optional[str] = None
+        self._escape: Optional[str] = None  # pending escape sequence, '' right after a backslash
+        self._depth = 0  # nesting inside a skipped value
+        self._in_string = False  # inside a string within a skipped value
+        self._skip_escape = False
+        self._high_surrogate = 0
+
+    @property
+    def finished(self) -> bool:
+        return self._state == 'end'
+
+    def feed(self, chunk: str) -> List[Tuple[str, str, bool]]:
+        events: List[Tuple[str, str, bool]] = []
+        text = []
+
+        def flush(done: bool = False):
+            if self._field is not None and (text or done):
+                piece = ''.join(text)
+                self.values[self._field] = self.values.get(self._field, '') + piece
+                events.append((self._field, piece, done))
+            text.clear()
+
+        for ch in chunk:
+            state = self._state
+            if state == 'start':
+                if ch == '{':
+                    self._state = 'key'
+            elif state == 'key':
+                if ch == '"':
+                    self._key = ''
+                    self._state = 'key_string'
+                elif ch == '}':
+                    self._state = 'end'
+            elif state == 'key_string':
+                if self._escape is not None:
+                    self._key += _ESCAPES.get(ch, ch)
+                    self._escape = None
+                elif ch == '\\':
+                    self._escape = ''
+                elif ch == '"':
+                    self._state = 'colon'
+                else:
+                    self._key += ch
+            elif state == 'colon':
+                if ch == ':':
+                    self._state = 'value'
+            elif state == 'value':
+                if ch.isspace():
+                    continue
+                if ch == '"':
+                    wanted = self.fields is None or self._key in self.fields
+                    self._field = self._key if wanted else None
+                    self._state = 'string'
+                else:
+                    # Number, literal, object or array: step over it
+                    self._depth = 1 if ch in '{[' else 0
+                    self._in_string = False
+                    self._state = 'skip'
+            elif state == 'string':
+                if self._escape is not None:
+                    self._escape += ch
+                    if self._escape[0] != 'u':
+                        text.append(_ESCAPES.get(ch, ch))
+                        self._escape = None
+                    elif len(self._escape) == 5:
+                        try:
+                            code = int(self._escape[1:], 16)
+                        except ValueError:
+                            code = 0xfffd
+                        if 0xd800 <= code < 0xdc00:
+                            self._high_surrogate = code  # wait for the low half
+                        elif 0xdc00 <= code < 0xe000 and self._high_surrogate:
+                            text.append(chr(0x10000 + ((self._high_surrogate - 0xd800) << 10) + (code - 0xdc00)))
+                            self._high_surrogate = 0
+                        else:
+                            text.append(chr(code))
+                        self._escape = None
+                elif ch == '\\':
+                    self._escape = ''
+                elif ch == '"':
+                    flush(done=True)
+                    self._field = None
+                    self._state = 'after_value'
+                else:
+                    text.append(ch)
+            elif state == 'skip':
+                if self._in_string:
+                    if self._skip_escape:
+                        self._skip_escape = False
+                    elif ch == '\\':
+                        self._skip_escape = True
+                    elif ch == '"':
+                        self._in_string = False
+                elif ch == '"':
+                    self._in_string = True
+                elif ch in '{[':
+                    self._depth += 1
+                elif ch in '}]':
+                    if self._depth == 0:
+                        self._state = 'end'  # scalar ended by the closing brace
+                    else:
+                        self._depth -= 1
+                        if self._depth == 0:
+                            self._state = 'after_value'
+                elif ch == ',' and self._depth == 0:
+                    self._state = 'key'
+            elif state == 'after_value':
+                if ch == ',':
+                    self._state = 'key'
+                elif ch == '}':
+                    self._state = 'end'
+        flush()
+        return events
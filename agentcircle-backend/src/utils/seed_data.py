@@ -3,6 +3,7 @@ Seed data for AgentCircle
 Real historical figures and fictional characters from novels/movies/games
 """
 import json
+import random
 import uuid
 from datetime import datetime
 
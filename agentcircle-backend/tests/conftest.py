@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# Services open their SQLite database on import; keep tests off the real one
+os.environ.setdefault('SQLITE_DB_PATH', os.path.join(tempfile.mkdtemp(prefix='agentcircle-tests-'), 'agentcircle.db'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
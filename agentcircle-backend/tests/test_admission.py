@@ -0,0 +1,21 @@
+import asyncio
+
+from services.admission import AdmissionController, Bulkhead, Overloaded
+
+def test_health_and_metrics_bypass_admission():
+    controller = AdmissionController()
+    assert controller.classify('/api/health') is None
+    assert controller.classify('/metrics') is None
+    assert controller.classify('/api/posts') == 'reads'
+    assert controller.classify('/api/admin/jobs') == 'admin'
+    assert controller.classify('/api/chat/rooms/r1/stream') == 'streaming'
+
+def test_full_bulkhead_sheds():
+    async def scenario():
+        bulkhead = Bulkhead('reads', max_concurrency=1, max_queue=0, queue_timeout=1.0)
+        await bulkhead.acquire()
+        try:
+            await bulkhead.acquire()
+        except Overloaded as e:
+            return e.reason
+    assert asyncio.run(scenario()) == 'queue full'
@@ -0,0 +1,47 @@
+import asyncio
+import uuid
+
+from services.event_bus import event_bus, room_topic
+from services.event_relay import EventRelay
+from services.storage_service import storage
+
+def store_elsewhere(room_id, contents):
+    """Insert messages the way another worker would: stored, but not on this worker's bus"""
+    messages = [{'id': uuid.uuid4().hex, 'room_id': room_id, 'sender_id': 'libai', 'content': content,
+                 'created_at': '2026-01-01T00:00:00'} for content in contents]
+    with storage._transaction():
+        storage._insert_many('chat_messages', messages)
+    return [m['id'] for m in messages]
+
+def test_follower_relays_stored_messages_in_order(monkeypatch):
+    monkeypatch.setattr('services.event_relay.EVENT_RELAY_BATCH', 2)
+    room_id = uuid.uuid4().hex
+
+    async def scenario():
+        sub, _ = event_bus.subscribe(room_topic(room_id))
+        relay = EventRelay()
+        store_elsewhere(room_id, ['before the relay started'])
+        assert relay.poll() == 0  # starts from the end of the table
+        ids = store_elsewhere(room_id, ['一', '二', '三'])
+        assert relay.poll() == 3
+        events = [await sub.get(1) for _ in ids]
+        sub.close()
+        assert [event['id'] for event in events] == ids
+        assert events[0]['data']['content'] == '一'
+        assert await sub.get(0.05) is None
+    asyncio.run(scenario())
+
+def test_leader_and_idle_workers_do_not_relay():
+    relay = EventRelay()
+    relay._is_source = lambda: True
+    assert relay.poll() == 0 and relay.stats()['active'] is False
+
+    async def scenario():
+        sub, _ = event_bus.subscribe(room_topic('r'))
+        relay._is_source = lambda: False
+        relay.poll()
+        sub.close()
+        assert relay.stats()['active']
+        relay.poll()  # no subscribers left
+        assert not relay.stats()['active']
+    asyncio.run(scenario())
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from utils.json_stream import JSONFieldExtractor
+
+OUTPUT = {
+    'title': '将进酒 "君不见"',
+    'metadata': {'mood': '豪放 {不羁}', 'tags': ['酒', '"月"', {'deep': '\\}'}], 'count': 3},
+    'score': 9.5,
+    'content': '君不见黄河之水天上来\\n奔流到海不复回。\t🍶🌕 \\u 末',
+    'flags': [True, None, '}', ']'],
+    'emotion': '豪迈',
+}
+
+def extract(chunks, fields=None):
+    extractor = JSONFieldExtractor(fields)
+    events = [event for chunk in chunks for event in extractor.feed(chunk)]
+    return extractor, events
+
+def splits(text):
+    """Every way of cutting the text into two chunks"""
+    for i in range(len(text) + 1):
+        yield [text[:i], text[i:]]
+
+@pytest.mark.parametrize('ensure_ascii', [False, True])
+def test_values_match_json_for_every_chunk_boundary(ensure_ascii):
+    text = '```json\n' + json.dumps(OUTPUT, ensure_ascii=ensure_ascii, indent=1) + '\n```'
+    for chunks in splits(text):
+        extractor, _ = extract(chunks, ['title', 'content', 'emotion'])
+        assert extractor.values == {k: OUTPUT[k] for k in ('title', 'content', 'emotion')}, chunks
+        assert extractor.finished
+
+def test_one_character_chunks():
+    text = json.dumps(OUTPUT, ensure_ascii=True)
+    extractor, events = extract(list(text))
+    assert extractor.values == {k: v for k, v in OUTPUT.items() if isinstance(v, str)}
+    assert ''.join(piece for field, piece, _ in events if field == 'content') == OUTPUT['content']
+
+def test_surrogate_pair_split_across_chunks():
+    text = json.dumps({'content': '月🌕'}, ensure_ascii=True)  # "月🌕"
+    cut = text.index('\\udf15')
+    for i in range(text.index('\\ud83c'), cut + 6):
+        extractor, _ = extract([text[:i], text[i:]])
+        assert extractor.values['content'] == '月🌕'
+
+def test_nested_values_are_skipped():
+    extractor, events = extract([json.dumps(OUTPUT, ensure_ascii=False)])
+    assert {field for field, _, _ in events} == {'title', 'content', 'emotion'}
+    assert 'mood' not in extractor.values and 'deep' not in extractor.values
+
+def test_done_marks_the_closing_quote():
+    text = json.dumps({'content': 'abcdef', 'emotion': '平静'}, ensure_ascii=False)
+    extractor, events = extract([text[:14], text[14:]])
+    assert [(field, done) for field, _, done in events] == [
+        ('content', False), ('content', True), ('emotion', True)]
+
+def test_unwanted_string_fields_are_not_emitted():
+    _, events = extract([json.dumps(OUTPUT, ensure_ascii=False)], ['emotion'])
+    assert events == [('emotion', '豪迈', True)]
+
+def test_trailing_scalar_ends_object():
+    extractor, _ = extract(['{"content": "x", "n": 1', '}'])
+    assert extractor.finished
@@ -0,0 +1,71 @@
+import time
+import asyncio
+import threading
+
+from services.leader_election import LeaderElector
+
+def elector(tmp_path, **kwargs):
+    return LeaderElector(str(tmp_path / 'leases.db'), lease_seconds=30, renew_seconds=0.01, **kwargs)
+
+def test_one_leader_and_handover_on_stop(tmp_path):
+    first, second = elector(tmp_path), elector(tmp_path)
+    events = []
+
+    async def scenario():
+        first.start(lambda: events.append('first elected'), lambda: events.append('first revoked'))
+        await asyncio.sleep(0.05)
+        second.start(lambda: events.append('second elected'), lambda: events.append('second revoked'))
+        await asyncio.sleep(0.05)
+        assert first.is_leader and not second.is_leader
+        await first.stop()
+        await asyncio.sleep(0.05)
+        assert second.is_leader
+        await second.stop()
+    asyncio.run(scenario())
+    assert events == ['first elected', 'first revoked', 'second elected', 'second revoked']
+
+def test_renewal_in_flight_during_stop_does_not_retake_the_lease(tmp_path):
+    leader = elector(tmp_path)
+    leader._try_acquire()
+    renewing, resume = threading.Event(), threading.Event()
+
+    def slow_renewal():
+        renewing.set()
+        resume.wait(5)
+        return leader._try_acquire()
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        leader._task = asyncio.ensure_future(loop.run_in_executor(None, slow_renewal))
+        await loop.run_in_executor(None, renewing.wait, 5)
+        stopping = asyncio.ensure_future(leader.stop())
+        await asyncio.sleep(0.05)
+        resume.set()
+        await stopping
+    asyncio.run(scenario())
+    other = elector(tmp_path)
+    assert other.current_leader() is None
+    assert other._try_acquire()
+
+def test_status_never_touches_the_lease_row(tmp_path):
+    leader, follower = elector(tmp_path), elector(tmp_path)
+    assert leader._try_acquire() and not follower._try_acquire()
+    held, release = threading.Event(), threading.Event()
+
+    def busy():
+        with follower._lock:
+            held.set()
+            release.wait(1)
+
+    thread = threading.Thread(target=busy)
+    thread.start()
+    held.wait(5)
+    # The connection is busy: status() still answers at once, from the last campaign round
+    started = time.monotonic()
+    status = follower.status()
+    assert time.monotonic() - started < 0.5
+    release.set()
+    thread.join()
+    assert not status['is_leader']
+    assert status['leader']['worker_id'] == leader.worker_id
+    assert leader.status()['leader']['worker_id'] == leader.worker_id
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from services import llm_router as router_module
+from services.llm_router import LLMRouter
+
+@pytest.fixture(autouse=True)
+def fast_hedging(monkeypatch):
+    monkeypatch.setattr(router_module, 'LLM_HEDGING_ENABLED', True)
+    monkeypatch.setattr(router_module, 'LLM_HEDGE_MIN_DELAY', 0.01)
+    monkeypatch.setattr(router_module, 'LLM_HEDGE_DEFAULT_DELAY', 0.01)
+
+def make_call(delays, started, cancelled, errors=()):
+    async def call(model):
+        started.append(model)
+        try:
+            await asyncio.sleep(delays[model])
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        if model in errors:
+            raise RuntimeError(model)
+        return f'result of {model}'
+    return call
+
+def test_fast_primary_needs_no_backup():
+    router, started, cancelled = LLMRouter(), [], []
+    call = make_call({'a': 0, 'b': 0}, started, cancelled)
+    assert asyncio.run(router.hedged(['a', 'b'], call)) == ('a', 'result of a')
+    assert started == ['a']
+    assert router.hedges == 0
+
+def test_backup_wins_and_primary_is_cancelled():
+    router, started, cancelled = LLMRouter(), [], []
+    call = make_call({'a': 5, 'b': 0.01}, started, cancelled)
+    assert asyncio.run(router.hedged(['a', 'b'], call)) == ('b', 'result of b')
+    assert started == ['a', 'b']
+    assert cancelled == ['a']
+    assert (router.hedges, router.hedge_wins) == (1, 1)
+
+def test_primary_wins_and_backup_is_cancelled():
+    router, started, cancelled = LLMRouter(), [], []
+    call = make_call({'a': 0.05, 'b': 5}, started, cancelled)
+    assert asyncio.run(router.hedged(['a', 'b'], call)) == ('a', 'result of a')
+    assert cancelled == ['b']
+    assert (router.hedges, router.hedge_wins) == (1, 0)
+
+def test_failed_primary_falls_back_without_waiting():
+    router, started, cancelled = LLMRouter(), [], []
+    call = make_call({'a': 0, 'b': 0}, started, cancelled, errors={'a'})
+    assert asyncio.run(router.hedged(['a', 'b'], call)) == ('b', 'result of b')
+
+def test_both_failing_raises_last_error():
+    router, started, cancelled = LLMRouter(), [], []
+    call = make_call({'a': 0, 'b': 0}, started, cancelled, errors={'a', 'b'})
+    with pytest.raises(RuntimeError):
+        asyncio.run(router.hedged(['a', 'b'], call))
+
+@pytest.mark.parametrize('cancel_after', [0.001, 0.05])
+def test_cancelling_caller_cancels_running_calls(monkeypatch, cancel_after):
+    """Before the hedge delay only the primary runs; after it both do"""
+    monkeypatch.setattr(router_module, 'LLM_HEDGE_DEFAULT_DELAY', 0.02)
+    router, started, cancelled = LLMRouter(), [], []
+    call = make_call({'a': 5, 'b': 5}, started, cancelled)
+
+    async def scenario():
+        caller = asyncio.ensure_future(router.hedged(['a', 'b'], call))
+        await asyncio.sleep(cancel_after)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        await asyncio.sleep(0)
+        # Checked before asyncio.run() cancels leftovers on shutdown
+        assert sorted(cancelled) == sorted(started)
+
+    asyncio.run(scenario())
+    assert started == (['a'] if cancel_after < 0.02 else ['a', 'b'])
+
+def test_record_keeps_failures_out_of_latency_samples():
+    router = LLMRouter()
+    router.record('a', 2.0, error=False)
+    router.record('a', 0.1, error=True)
+    assert router.stats()['models']['a']['samples'] == 1
+    assert router.stats()['models']['a']['error_rate'] == 0.5
+
+def test_cancelled_hedge_loser_is_refunded_and_not_sampled(monkeypatch):
+    from services import llm_service as llm_module
+    from services.llm_service import llm_service
+    from services.rate_limiter import ProviderLimiter
+    from services.structured_output import CHAT_SCHEMA
+
+    class SlowClient:
+        async def post(self, url, headers=None, json=None):
+            await asyncio.sleep(5)
+
+    router, limiter = LLMRouter(), ProviderLimiter('openai', rpm=60, tpm=60000)
+    monkeypatch.setattr(llm_module, 'llm_router', router)
+    monkeypatch.setitem(llm_module.rate_limits, 'openai', limiter)
+    monkeypatch.setattr(llm_service, '_async_client', lambda provider: SlowClient())
+
+    async def scenario():
+        task = asyncio.ensure_future(llm_service._acall_llm('gpt-4o-mini', 'persona', 'hi', CHAT_SCHEMA))
+        await asyncio.sleep(0.05)
+        assert limiter.tokens.level < 60000
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(scenario())
+    assert limiter.tokens.level == pytest.approx(60000)
+    assert 'gpt-4o-mini' not in router.stats()['models']
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from services import memory_service as memory_module
+from services.memory_service import MemoryService, chat_memories
+
+ROOM = {'id': 'room1', 'name': '黄鹤楼', 'participant_ids': ['libai', 'menghaoran']}
+
+def iso(seconds_ago):
+    return (datetime.utcnow() - timedelta(seconds=seconds_ago)).isoformat()
+
+@pytest.fixture
+def stored(monkeypatch):
+    """In-memory stand-in for the memories table"""
+    rows = []
+    monkeypatch.setattr(memory_module, 'MEMORY_ENABLED', True)
+    monkeypatch.setattr(memory_module.storage, 'create_memories', lambda memories: rows.extend(memories) or memories)
+    monkeypatch.setattr(memory_module.storage, 'get_memories',
+                        lambda role_id, limit=1000, fields=None: [m for m in reversed(rows) if m['role_id'] == role_id][:limit])
+    return rows
+
+def said(message_id, content, created_at):
+    return {'id': message_id, 'room_id': 'room1', 'sender_id': 'menghaoran',
+            'content': content, 'created_at': created_at}
+
+def test_recall_needs_a_loaded_index(stored):
+    service = MemoryService()
+    service.remember([{'role_id': 'libai', 'content': '在黄鹤楼送别孟浩然', 'created_at': iso(3600)}])
+    assert service.recall('libai', '黄鹤楼 送别') == []
+    service.load('libai')
+    assert [m['content'] for m in service.recall('libai', '黄鹤楼 送别')] == ['在黄鹤楼送别孟浩然']
+
+def test_context_messages_are_not_recalled(stored):
+    service = MemoryService()
+    service.load('libai')
+    service.remember([{'role_id': 'libai', 'content': '去年在黄鹤楼送别孟浩然，烟花三月下扬州',
+                       'created_at': iso(86400)}])
+    # The room's latest messages, stored and remembered just like the scheduler does
+    context = [said('m1', '还记得黄鹤楼送别那天吗', iso(60)), said('m2', '烟花三月，我下扬州', iso(30))]
+    service.remember([memory for m in context for memory in chat_memories(m, ROOM, '孟浩然')])
+    query = '\n'.join(m['content'] for m in context)
+
+    assert len(service.recall('libai', query, k=5)) == 3
+    by_time = service.recall('libai', query, k=5, before=min(m['created_at'] for m in context))
+    by_text = service.recall('libai', query, k=5, exclude=[m['content'] for m in context])
+    for hits in (by_time, by_text):
+        assert [m['content'] for m in hits] == ['去年在黄鹤楼送别孟浩然，烟花三月下扬州']
+
+def test_exclusion_still_fills_k(stored):
+    service = MemoryService()
+    service.load('libai')
+    service.remember([{'role_id': 'libai', 'content': f'黄鹤楼旧事其{i}', 'created_at': iso(86400 + i)}
+                      for i in range(4)])
+    service.remember([{'role_id': 'libai', 'content': f'在「黄鹤楼」里，孟浩然说：黄鹤楼旧事{i}',
+                       'created_at': iso(10)} for i in range(2)])
+    hits = service.recall('libai', '黄鹤楼旧事', k=3, exclude=['黄鹤楼旧事0', '黄鹤楼旧事1'])
+    assert len(hits) == 3
+    assert all('孟浩然说' not in m['content'] for m in hits)
+
+def test_memories_remembered_during_load_are_kept(stored, monkeypatch):
+    service = MemoryService()
+    service.remember([{'role_id': 'libai', 'content': '登上黄鹤楼远眺', 'created_at': iso(3600)}])
+    read = memory_module.storage.get_memories
+
+    def slow_read(role_id, limit=1000, fields=None):
+        rows = read(role_id, limit, fields)
+        # Arrives after the storage read, before the index is published
+        service.remember([{'role_id': 'libai', 'content': '黄鹤楼上听到笛声'}])
+        return rows
+
+    monkeypatch.setattr(memory_module.storage, 'get_memories', slow_read)
+    service.load('libai')
+    assert service.stats()['indexed_memories'] == 2
+    assert service.recall('libai', '黄鹤楼 笛声', k=1)[0]['content'] == '黄鹤楼上听到笛声'
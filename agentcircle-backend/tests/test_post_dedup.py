@@ -0,0 +1,91 @@
+import random
+
+import numpy as np
+import pytest
+
+from services import post_dedup as dedup_module
+from services.post_dedup import PostDedupIndex, signature
+
+POEM = ('床前明月光，疑是地上霜。举头望明月，低头思故乡。'
+        '春眠不觉晓，处处闻啼鸟。夜来风雨声，花落知多少。'
+        '白日依山尽，黄河入海流。欲穷千里目，更上一层楼。')
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(dedup_module, 'DEDUP_ENABLED', True)
+
+def shingles(text):
+    text = dedup_module._NON_WORD.sub('', text.lower())
+    n = dedup_module.DEDUP_SHINGLE_CHARS
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+def jaccard(a, b):
+    a, b = shingles(a), shingles(b)
+    return len(a & b) / len(a | b)
+
+def estimate(a, b):
+    return float((signature(a) == signature(b)).mean())
+
+def post(post_id, content, author='libai', title='静夜思'):
+    return {'id': post_id, 'author_id': author, 'title': title, 'content': content}
+
+def test_signature_ignores_punctuation_and_case():
+    assert np.array_equal(signature('Hello, World!'), signature('hello world'))
+    assert signature('，。！') is None
+
+def test_minhash_estimates_jaccard():
+    rng = random.Random(7)
+    chars = list(POEM)
+    for edits in (1, 5, 20, 60):
+        edited = chars[:]
+        for i in rng.sample(range(len(edited)), edits):
+            edited[i] = '鹅'
+        edited = ''.join(edited)
+        assert abs(estimate(POEM, edited) - jaccard(POEM, edited)) < 0.2
+
+@pytest.mark.parametrize('other, duplicate', [
+    (POEM, True),
+    (POEM.replace('故乡', '故里'), True),
+    (POEM + '——李白', True),
+    (POEM[:48], False),
+    ('朝辞白帝彩云间，千里江陵一日还。两岸猿声啼不住，轻舟已过万重山。', False),
+])
+def test_duplicate_threshold(other, duplicate):
+    index = PostDedupIndex(window=16)
+    assert index.check_and_add(post('p1', POEM)) is None
+    match = index.check_and_add(post('p2', other))
+    assert (match is not None) == duplicate
+    assert (jaccard(POEM, other) >= dedup_module.DEDUP_SIMILARITY_THRESHOLD) == duplicate
+    if duplicate:
+        assert match['post_id'] == 'p1'
+
+def test_window_evicts_oldest():
+    index = PostDedupIndex(window=2)
+    index.check_and_add(post('p1', POEM))
+    index.check_and_add(post('p2', '朝辞白帝彩云间，千里江陵一日还。'))
+    index.check_and_add(post('p3', '两岸猿声啼不住，轻舟已过万重山。'))
+    assert index.check_and_add(post('p4', POEM)) is None
+
+def test_discard_rolls_back_unstored_posts():
+    index = PostDedupIndex(window=16)
+    index.check_and_add(post('p1', POEM), topic='月亮')
+    assert index.recent_topics('libai', []) == {'月亮'}
+    index.discard(['p1'])
+    assert index.check_and_add(post('p2', POEM), topic='故乡') is None
+    assert index.recent_topics('libai', []) == {'故乡'}
+    assert index.stats()['indexed_posts'] == 1
+
+def test_load_seeds_window_once(monkeypatch):
+    stored = [post('p2', '朝辞白帝彩云间，千里江陵一日还。'), post('p1', POEM)]
+    calls = []
+    def get_posts(**kwargs):
+        calls.append(kwargs)
+        return stored
+    monkeypatch.setattr(dedup_module.storage, 'get_posts', get_posts)
+    index = PostDedupIndex(window=16)
+    index.check_and_add(post('p2', '朝辞白帝彩云间，千里江陵一日还。'))
+    index.load()
+    index.load()
+    assert len(calls) == 1
+    assert index.stats()['indexed_posts'] == 2
+    assert index.check_and_add(post('p3', POEM))['post_id'] == 'p1'
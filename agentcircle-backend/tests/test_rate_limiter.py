@@ -0,0 +1,80 @@
+import time
+
+import httpx
+import pytest
+import requests
+
+from services import rate_limiter as limiter_module
+from services.rate_limiter import ProviderLimiter, TokenBucket, retry_budget
+
+def status_error(status, headers=None):
+    request = httpx.Request('POST', 'https://api.example.com/v1/chat')
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return httpx.HTTPStatusError(f'{status}', request=request, response=response)
+
+@pytest.fixture(autouse=True)
+def backoff(monkeypatch):
+    monkeypatch.setattr(limiter_module, 'LLM_MAX_RETRIES', 4)
+    monkeypatch.setattr(limiter_module, 'LLM_BACKOFF_BASE', 1.0)
+    monkeypatch.setattr(limiter_module, 'LLM_BACKOFF_MAX', 30.0)
+    monkeypatch.setattr(limiter_module, 'record_llm_retry', lambda provider, reason: None)
+
+@pytest.mark.parametrize('attempt', range(4))
+def test_jitter_stays_within_exponential_bound(attempt):
+    limiter = ProviderLimiter('openai', rpm=0, tpm=0)
+    ceiling = min(30.0, 2 ** attempt)
+    delays = [limiter.retry_delay(status_error(503), attempt) for _ in range(300)]
+    assert all(0.0 <= delay <= ceiling for delay in delays)
+    # Full jitter spreads over the whole range rather than clustering at the ceiling
+    assert min(delays) < ceiling * 0.2 and max(delays) > ceiling * 0.8
+
+def test_backoff_is_capped(monkeypatch):
+    monkeypatch.setattr(limiter_module, 'LLM_MAX_RETRIES', 20)
+    limiter = ProviderLimiter('openai', rpm=0, tpm=0)
+    assert all(limiter.retry_delay(status_error(503), 15) <= 30.0 for _ in range(100))
+
+def test_429_pauses_the_provider(monkeypatch):
+    monkeypatch.setattr(limiter_module.random, 'uniform', lambda low, high: 0.0)
+    limiter = ProviderLimiter('anthropic', rpm=0, tpm=0)
+    delay = limiter.retry_delay(status_error(429, {'retry-after': '2'}), 0)
+    assert delay == 2.0
+    assert limiter.paused_until - time.monotonic() == pytest.approx(2.0, abs=0.1)
+    # Every caller waits out the pause, not just the one that got the 429
+    assert limiter._reserve(1) == pytest.approx(2.0, abs=0.1)
+    assert limiter.stats()['paused_for'] == pytest.approx(2.0, abs=0.1)
+
+def test_other_retryable_errors_do_not_pause():
+    limiter = ProviderLimiter('anthropic', rpm=0, tpm=0)
+    assert limiter.retry_delay(status_error(503, {'retry-after': '2'}), 0) >= 2.0
+    assert limiter.paused_until == 0.0
+    assert limiter._reserve(1) == 0.0
+
+def test_retry_after_is_capped(monkeypatch):
+    monkeypatch.setattr(limiter_module, 'LLM_BACKOFF_MAX', 5.0)
+    limiter = ProviderLimiter('gemini', rpm=0, tpm=0)
+    assert limiter.retry_delay(status_error(429, {'retry-after': '600'}), 0) == 5.0
+
+def test_gives_up_on_client_errors_and_after_max_retries():
+    limiter = ProviderLimiter('openai', rpm=0, tpm=0)
+    assert limiter.retry_delay(status_error(400), 0) is None
+    assert limiter.retry_delay(ValueError('bad output'), 0) is None
+    assert limiter.retry_delay(status_error(503), 4) is None
+    assert limiter.retry_delay(requests.ConnectionError('reset'), 0) is not None
+    assert limiter.retries == 1
+
+def test_job_retry_budget_is_shared():
+    limiter = ProviderLimiter('openai', rpm=0, tpm=0)
+    with retry_budget(2) as budget:
+        assert limiter.retry_delay(status_error(503), 0) is not None
+        assert limiter.retry_delay(status_error(429), 0) is not None
+        assert limiter.retry_delay(status_error(503), 0) is None
+    assert budget.used == 2
+    assert limiter.retry_delay(status_error(503), 0) is not None
+
+def test_token_bucket_reservation_goes_negative():
+    bucket = TokenBucket(60)
+    now = bucket._updated
+    assert bucket.reserve(60, now) == 0.0
+    assert bucket.reserve(3, now) == pytest.approx(3.0)
+    bucket.adjust(3, now)
+    assert bucket.reserve(0, now) == 0.0
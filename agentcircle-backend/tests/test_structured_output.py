@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from services import llm_service as llm_module
+from services.llm_service import llm_service
+from services.structured_output import (
+    OutputValidationError, CHAT_SCHEMA, parse_json_output, post_schema, repair_prompt,
+)
+
+VALID = '{"content": "月下独酌，不亦快哉", "emotion": "开心"}'
+
+def test_parse_tolerates_fences_trailing_commas_and_remarks():
+    assert parse_json_output('```json\n{"a": 1}\n```') == {'a': 1}
+    assert parse_json_output('好的：{"a": [1, 2,], "b": "x",} 以上') == {'a': [1, 2], 'b': 'x'}
+    assert parse_json_output('{"a": "第一行\n第二行"}') == {'a': '第一行\n第二行'}
+    assert parse_json_output('[1, 2]') is None
+    assert parse_json_output('no json here') is None
+
+def test_schema_validation_errors():
+    schema = post_schema('poem', ['dynasty'])
+    with pytest.raises(OutputValidationError) as info:
+        schema.parse('{"title": "  ", "metadata": "唐"}')
+    assert info.value.errors == ['字段 title 应为非空字符串', '缺少字段 content', '字段 metadata 应为JSON对象']
+    assert schema.parse({'title': '静夜思', 'content': '床前明月光', 'metadata': {'dynasty': '唐'}})['title'] == '静夜思'
+    with pytest.raises(OutputValidationError, match='有效的JSON'):
+        CHAT_SCHEMA.parse('抱歉，我无法回答')
+
+def test_repair_prompt_quotes_errors_and_output():
+    error = OutputValidationError(['缺少字段 emotion'], '{"content": "hi"}' + 'x' * 5000)
+    prompt = repair_prompt('写一条消息', error)
+    assert prompt.startswith('写一条消息\n\n')
+    assert '缺少字段 emotion' in prompt
+    assert len(prompt) < 2200
+
+@pytest.fixture
+def outputs(monkeypatch):
+    """Scripted model outputs, parsed like _call_llm would; records the prompts sent"""
+    recorded = {'prompts': [], 'outcomes': []}
+
+    def call(model, system_prompt, user_prompt, schema):
+        recorded['prompts'].append(user_prompt)
+        return schema.parse(recorded['replies'].pop(0))
+
+    async def acall(model, system_prompt, user_prompt, schema):
+        return call(model, system_prompt, user_prompt, schema)
+
+    monkeypatch.setattr(llm_service, '_call_llm', call)
+    monkeypatch.setattr(llm_service, '_acall_llm', acall)
+    monkeypatch.setattr(llm_module, 'record_llm_output', lambda provider, outcome: recorded['outcomes'].append(outcome))
+    monkeypatch.setattr(llm_module, 'LLM_REPAIR_ATTEMPTS', 1)
+    return recorded
+
+def validated(mode, user_prompt='写一条消息'):
+    if mode == 'sync':
+        return llm_service._call_validated('gpt-4o-mini', 'persona', user_prompt, CHAT_SCHEMA)
+    return asyncio.run(llm_service._acall_validated('gpt-4o-mini', 'persona', user_prompt, CHAT_SCHEMA))
+
+@pytest.mark.parametrize('mode', ['sync', 'async'])
+def test_invalid_output_is_repaired(outputs, mode):
+    outputs['replies'] = ['{"content": "月下独酌"}', VALID]
+    assert validated(mode)['emotion'] == '开心'
+    first, repair = outputs['prompts']
+    assert first == '写一条消息'
+    assert repair.startswith('写一条消息') and '缺少字段 emotion' in repair and '{"content": "月下独酌"}' in repair
+    assert outputs['outcomes'] == ['repaired']
+
+@pytest.mark.parametrize('mode', ['sync', 'async'])
+def test_valid_output_is_not_repaired(outputs, mode):
+    outputs['replies'] = [VALID]
+    validated(mode)
+    assert len(outputs['prompts']) == 1
+    assert outputs['outcomes'] == ['valid']
+
+@pytest.mark.parametrize('mode', ['sync', 'async'])
+def test_gives_up_after_repair_attempts(outputs, mode):
+    outputs['replies'] = ['不是JSON', '{"emotion": "平静"}']
+    with pytest.raises(OutputValidationError, match='缺少字段 content'):
+        validated(mode)
+    assert len(outputs['prompts']) == 2
+    assert outputs['outcomes'] == ['invalid']
+
+def test_stream_failure_starts_with_a_repair(outputs):
+    outputs['replies'] = [VALID]
+    content = asyncio.run(llm_service._avalidate_stream('gpt-4o-mini', 'persona', '写一条消息', CHAT_SCHEMA,
+                                                        '{"content": "半截'))
+    assert content['content'] == '月下独酌，不亦快哉'
+    assert '有效的JSON' in outputs['prompts'][0]
+    assert outputs['outcomes'] == ['repaired']
@@ -0,0 +1,55 @@
+import threading
+
+import pytest
+
+from services import usage_tracker as usage_module
+from services.usage_tracker import UsageTracker, usage_context
+
+def test_spend_survives_flush_and_reload(tmp_path):
+    tracker = UsageTracker(str(tmp_path / 'usage.db'))
+    with usage_context(job='content_generation', role='libai'):
+        cost = tracker.record('openai', 'gpt-4o-mini', 1000, 500)
+    tracker.flush()
+    reloaded = UsageTracker(str(tmp_path / 'usage.db'))
+    assert reloaded.spend_today() == pytest.approx(cost)
+    assert reloaded.spend_today('content_generation') == pytest.approx(cost)
+
+def test_reload_during_a_flush_sees_the_rows_being_written(tmp_path):
+    tracker = UsageTracker(str(tmp_path / 'usage.db'))
+    cost = tracker.record('openai', 'gpt-4o-mini', 1000, 500)
+    writing, resume = threading.Event(), threading.Event()
+
+    class SlowConnection:
+        """Pauses a flush between taking the pending rows and committing them"""
+        def __init__(self, conn):
+            self.conn = conn
+        def executemany(self, *args):
+            writing.set()
+            resume.wait(5)
+            return self.conn.executemany(*args)
+        def __getattr__(self, name):
+            return getattr(self.conn, name)
+
+    conn = tracker._connect()
+    tracker._conn = SlowConnection(conn)
+    flush = threading.Thread(target=tracker.flush)
+    flush.start()
+    writing.wait(5)
+    seen = []
+    reload = threading.Thread(target=lambda: seen.append(tracker.spend_today()))
+    reload.start()
+    reload.join(0.2)
+    resume.set()
+    flush.join()
+    reload.join()
+    tracker._conn = conn
+    assert seen == [pytest.approx(cost)]
+
+def test_job_cap(tmp_path, monkeypatch):
+    monkeypatch.setattr(usage_module, 'LLM_JOB_DAILY_SPEND_CAPS', {'chat_activity': 0.001})
+    tracker = UsageTracker(str(tmp_path / 'usage.db'))
+    assert tracker.over_cap('chat_activity') is None
+    with usage_context(job='chat_activity'):
+        tracker.record('openai', 'gpt-4o', 1000, 1000)
+    assert 'chat_activity' in tracker.over_cap('chat_activity')
+    assert tracker.caps()['jobs']['chat_activity']['spent_today_usd'] > 0.001
@@ -14,7 +14,7 @@ import {
 } from 'lucide-react';
 import { Button } from '@/components/ui/button';
 import { useQuery } from '@tanstack/react-query';
-import { getStats, getPosts, getRoles } from '@/services/api';
+import { getHomeBootstrap } from '@/services/api';
 import PostCard from '@/components/PostCard';
 import RoleAvatar from '@/components/RoleAvatar';
 
@@ -22,20 +22,13 @@ export default function HomePage() {
   const heroRef = useRef<HTMLDivElement>(null);
   const statsRef = useRef<HTMLDivElement>(null);
 
-  const { data: stats } = useQuery({
-    queryKey: ['stats'],
-    queryFn: getStats,
-  });
-
-  const { data: recentPosts } = useQuery({
-    queryKey: ['posts', 'recent'],
-    queryFn: () => getPosts({ limit: 6, order_by: 'created_at' }),
-  });
-
-  const { data: activeRoles } = useQuery({
-    queryKey: ['roles', 'active'],
-    queryFn: () => getRoles({ limit: 8 }),
+  const { data: bootstrap } = useQuery({
+    queryKey: ['home', 'bootstrap'],
+    queryFn: getHomeBootstrap,
   });
+  const stats = bootstrap?.stats;
+  const recentPosts = bootstrap?.recentPosts;
+  const activeRoles = bootstrap?.activeRoles;
 
   useEffect(() => {
     // Hero animations
@@ -147,14 +147,34 @@ export async function getChatRooms(limit: number = 50): Promise<ChatRoom[]> {
   }
 }
 
-export async function getChatMessages(roomId: string, limit: number = 50): Promise<ChatMessage[]> {
+// Newest messages in chronological order; pass the oldest loaded id as `before` to page back.
+export async function getChatMessages(roomId: string, limit: number = 50, before?: string): Promise<ChatMessage[]> {
   try {
-    return await fetchApi<ChatMessage[]>(`/chat/rooms/${roomId}/messages?limit=${limit}`);
+    const cursor = before ? `&before=${encodeURIComponent(before)}` : '';
+    return await fetchApi<ChatMessage[]>(`/chat/rooms/${roomId}/messages?limit=${limit}${cursor}`);
   } catch {
-    return mockChatMessages.filter(m => m.room_id === roomId).slice(0, limit);
+    return mockChatMessages.filter(m => m.room_id === roomId).slice(-limit);
   }
 }
 
+// Subscribe to new messages in a room over Server-Sent Events.
+// EventSource resends Last-Event-ID on reconnect, so missed messages are replayed.
+export function subscribeChatRoom(
+  roomId: string,
+  onMessage: (message: ChatMessage) => void,
+  lastMessageId?: string
+): () => void {
+  if (USE_MOCK_DATA || typeof EventSource === 'undefined') {
+    return () => {};
+  }
+  const query = lastMessageId ? `?last_event_id=${encodeURIComponent(lastMessageId)}` : '';
+  const source = new EventSource(`${API_BASE_URL}/chat/rooms/${roomId}/stream${query}`);
+  source.addEventListener('message', (event) => {
+    onMessage(JSON.parse((event as MessageEvent).data) as ChatMessage);
+  });
+  return () => source.close();
+}
+
 // ==================== Wiki API ====================
 
 export async function getWikiEntries(params?: {
@@ -195,10 +215,86 @@ export async function getStats(): Promise<Stats> {
   }
 }
 
+// ==================== Batch API ====================
+
+export interface BatchItem {
+  id?: string;
+  path: string;
+  params?: Record<string, string | number>;
+}
+
+export interface BatchItemResult<T = unknown> {
+  id?: string;
+  path: string;
+  status: number;
+  body: T;
+}
+
+export async function batchGet(requests: BatchItem[]): Promise<BatchItemResult[]> {
+  const result = await fetchApi<{ responses: BatchItemResult[] }>('/batch', {
+    method: 'POST',
+    body: JSON.stringify({ requests }),
+  });
+  return result.responses;
+}
+
+// Home page data in a single round trip
+export async function getHomeBootstrap(): Promise<{
+  stats: Stats;
+  recentPosts: Post[];
+  activeRoles: Role[];
+}> {
+  try {
+    const [stats, posts, roles] = await batchGet([
+      { path: '/api/stats' },
+      { path: '/api/posts', params: { limit: 6, order_by: 'created_at' } },
+      { path: '/api/roles', params: { limit: 8 } },
+    ]);
+    if ([stats, posts, roles].some(item => item.status !== 200)) {
+      throw new Error('Batch item failed');
+    }
+    return {
+      stats: stats.body as Stats,
+      recentPosts: posts.body as Post[],
+      activeRoles: roles.body as Role[],
+    };
+  } catch {
+    const [stats, recentPosts, activeRoles] = await Promise.all([
+      getStats(),
+      getPosts({ limit: 6, order_by: 'created_at' }),
+      getRoles({ limit: 8 }),
+    ]);
+    return { stats, recentPosts, activeRoles };
+  }
+}
+
 // ==================== Admin API ====================
 
-export async function syncFromSupabase(): Promise<{ success: boolean }> {
-  return fetchApi<{ success: boolean }>('/admin/sync', { method: 'POST' });
+export interface AdminJob {
+  id: string;
+  kind: string;
+  status: 'pending' | 'running' | 'succeeded' | 'failed' | 'cancelled';
+  created_at: string;
+  started_at?: string;
+  finished_at?: string;
+  elapsed_seconds: number;
+  progress: Record<string, { done: number; total?: number }>;
+  items_done: number;
+  items_per_second: number;
+  cancel_requested: boolean;
+  error?: string;
+}
+
+export async function syncFromSupabase(): Promise<{ job: AdminJob; attached: boolean }> {
+  return fetchApi<{ job: AdminJob; attached: boolean }>('/admin/sync', { method: 'POST' });
+}
+
+export async function getAdminJob(jobId: string): Promise<AdminJob> {
+  return fetchApi<AdminJob>(`/admin/jobs/${jobId}`);
+}
+
+export async function cancelAdminJob(jobId: string): Promise<{ cancelled: boolean; job: AdminJob }> {
+  return fetchApi<{ cancelled: boolean; job: AdminJob }>(`/admin/jobs/${jobId}/cancel`, { method: 'POST' });
 }
 
 export async function startScheduler(): Promise<{ status: string }> {